@@ -20,6 +20,7 @@ from tinytag import TinyTag
 
 # ================= Configuration Area =================
 from global_config.config import yaml_config_boxed
+from global_config.db_pool import configure_pool, pooled_connection
 from file_scanner.mount_path_utils import MountPathUtil
 
 CONFIG_FILE = os.path.expanduser("~/exif_extractor_config.json")
@@ -158,8 +159,11 @@ def audio_id3_metadata(fp, EXTRACT_APIC=False):
                 and not key.startswith('_') and not callable(getattr(tag, key))
                 }
 
+configure_pool(**(yaml_config_boxed.transcribe.get('db_pool') or {}))
+
 def db_connect():
-    return psycopg2.connect(yaml_config_boxed.transcribe.db_conn)
+    """Borrow a pooled connection, use it as `with db_connect() as conn`"""
+    return pooled_connection(yaml_config_boxed.transcribe.db_conn)
 
 def execute_sql(sql, params=None, fetch=False, commit=False, dry_run=False, debug_mode=False):
     """Execute SQL, supports dry_run mode"""
@@ -171,11 +175,10 @@ def execute_sql(sql, params=None, fetch=False, commit=False, dry_run=False, debu
     with db_connect() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute(sql, params)
+            rows = cur.fetchall() if fetch else None
             if commit:
                 conn.commit()
-            if fetch:
-                return cur.fetchall()
-    return None
+    return rows
 
 def clean_json_str(raw):
     """Clean JSON string from stdout, remove \\u0000"""
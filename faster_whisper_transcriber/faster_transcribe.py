@@ -1,6 +1,7 @@
 import os
 from datetime import datetime
 from dataclasses import dataclass
+from functools import lru_cache
 
 import torch
 from faster_whisper import WhisperModel
@@ -81,32 +82,7 @@ class WhisperTranscriber:
         cur_logger.info('transcribe: pid=%s, ppid=%s, file_path=%s'%(os.getpid(), os.getppid(), file_path))
         
         if self.selected_model_path.endswith("@remote_fast_api"):
-            import requests
-
-            from global_config.config import yaml_config_boxed
-            remote_fast_api = yaml_config_boxed.transcribe.remote_fast_api
-            url = f"http://{remote_fast_api}/transcribe"
-            cur_logger.info(f"Sending request to remote FastAPI server at {url}")
-
-            with open(file_path, "rb") as f:
-                files = {"file": (Path(file_path).name, f)}
-                data = {
-                    "whisper_model_alias": self.selected_model_path.replace("@remote_fast_api", ""),
-                    "whisper_beam_size": beam_size,
-                }
-                response = requests.post(url, files=files, data=data)
-
-            if response.status_code == 200:
-                result = response.json()
-                if "error" in result:
-                    raise Exception(f"Error from remote server: {result['error']}")
-                segments = result.get("segments", [])
-                segments = [SimpleNamespace(**seg) for seg in segments]
-                info = result.get("info", {})
-                info = SimpleNamespace(**info)
-                cur_logger.info(f"Received response from remote server: info={info}")
-            else:
-                raise Exception(f"Failed to get response from remote server, status code: {response.status_code}, detail: {response.text}")
+            segments, info = self._transcribe_remote(file_path, beam_size)
         elif self.is_macos():
             import mlx_whisper
             # NOTE: beam_size, vad_filter are omitted, not yet implemented
@@ -136,13 +112,90 @@ class WhisperTranscriber:
                                 , vad_filter=vad_filter)
         return segments, info
 
-    def start_transcribe(self, file_path:str, file_format:str="srt", not_write_file:bool=True, multilingual=True, language:str=None, temperature=(0.0, 0.2, 0.4)):
+    def _transcribe_remote(self, file_path:str, beam_size:int):
         '''
-            language: "zh", "en" or None
+            streams segments from /transcribe_stream (NDJSON) as the server decodes them,
+            servers without that endpoint fall back to /transcribe which returns the whole transcript at once
+        '''
+        import requests
+
+        from global_config.config import yaml_config_boxed
+        remote_fast_api = yaml_config_boxed.transcribe.remote_fast_api
+        url = f"http://{remote_fast_api}/transcribe_stream"
+        cur_logger.info(f"Sending request to remote FastAPI server at {url}")
+
+        with open(file_path, "rb") as f:
+            files = {"file": (Path(file_path).name, f)}
+            data = {
+                "whisper_model_alias": self.selected_model_path.replace("@remote_fast_api", ""),
+                "whisper_beam_size": beam_size,
+            }
+            response = requests.post(url, files=files, data=data, stream=True)
+
+        if response.status_code == 404:
+            response.close()
+            return self._transcribe_remote_all(file_path, beam_size)
+        if response.status_code != 200:
+            detail = response.text
+            response.close()
+            raise Exception(f"Failed to get response from remote server, status code: {response.status_code}, detail: {detail}")
+
+        messages = (json.loads(line) for line in response.iter_lines() if line)
+        first = next(messages, None)
+        if first is None or "error" in first:
+            response.close()
+            raise Exception(f"Error from remote server: {first['error'] if first else 'empty response'}")
+        info = SimpleNamespace(**first["info"])
+        cur_logger.info(f"Received response from remote server: info={info}")
+
+        def segments():
+            try:
+                for message in messages:
+                    if "error" in message:
+                        raise Exception(f"Error from remote server: {message['error']}")
+                    if "segment" in message:
+                        yield SimpleNamespace(**message["segment"])
+            finally:
+                response.close()
+
+        return segments(), info
+
+    def _transcribe_remote_all(self, file_path:str, beam_size:int):
+        '''
+            the whole transcript in one JSON response
+        '''
+        import requests
+
+        from global_config.config import yaml_config_boxed
+        remote_fast_api = yaml_config_boxed.transcribe.remote_fast_api
+        url = f"http://{remote_fast_api}/transcribe"
+        cur_logger.info(f"Sending request to remote FastAPI server at {url}")
+
+        with open(file_path, "rb") as f:
+            files = {"file": (Path(file_path).name, f)}
+            data = {
+                "whisper_model_alias": self.selected_model_path.replace("@remote_fast_api", ""),
+                "whisper_beam_size": beam_size,
+            }
+            response = requests.post(url, files=files, data=data)
+
+        if response.status_code == 200:
+            result = response.json()
+            if "error" in result:
+                raise Exception(f"Error from remote server: {result['error']}")
+            segments = result.get("segments", [])
+            segments = [SimpleNamespace(**seg) for seg in segments]
+            info = result.get("info", {})
+            info = SimpleNamespace(**info)
+            cur_logger.info(f"Received response from remote server: info={info}")
+        else:
+            raise Exception(f"Failed to get response from remote server, status code: {response.status_code}, detail: {response.text}")
+        return segments, info
+
+    def _prepare_input(self, file_path:str)->str:
+        '''
+            VOB files are converted to a 16k mono WAV first, returns the path to transcribe
         '''
-        
-        cur_logger.info('transcribe: pid=%s, ppid=%s, file_path=%s'%(os.getpid(), os.getppid(), file_path))
-        
         # 检查是否为VOB文件
         if file_path.lower().endswith('.vob'):
             cur_logger.info(f'VOB file detected: {file_path}')
@@ -175,67 +228,61 @@ class WhisperTranscriber:
                 logger.error(f'Error during VOB conversion: {str(e)}')
                 raise Exception(f'VOB conversion failed for file {file_path}: {str(e)}')
         
+        return file_path
+
+    def stream_transcribe(self, file_path:str, file_format:str="srt", multilingual=True, language:str=None):
+        '''
+            yields the srt/txt lines as the decoder produces segments, followed by the footer lines,
+            so a multi-hour file never holds its whole transcript in memory
+        '''
+        cur_logger.info('transcribe: pid=%s, ppid=%s, file_path=%s'%(os.getpid(), os.getppid(), file_path))
+        file_path = self._prepare_input(file_path)
         segments, info = self.transcribe(file_path=file_path, beam_size=5, language=language if not multilingual else None, vad_filter=True)
 
         start = datetime.now()
+        row_num=1
+        for segment in segments:
+            if row_num==1:
+                cur_logger.info(f'type(segment): {type(segment)}, segment: {segment}, info: {info}, type(info): {type(info)}')
+
+            if file_format=='txt':
+                line = self.create_txt_line(row_num, segment)
+
+            if file_format=='srt':
+                line = self.create_srt_line(row_num, segment)
+
+            cur_logger.info(line)
+            yield line
+            row_num+=1
+
+        ending = datetime.now()
+        elapse_seconds = (ending-start).seconds
+        yield "\n\n\n"
+        yield "selected_model_path: %s\n"%(self.selected_model_path)
+        yield "start: %s, end: %s\n"%(start, ending)
+        yield "elapse_seconds: %s\n"%elapse_seconds
+
+    def start_transcribe(self, file_path:str, file_format:str="srt", not_write_file:bool=True, multilingual=True, language:str=None, temperature=(0.0, 0.2, 0.4)):
+        '''
+            language: "zh", "en" or None
+            not_write_file: returns the transcript as one string, otherwise writes it line by line next to the file
+        '''
+        lines = self.stream_transcribe(file_path, file_format=file_format, multilingual=multilingual, language=language)
         if not_write_file:
-            lines=[]
-            row_num=1
-            for segment in segments:
-                if row_num==1:
-                    print(f'type(segments): {type(segments)}, type(segments[0]):{type(segment if segments else "No segments")}, segments[0]:{segment if segments else "No segments data"}, info: {info}, type(info): {type(info)}')
-                    
-                if file_format=='txt':
-                    line = self.create_txt_line(row_num, segment)
-                    
-                if file_format=='srt':
-                    line = self.create_srt_line(row_num, segment)
-                    
-                lines.append(line)
-                # if row_num % 50 ==0:
-                #     srt_out.flush()
-                cur_logger.info(line)
-                row_num+=1
-
-                ending = datetime.now()
-                elapse_seconds = (ending-start).seconds
-                # srt_out.write("selected_model_path: %s"%(selected_model_path),ending='\n')
-                lines.append("\n\n\n")
-                lines.append("selected_model_path: %s\n"%(self.selected_model_path))
-                lines.append("start: %s, end: %s\n"%(start, ending))
-                lines.append("elapse_seconds: %s\n"%elapse_seconds)
             return ''.join(lines)
-        else:
-            only_file_name = os.path.splitext(os.path.basename(file_path))[0]
-
-            file_name_suffix= "_srt.txt" if file_format=='txt' else ".srt"
-
-            output_srt_file_path= os.path.join( os.path.dirname(file_path),only_file_name+"_"+start.strftime("%H_%M_%S")+file_name_suffix)
-            cur_logger.info('output_srt_file_path: %s'%(output_srt_file_path))
-            with open(output_srt_file_path,'w') as srt_out:
-                row_num=1
-                for segment in segments:
-                    if file_format=='txt':
-                        line = self.create_txt_line(row_num, segment)
-                        
-                    if file_format=='srt':
-                        line = self.create_srt_line(row_num, segment)
-                        
-                    srt_out.write(line)
-                    # if row_num % 50 ==0:
-                    #     srt_out.flush()
-                    cur_logger.info(line)
-                    row_num+=1
-
-                ending = datetime.now()
-                elapse_seconds = (ending-start).seconds
-                # srt_out.write("selected_model_path: %s"%(selected_model_path),ending='\n')
-                srt_out.write("\n\n\n")
-                srt_out.write("selected_model_path: %s\n"%(self.selected_model_path))
-                srt_out.write("start: %s, end: %s\n"%(start, ending))
-                srt_out.write("elapse_seconds: %s\n"%elapse_seconds)
-        
-            return output_srt_file_path
+
+        start = datetime.now()
+        only_file_name = os.path.splitext(os.path.basename(file_path))[0]
+
+        file_name_suffix= "_srt.txt" if file_format=='txt' else ".srt"
+
+        output_srt_file_path= os.path.join( os.path.dirname(file_path),only_file_name+"_"+start.strftime("%H_%M_%S")+file_name_suffix)
+        cur_logger.info('output_srt_file_path: %s'%(output_srt_file_path))
+        with open(output_srt_file_path,'w') as srt_out:
+            for line in lines:
+                srt_out.write(line)
+
+        return output_srt_file_path
 
 
     def create_txt_line(self, row_num:int, segment)->str:
@@ -272,6 +319,15 @@ class WhisperTranscriber:
                 , segment.text
             )
 
+@lru_cache(maxsize=2)
+def get_transcriber(model:str, disable_mlx_whisper:bool=False, cpu_threads:int=4, num_workers:int=1) -> WhisperTranscriber:
+    '''
+    one WhisperTranscriber per model and process: the model is loaded by the first call and stays resident,
+    so long-lived workers (process pool, api server) only pay the load once instead of once per file
+    '''
+    cur_logger.info(f'load transcriber: model={model}, pid={os.getpid()}')
+    return WhisperTranscriber(model, disable_mlx_whisper, cpu_threads=cpu_threads, num_workers=num_workers)
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Transcribe audio or video files')
     parser.add_argument('files', metavar='FILE', nargs='+', help='File paths to transcribe')
@@ -299,7 +355,9 @@ if __name__ == '__main__':
 
         if transcriber is None:
             transcriber = WhisperTranscriber(model_name, disable_mlx_whisper)
-        srt = transcriber.start_transcribe(file_path=file_path)
 
+        # written as the segments come out of the decoder
         with open(srt_file_path,'w') as srt_file:
-            srt_file.write(srt)
+            for line in transcriber.stream_transcribe(file_path=file_path):
+                srt_file.write(line)
+                srt_file.flush()
@@ -16,6 +16,70 @@ cur_logger = get_logger(os.path.basename(__file__))
 # logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 # logger = logging.getLogger(__name__)
 
+def probe_media(file_path: str, timeout: int = 30) -> dict:
+    """
+    一次 ffprobe 读取全部流和时长, 结果可按 md5 缓存到 media_probe 表
+
+    Returns:
+        dict: check_audio_stream 的字段, 另外有
+            {
+                'streams': list,             # 全部流 (index, codec_type, codec_name, ...)
+                'duration': float or None,   # 时长 (秒)
+                'format_name': str or None,
+                'audio_codec': str or None,  # 第一个音频流的编解码器
+                'video_codec': str or None,  # 第一个视频流的编解码器
+            }
+        error 为 None 时结果才可缓存, 超时和 ffprobe 失败都不缓存, 下次重新检测
+    """
+    result = {'has_audio': False, 'audio_streams': [], 'streams': [], 'duration': None,
+              'format_name': None, 'audio_codec': None, 'video_codec': None, 'error': None}
+    cmd = [
+        "ffprobe",
+        "-v", "error",
+        "-show_entries", "format=duration,format_name:stream=index,codec_type,codec_name,channels,sample_rate,width,height",
+        "-of", "json",
+        file_path
+    ]
+    try:
+        completed = subprocess.run(cmd, capture_output=True, text=True, check=True, timeout=timeout)
+        probe_data = json.loads(completed.stdout)
+    except subprocess.CalledProcessError as e:
+        cur_logger.error(f"file: {file_path}, ffprobe执行错误: {e}")
+        result['error'] = f"ffprobe执行失败: {e.stderr}"
+        return result
+    except subprocess.TimeoutExpired:
+        cur_logger.error(f"file: {file_path}, ffprobe执行超时")
+        result['error'] = "ffprobe执行超时"
+        return result
+    except Exception as e:
+        cur_logger.error(f"file: {file_path}, 检测过程中发生错误: {e}")
+        result['error'] = str(e)
+        return result
+
+    streams = probe_data.get("streams", [])
+    fmt = probe_data.get("format", {})
+    try:
+        result['duration'] = float(fmt["duration"]) if fmt.get("duration") not in (None, "N/A") else None
+    except ValueError:
+        result['duration'] = None
+    result['format_name'] = fmt.get("format_name")
+    result['streams'] = streams
+    for stream in streams:
+        codec_type = stream.get("codec_type")
+        if codec_type == "audio":
+            result['audio_streams'].append({
+                'index': stream.get('index', ''),
+                'codec': stream.get('codec_name', ''),
+                'channels': stream.get('channels', 0),
+                'sample_rate': stream.get('sample_rate', 0)
+            })
+            result['audio_codec'] = result['audio_codec'] or stream.get('codec_name')
+        elif codec_type == "video":
+            result['video_codec'] = result['video_codec'] or stream.get('codec_name')
+    result['has_audio'] = bool(result['audio_streams'])
+    return result
+
+
 def check_audio_stream(file_path: str) -> dict:
     """
     检查视频文件是否有音频流
@@ -31,92 +95,8 @@ def check_audio_stream(file_path: str) -> dict:
                 'error': str or None        # 错误信息（如果有）
             }
     """
-    
-    cmd_str = None
-    try:
-        # 使用 ffprobe 检查音频流
-        cmd = [
-            "ffprobe",
-            "-v", "error",                    # 只输出错误和数据
-            "-show_entries", "stream=codec_type,codec_name,channels,sample_rate",
-            "-select_streams", "a:0",           # 选择第一个音频流
-            "-of", "json",
-            file_path
-        ]
-        # 创建新列表，最后一个元素添加引号
-        cmd_with_quotes = cmd[:-1] + ['"' + cmd[-1] + '"']
-        cmd_str = " ".join(cmd_with_quotes)
-        
-        result = subprocess.run(
-            cmd, 
-            capture_output=True, 
-            text=True, 
-            check=True,
-            timeout=30  # 设置超时时间避免卡死
-        )
-        
-        try:
-            probe_data = json.loads(result.stdout)
-        except json.JSONDecodeError as e:
-            return {
-                'has_audio': False,
-                'audio_streams': [],
-                'error': f"ffprobe输出解析失败: {e}"
-            }
-            
-        # 检查是否有音频流
-        audio_streams = probe_data.get("streams", [])
-        
-        if not audio_streams:
-            return {
-                'has_audio': False,
-                'audio_streams': [],
-                'error': None
-            }
-            
-        # 提取音频流信息
-        audio_info_list = []
-        
-        for stream in probe_data.get("streams", []):
-            if stream.get("codec_type") == "audio":
-                info = {
-                    'index': stream.get('index', ''),
-                    'codec': stream.get('codec_name', ''),
-                    'channels': stream.get('channels', 0),
-                    'sample_rate': stream.get('sample_rate', 0)
-                }
-                audio_info_list.append(info)
-        
-        return {
-            'has_audio': True,
-            'audio_streams': audio_info_list,
-            'error': None
-        }
-        
-    except subprocess.CalledProcessError as e:
-        # ffprobe 执行失败
-        cur_logger.error(f"cmd: {cmd_str}, ffprobe执行错误: {e}")
-        return {
-            'has_audio': False,
-            'audio_streams': [],
-            'error': f"ffprobe执行失败: {e.stderr}"
-        }
-    except subprocess.TimeoutExpired:
-        # 超时
-        cur_logger.error(f"cmd: {cmd_str}, ffprobe执行超时")
-        return {
-            'has_audio': False,
-            'audio_streams': [],
-            'error': "ffprobe执行超时"
-        }
-    except Exception as e:
-        # 其他异常
-        cur_logger.error(f"cmd: {cmd_str}, 检测过程中发生错误: {e}")
-        return {
-            'has_audio': False,
-            'audio_streams': [],
-            'error': str(e)
-        }
+    result = probe_media(file_path)
+    return {'has_audio': result['has_audio'], 'audio_streams': result['audio_streams'], 'error': result['error']}
 
 def check_audio_stream_alternative(file_path: str) -> dict:
     """
@@ -178,6 +158,52 @@ def check_audio_stream_alternative(file_path: str) -> dict:
             'error': str(e)
         }
 
+# === media_probe: ffprobe 结果按内容 (md5) 缓存, 启动时建表 ===
+CREATE_MEDIA_PROBE_SQL = """
+CREATE TABLE IF NOT EXISTS public.media_probe (
+    md5 varchar(64) NOT NULL,
+    has_audio bool NOT NULL,
+    duration_secs float8 NULL,
+    format_name varchar(255) NULL,
+    audio_codec varchar(64) NULL,
+    video_codec varchar(64) NULL,
+    streams jsonb NULL,
+    probed_at timestamp DEFAULT CURRENT_TIMESTAMP NULL,
+    CONSTRAINT media_probe_pkey PRIMARY KEY (md5)
+);
+"""
+
+UPSERT_MEDIA_PROBE_SQL = """
+INSERT INTO media_probe (md5, has_audio, duration_secs, format_name, audio_codec, video_codec, streams, probed_at)
+VALUES %s
+ON CONFLICT (md5) DO UPDATE SET
+    has_audio = EXCLUDED.has_audio, duration_secs = EXCLUDED.duration_secs, format_name = EXCLUDED.format_name,
+    audio_codec = EXCLUDED.audio_codec, video_codec = EXCLUDED.video_codec, streams = EXCLUDED.streams,
+    probed_at = EXCLUDED.probed_at;
+"""
+
+
+def ensure_media_probe_table(cur):
+    """建表 (已存在时不做任何事), 没有建表权限时抛出异常, 调用方退回到不缓存的探测"""
+    cur.execute(CREATE_MEDIA_PROBE_SQL)
+
+
+def media_probe_row(md5: str, result: dict) -> tuple:
+    """probe_media 的结果 -> media_probe 的一行, 只用于 error 为 None 的结果"""
+    return (md5, result['has_audio'], result['duration'], result['format_name'],
+            result['audio_codec'], result['video_codec'], json.dumps(result['streams']), 'now')
+
+
+def save_media_probes(cur, rows: list) -> int:
+    """批量写入 media_probe_row 生成的行, 同一 md5 只保留最后一行"""
+    if not rows:
+        return 0
+    from psycopg2.extras import execute_values
+    rows = list({row[0]: row for row in rows}.values())
+    execute_values(cur, UPSERT_MEDIA_PROBE_SQL, rows, template="(%s, %s, %s, %s, %s, %s, %s::jsonb, %s::timestamp)", page_size=1000)
+    return len(rows)
+
+
 def is_video_has_audio(file_path: str) -> bool:
     """
     简化版本：只返回是否有音频
@@ -188,9 +214,7 @@ def is_video_has_audio(file_path: str) -> bool:
     Returns:
         bool: True 表示有音频，False 表示无音频
     """
-    
-    result = check_audio_stream(file_path)
-    return result.get('has_audio', False)
+    return probe_media(file_path)['has_audio']
 
 # def main():
 #     """主函数测试"""
@@ -3,10 +3,9 @@
 """
 Translate n8n workflow to Python:
 - manualTrigger → main()
-- postgres "query audio and video files" → sql_query_candidates
+- postgres "query audio and video files" + "filter out deleted files" + IF (tl_id empty) OR (tl_status == 'error')
+  → SQL_QUERY_CANDIDATES, one set-based query read in pages through a server-side cursor
 - splitInBatches/Loop Over Items → for item in rows
-- postgres "filter out deleted files" → sql_filter_deleted
-- IF (id notEmpty) OR (tl_id empty) OR (tl_status == 'error') → condition
 - Execute Command (onError: continue) → subprocess call with try/except then continue
 """
 
@@ -22,46 +21,69 @@ import psycopg2
 import psycopg2.extras
 
 from global_config.logger_config import logger,get_logger
+from global_config.db_pool import configure_pool, pooled_connection
 
 cur_logger = get_logger("transcribe_from_n8n")
 perf_logger = get_logger("perf.transcribe_from_n8n")
 
+# runnable work list: live audio/video rows whose md5 was never transcribed successfully
+# (rows without md5, e.g. scanned with full_hash: on_collision, cannot be matched to transcription_log and are left out)
+# and whose latest attempt (if any, per md5 across all paths of that content) ended in error. content already probed without audio (media_probe) is left out,
+# probe_has_audio is true when ffprobe has already found audio, so the file is not probed again.
+# supporting indexes: see README.md, idx_transcription_log_md5_status / idx_transcription_log_md5_id / idx_file_media
 SQL_QUERY_CANDIDATES = Template("""
-select 
-  f.*
-from file_inventory f
-left outer join (
-    select tl.status, tl.path, tl.id, tl.file_id, tl.ended_at, tl.file_md5
+with latest as (
+    select distinct on (tl.file_md5) tl.file_md5, tl.id, tl.status, tl.ended_at
     from transcription_log tl
-    where not exists (
-        select t.id from transcription_log t
-        where t.path = tl.path and t.id > tl.id
-    )
-) t on f.md5 = t.file_md5
+    order by tl.file_md5, tl.id desc
+)
+select
+  f.id,
+  f.path,
+  f.md5,
+  f.size,
+  f.mount_uuid,
+  f.relative_path,
+  t.id     as tl_id,
+  t.status as tl_status,
+  $probe_column
+from file_inventory f
+left outer join latest t on t.file_md5 = f.md5
+$probe_join
 where (f.mime_type ilike 'video/%%' or f.mime_type ilike 'audio/%%')
   and f.deleted = 0
-  and (t.status != 'success' or t.id is null)
-  and f.id between $id_min and $id_max
-order by f.id $id_order_by, f.size $size_order_by, t.ended_at nulls last;
+  and f.md5 is not null
+  and f.id between %(id_min)s and %(id_max)s
+  and (t.id is null or t.status = 'error')
+  $probe_filter
+  and not exists (
+      select 1 from transcription_log s
+      where s.file_md5 = f.md5 and s.status = 'success'
+  )
+order by f.id $id_order_by, f.size $size_order_by, t.ended_at nulls last
+limit %(limit)s;
 """)
 
-SQL_FILTER_DELETED = r"""
-select
-  fi.id,
-  fi.path,
-  fi.md5,
-  fi.mount_uuid,
-  fi.relative_path,
-  tl.id   as tl_id,
-  tl.status as tl_status,
-  tl.file_md5 as tl_md5
-from file_inventory fi
-left outer join transcription_log tl
-  on fi.md5 = tl.file_md5
-where fi.deleted = 0
-  and fi.id in (%(file_id)s);
+SQL_COUNT_WITHOUT_MD5 = r"""
+select count(*) as cnt
+from file_inventory f
+where (f.mime_type ilike 'video/%%' or f.mime_type ilike 'audio/%%')
+  and f.deleted = 0
+  and f.md5 is null
+  and f.id between %(id_min)s and %(id_max)s;
 """
 
+# media_probe parts of SQL_QUERY_CANDIDATES, without the table every file is probed again
+PROBE_CACHE_SQL = {
+    "probe_column": "p.has_audio as probe_has_audio",
+    "probe_join": "left outer join media_probe p on p.md5 = f.md5",
+    "probe_filter": "and p.has_audio is not false",
+}
+NO_PROBE_CACHE_SQL = {"probe_column": "null::bool as probe_has_audio", "probe_join": "", "probe_filter": ""}
+
+# candidate rows fetched per round trip from the server-side cursor
+CANDIDATE_PAGE_SIZE = 1000
+
 
 def getenv_or(arg: Optional[str], env_key: str, default: Optional[str] = None) -> Optional[str]:
     if arg:
@@ -72,9 +94,12 @@ def getenv_or(arg: Optional[str], env_key: str, default: Optional[str] = None) -
 
 def get_conn(dsn: Optional[str], host: Optional[str]=None, port: Optional[int]=None,
              db: str=None, user: str=None, password: Optional[str]=None):
+    '''
+    returns a pooled connection context: `with get_conn(dsn) as conn`
+    '''
     if dsn:
-        return psycopg2.connect(dsn)
-    return psycopg2.connect(
+        return pooled_connection(dsn)
+    return pooled_connection(
         host=host, port=port, dbname=db, user=user, password=password
     )
 
@@ -89,25 +114,44 @@ def handle_result(fut, ctx):
 from global_config.config import yaml_config_boxed
 import traceback
 
-def transcribe_files(filtered_rows, whisper_model_alias:str, max_parallel_workers:int):
-    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED, as_completed
-    from concurrent.futures.process import BrokenProcessPool
-    
+def new_transcribe_pool(whisper_model_alias:str, max_parallel_workers:int):
+    '''
+    long-lived worker processes, each loads the whisper model once in its initializer and keeps it for every file
+    '''
+    from concurrent.futures import ProcessPoolExecutor
     import multiprocessing as mp
-    import time
-    
-    processed = 0
-    MAX_WORKERS = max_parallel_workers # 3 workers causes OOM in CUDA at 2025-08-25 00:30:38
-    # MAX_WORKERS = 3 # 2025-08-25 00:30:38 | INFO | faster_transcribe.py:17 | error_message: CUDA failed with error out of memory
+
     # 使用 spawn，避免 fork + CUDA
     try:
         mp.set_start_method("spawn", force=True)
     except RuntimeError:
         pass
     ctx = mp.get_context("spawn")
+    from transcribe_insert import init_worker
+    perf_logger.info("start transcribe pool: workers=%s, model=%s", max_parallel_workers, whisper_model_alias)
+    return ProcessPoolExecutor(max_workers=max_parallel_workers, mp_context=ctx,
+                               initializer=init_worker, initargs=(whisper_model_alias,))
+
+def transcribe_files(filtered_rows, whisper_model_alias:str, max_parallel_workers:int, pool=None):
+    '''
+    pool: a pool from new_transcribe_pool() shared by all batches, so the models stay loaded between batches.
+    without it a pool is created for this batch only. returns the pool to use for the next batch,
+    a new one if this one broke (e.g. a worker was killed by OOM)
+    '''
+    from concurrent.futures import wait, FIRST_COMPLETED, as_completed
+    from concurrent.futures.process import BrokenProcessPool
+    from contextlib import nullcontext
+    
+    import time
+    
+    processed = 0
+    MAX_WORKERS = max_parallel_workers # 3 workers causes OOM in CUDA at 2025-08-25 00:30:38
+    # MAX_WORKERS = 3 # 2025-08-25 00:30:38 | INFO | faster_transcribe.py:17 | error_message: CUDA failed with error out of memory
+    shared_pool = pool
 
     try:
-        with ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=ctx) as pool:
+        # a shared pool is shut down by its owner, not after every batch
+        with (nullcontext(shared_pool) if shared_pool else new_transcribe_pool(whisper_model_alias, MAX_WORKERS)) as pool:
             pending = set()
             ctx_map = {}
             perf_logger.info("start to transcribe audio stream for files")
@@ -115,15 +159,9 @@ def transcribe_files(filtered_rows, whisper_model_alias:str, max_parallel_worker
                 file_id = one_row["id"]
                 path = one_row["path"]
                 md5 = one_row["md5"]
+                # files with a successful transcription are excluded by SQL_QUERY_CANDIDATES,
+                # transcribe_all checks again right before transcribing
                 cur_logger.info("[file_id=%s] Processing file: %s", file_id, path)
-                conn = get_conn(DB_CONN)
-                
-                with conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-                    cur.execute(f"select * from transcription_log where file_md5=%(file_md5)s and status='success';", {"file_md5": md5})
-                    is_suc_before = cur.fetchall()
-                    if is_suc_before:
-                        cur_logger.info("[file_id=%s] successful rows existed; skip.", file_id)
-                        continue
 
                 submit_path = path
                 is_tmp_wav = False
@@ -196,11 +234,16 @@ def transcribe_files(filtered_rows, whisper_model_alias:str, max_parallel_worker
         ctx_map.clear()
         # 可视需要这里选择：重建池重试 / 直接返回 / 抛出
         logger.error("Process pool broken; cancelled pending and cleaned up.")
+        if shared_pool:
+            shared_pool.shutdown(wait=False, cancel_futures=True)
+            shared_pool = new_transcribe_pool(whisper_model_alias, MAX_WORKERS)
     finally:
         logger.info("Done. processed=%d", processed)
+    return shared_pool
 
 # DB 连接参数
 DB_CONN = yaml_config_boxed.transcribe.db_conn
+configure_pool(**(yaml_config_boxed.transcribe.get('db_pool') or {}))
 
 def main():
     parser = argparse.ArgumentParser(description="Run media transcribe loop translated from n8n.")
@@ -217,108 +260,143 @@ def main():
     args = parser.parse_args()
     perf_logger.info("Parsed args: %s", args)
 
-    conn = get_conn(DB_CONN)
-    conn.autocommit = False
-    
     # path converter
     from file_scanner.mount_path_utils import MountPathUtil
     mountPathUtil = MountPathUtil.from_system()
 
+    pool = None
+    # === node: query audio and video files ===
+    id_order_by_str = "desc" if args.id_order_by=="desc" else "asc"
+    size_order_by_str = "desc" if args.size_order_by=="desc" else "asc"
+
+    whisper_model_alias = args.whisper_model_alias if args.whisper_model_alias else yaml_config_boxed.transcribe.whisper.model_alias
+    max_parallel_workers = args.max_parallel_workers if args.max_parallel_workers and args.max_parallel_workers > 0 else yaml_config_boxed.transcribe.max_parallel_workers
+    # one pool for the whole run, the workers keep their model loaded across batches
+    pool = new_transcribe_pool(whisper_model_alias, max_parallel_workers)
+
+    # a missing media_probe table is created; without the permission to do so, runs go on uncached
+    from media_detector import ensure_media_probe_table
     try:
-        with conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-            # === node: query audio and video files ===
-            id_order_by_str = "desc" if args.id_order_by=="desc" else "asc"
-            size_order_by_str = "desc" if args.size_order_by=="desc" else "asc"
-            
-            whisper_model_alias = args.whisper_model_alias if args.whisper_model_alias else yaml_config_boxed.transcribe.whisper.model_alias
-            max_parallel_workers = args.max_parallel_workers if args.max_parallel_workers and args.max_parallel_workers > 0 else yaml_config_boxed.transcribe.max_parallel_workers
-            
-            cur_logger.info("Querying candidate media files in id range [%s, %s], id_order_by: %s, id_order_by_str:%s, size_order_by_str:%s, size_order_by:%s ...", args.id_min, args.id_max, args.id_order_by, id_order_by_str, args.size_order_by, size_order_by_str)
-            
-            tmp_sql = SQL_QUERY_CANDIDATES.substitute({"id_min": args.id_min, "id_max": args.id_max, "id_order_by": id_order_by_str, "size_order_by": size_order_by_str})
-            perf_logger.info(f'SQL_QUERY_CANDIDATES: {tmp_sql}')
-            cur.execute(tmp_sql)
-            
-            rows = cur.fetchall()
-            rows_count = len(rows)
-            cur_logger.info("Fetched %d candidate rows.", rows_count)
-
-            idx = 0
-            filtered_rows = []
-            count_sum = {}
-            perf_logger.info("Start filtering rows ... rows_count: %s", rows_count)
-            for r in rows:
-                idx += 1
-                if idx % 200 == 0:
-                    perf_logger.info("filtered rows_count: %s/%s (%.2f%%)", idx, rows_count, (idx/rows_count)*100)
-                    
-                    # 2025-09-04 11:18:28 | INFO | media_detector.py:175 | filtered_rows length: 152, count_sum for skipping files: {'no_audio': 125, 'non_existing': 248}
-                    perf_logger.info("-" * 120)
-                    perf_logger.info("filtered_rows length: %s, count_sum for skipping files: %s", len(filtered_rows), count_sum)
-                    perf_logger.info("-" * 120)
-                    
-                    transcribe_files(filtered_rows, whisper_model_alias, max_parallel_workers)
-                    
-                    filtered_rows.clear()
-
-                file_id = r["id"]
-                if args.limit and idx >= args.limit:
-                    break
+        with get_conn(DB_CONN) as conn, conn.cursor() as cur:
+            ensure_media_probe_table(cur)
+        use_probe_cache = True
+    except Exception as e:
+        cur_logger.error("❌ media_probe 表不可用, 本次不使用探测缓存: %s", e)
+        use_probe_cache = False
+
+    # WITH HOLD: the result is kept on the server after the commit below,
+    # so no transaction stays open for the hours the files take to transcribe
+    with get_conn(DB_CONN) as conn, conn.cursor(name="transcribe_candidates", cursor_factory=psycopg2.extras.RealDictCursor, withhold=True) as cur:
+        cur.itersize = CANDIDATE_PAGE_SIZE
+        cur_logger.info("Querying candidate media files in id range [%s, %s], id_order_by: %s, id_order_by_str:%s, size_order_by_str:%s, size_order_by:%s ...", args.id_min, args.id_max, args.id_order_by, id_order_by_str, args.size_order_by, size_order_by_str)
+        
+        with conn.cursor() as count_cur:
+            count_cur.execute(SQL_COUNT_WITHOUT_MD5, {"id_min": args.id_min, "id_max": args.id_max})
+            without_md5 = count_cur.fetchone()[0]
+        if without_md5:
+            cur_logger.info("⚠️ %s media rows without md5 (full_hash: on_collision) skipped; rescan with --full_hash to transcribe them.", without_md5)
+
+        tmp_sql = SQL_QUERY_CANDIDATES.substitute({"id_order_by": id_order_by_str, "size_order_by": size_order_by_str,
+                                                   **(PROBE_CACHE_SQL if use_probe_cache else NO_PROBE_CACHE_SQL)})
+        perf_logger.info(f'SQL_QUERY_CANDIDATES: {tmp_sql}')
+        cur.execute(tmp_sql, {"id_min": args.id_min, "id_max": args.id_max, "limit": args.limit or None})
+        conn.commit()
+
+        idx = 0
+        filtered_rows = []
+        count_sum = {}
+        # copies of the same content at several paths: only the first reachable one is transcribed
+        queued_md5s = set()
+        # new media_probe rows, written before each batch is transcribed
+        probe_rows = []
+
+        def flush_probes():
+            from media_detector import save_media_probes
+            if not probe_rows or not use_probe_cache:
+                probe_rows.clear()
+                return
+            try:
+                with get_conn(DB_CONN) as probe_conn, probe_conn.cursor() as probe_cur:
+                    saved = save_media_probes(probe_cur, probe_rows)
+                perf_logger.info("media_probe rows saved: %s", saved)
+            except Exception as e:
+                cur_logger.error("❌ 写入 media_probe 失败: %s", e)
+            probe_rows.clear()
+
+        perf_logger.info("Start filtering rows ...")
+        for r in cur:
+            idx += 1
+            if idx % 200 == 0:
+                perf_logger.info("filtered rows_count: %s", idx)
                 
-                # === node: filter out deleted files ===
-                cur.execute(SQL_FILTER_DELETED, {"file_id": file_id})
-                filtered = cur.fetchall()
-                if not filtered:
-                    cur_logger.info("[id=%s] no rows after filter; continue.", file_id)
-                    continue
-
-                row = filtered[0]
-                # logger.info("[id=%s] row after filter: %s", file_id, row)
+                # 2025-09-04 11:18:28 | INFO | media_detector.py:175 | filtered_rows length: 152, count_sum for skipping files: {'no_audio': 125, 'non_existing': 248}
+                perf_logger.info("-" * 120)
+                perf_logger.info("filtered_rows length: %s, count_sum for skipping files: %s", len(filtered_rows), count_sum)
+                perf_logger.info("-" * 120)
                 
-                tl_id = row.get("tl_id")
-                tl_status = row.get("tl_status")
-                path = row.get("path")
-                md5 = row.get("md5")
-                mount_uuid = row.get("mount_uuid")
-                relative_path = row.get("relative_path")
-                cur_logger.info("[id=%s] tl_id: %s, tl_status: %s, path: %s, md5: %s, mount_uuid: %s, relative_path: %s", file_id, tl_id, tl_status, path, md5, mount_uuid, relative_path)
-
-                cond = (file_id is not None) and ((tl_id is None) or (tl_status == "error"))
-                if not cond:
-                    cur_logger.debug("[id=%s] IF condition false; skip.", file_id)
-                    continue
-                if not path:
-                    cur_logger.debug("[id=%s] Empty path; skip.", file_id)
-                    continue
+                flush_probes()
+                pool = transcribe_files(filtered_rows, whisper_model_alias, max_parallel_workers, pool)
                 
-                if mount_uuid and relative_path:
-                    abs_path_from_uuid_and_rel_path = mountPathUtil.logical_path_2_real(mount_uuid, relative_path)
-                    if abs_path_from_uuid_and_rel_path and os.path.exists(abs_path_from_uuid_and_rel_path):
-                        cur_logger.info("[id=%s] path[%s] updated to %s", file_id, path, abs_path_from_uuid_and_rel_path)
-                        path = abs_path_from_uuid_and_rel_path
-                        row["path"] = path
-                        r["path"] = path
-                    
-                if not os.path.exists(path) or not os.path.isfile(path):
-                    # 文件不存在，跳过
-                    cur_logger.info("[id=%s][path=%s] Non-existing or irregular file detected; skip.", file_id, path)
-                    count_sum["non_existing"] = count_sum.get("non_existing", 0) + 1
-                    continue
-
-                from media_detector import is_video_has_audio
-                if not is_video_has_audio(path):
+                filtered_rows.clear()
+
+            file_id = r["id"]
+            tl_id = r["tl_id"]
+            tl_status = r["tl_status"]
+            path = r["path"]
+            md5 = r["md5"]
+            mount_uuid = r["mount_uuid"]
+            relative_path = r["relative_path"]
+            cur_logger.info("[id=%s] tl_id: %s, tl_status: %s, path: %s, md5: %s, mount_uuid: %s, relative_path: %s", file_id, tl_id, tl_status, path, md5, mount_uuid, relative_path)
+
+            if not path:
+                cur_logger.debug("[id=%s] Empty path; skip.", file_id)
+                continue
+            if md5 and md5 in queued_md5s:
+                cur_logger.info("[id=%s] same md5 already queued in this run; skip.", file_id)
+                count_sum["same_md5"] = count_sum.get("same_md5", 0) + 1
+                continue
+            
+            if mount_uuid and relative_path:
+                abs_path_from_uuid_and_rel_path = mountPathUtil.logical_path_2_real(mount_uuid, relative_path)
+                if abs_path_from_uuid_and_rel_path and os.path.exists(abs_path_from_uuid_and_rel_path):
+                    cur_logger.info("[id=%s] path[%s] updated to %s", file_id, path, abs_path_from_uuid_and_rel_path)
+                    path = abs_path_from_uuid_and_rel_path
+                    r["path"] = path
+                
+            if not os.path.exists(path) or not os.path.isfile(path):
+                # 文件不存在，跳过
+                cur_logger.info("[id=%s][path=%s] Non-existing or irregular file detected; skip.", file_id, path)
+                count_sum["non_existing"] = count_sum.get("non_existing", 0) + 1
+                continue
+
+            if r["probe_has_audio"]:
+                count_sum["probe_cached"] = count_sum.get("probe_cached", 0) + 1
+            else:
+                from media_detector import probe_media, media_probe_row
+                probe = probe_media(path)
+                # timeouts and ffprobe failures are not cached, the file is probed again next run
+                if md5 and probe["error"] is None:
+                    probe_rows.append(media_probe_row(md5, probe))
+                if not probe["has_audio"]:
                     # 无音频流，跳过
                     cur_logger.info("[id=%s][path=%s] No audio stream detected; skip.", file_id, path)
                     count_sum["no_audio"] = count_sum.get("no_audio", 0) + 1
                     continue
-                
-                filtered_rows.append(r)
-                
-                # sys.exit(0)
+            
+            filtered_rows.append(r)
+            if md5:
+                queued_md5s.add(md5)
+            
+            # sys.exit(0)
 
+        # the last partial batch
+        flush_probes()
+        if filtered_rows:
+            pool = transcribe_files(filtered_rows, whisper_model_alias, max_parallel_workers, pool)
+        cur_logger.info("Fetched %d candidate rows.", idx)
+    if pool:
+        pool.shutdown(wait=True)
 
-    finally:
-        conn.close()
 
 import subprocess, tempfile
 from pathlib import Path
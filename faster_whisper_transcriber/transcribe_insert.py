@@ -1,8 +1,9 @@
 import sys
 import os
 import psycopg2
+from psycopg2.extras import execute_values
 import datetime
-from faster_transcribe import WhisperTranscriber
+from faster_transcribe import get_transcriber
 from langdetect import detect
 from sentence_transformers import SentenceTransformer
 from uuid import uuid4
@@ -11,10 +12,14 @@ import argparse
 from types import SimpleNamespace
 
 from global_config.logger_config import get_logger
+from global_config.db_pool import configure_pool, pooled_connection
 
 cur_logger = get_logger(os.path.basename(__file__))
 
-def log_transcription(conn, cur, file_id, file_md5, path, status, start_time, ollama_model, embedding_model_name,model_in_out,version, error_message=None):
+def log_transcription(conn, cur, file_id, file_md5, path, status, start_time, ollama_model, embedding_model_name,model_in_out,version, error_message=None, commit:bool=True):
+    '''
+    commit=False leaves the row in the caller's transaction, so it commits together with the segments of the file
+    '''
     if status != 'success':
         cur_logger.info(f'error_message: {error_message}')
 
@@ -30,7 +35,8 @@ def log_transcription(conn, cur, file_id, file_md5, path, status, start_time, ol
         duration, error_message[:1000] if error_message else None,
         ollama_model, embedding_model_name, str(model_in_out), version
     ))
-    conn.commit()
+    if commit:
+        conn.commit()
 
 
 def get_transcription_log(cur, file_path):
@@ -196,10 +202,26 @@ def old_logic(conn, cur, segments, ollamaModel, info, embedding_model,version):
     conn.commit()
     return err_msg
 
+# segments per INSERT statement, also the most segments held in memory
+SEGMENT_PAGE_SIZE = 1000
+
+INSERT_SEGMENTS_SQL = """
+    INSERT INTO transcript_segment (
+        file_id, start_time, end_time, text, version
+    ) VALUES %s
+"""
+
 def new_logic(conn, cur, file_id, segments, version):
+    '''
+    segments are written while the decoder produces them, one multi-row INSERT per SEGMENT_PAGE_SIZE segments,
+    so memory stays flat on long recordings. they go into the caller's transaction and nothing is committed here:
+    the caller commits them together with the transcription_log row, or rolls them back
+    '''
     cur_logger.info(f'begin to deal with segments')
     
     err_msg=[]
+    rows=[]
+    written=0
     
     seg_idx = 0
     for seg in segments:
@@ -210,7 +232,8 @@ def new_logic(conn, cur, file_id, segments, version):
             seg = SimpleNamespace(**seg)
             
         seg_idx += 1
-        cur_logger.info(f'deal with file_id: {file_id} seg_idx: {seg_idx}')
+        if seg_idx % 100 == 0:
+            cur_logger.info(f'deal with file_id: {file_id} seg_idx: {seg_idx}')
         start, end, text = seg.start, seg.end, seg.text.strip()
         if not text:
             continue
@@ -225,21 +248,22 @@ def new_logic(conn, cur, file_id, segments, version):
         
             file_id, start_time, end_time, text
         '''
-        cur.execute("""
-            INSERT INTO transcript_segment (
-                file_id, start_time, end_time, text, version
-            ) VALUES (
-                %s, %s, %s, %s, %s
-            )
-        """, (
+        rows.append((
             file_id,  # file_id: 建议先人工将文件入表获取 ID
             datetime.timedelta(seconds=start),
             datetime.timedelta(seconds=end),
             text,
             version,
         ))
-
-        conn.commit()
+        if len(rows) >= SEGMENT_PAGE_SIZE:
+            execute_values(cur, INSERT_SEGMENTS_SQL, rows, page_size=SEGMENT_PAGE_SIZE)
+            written += len(rows)
+            rows.clear()
+
+    if rows:
+        execute_values(cur, INSERT_SEGMENTS_SQL, rows, page_size=SEGMENT_PAGE_SIZE)
+        written += len(rows)
+    cur_logger.info(f'end to deal with segments, file_id: {file_id}, segments: {written}')
     return err_msg
 
 def exist_same_md5_transcript_log(cur, file_md5:str)->bool:
@@ -272,9 +296,9 @@ def transcribe_all(conn, cur, file_id:str, file_path:str,start_time:str,llm_mode
         if exist_same_md5_transcript_log(cur, file_md5):
             return
 
-        # 初始化模型
+        # 模型常驻进程, 只有第一个文件加载
         cur_logger.info(f'begin to init {whisper_model_alias}')
-        transcriber = WhisperTranscriber(whisper_model_alias, num_workers=NUM_WORKERS)
+        transcriber = get_transcriber(whisper_model_alias, num_workers=NUM_WORKERS)
         cur_logger.info(f'end to init {whisper_model_alias}, transcriber.id: {id(transcriber)}')
 
         # Step 1: 转录
@@ -295,12 +319,15 @@ def transcribe_all(conn, cur, file_id:str, file_path:str,start_time:str,llm_mode
         # err_msg = old_logic(segments,OLLAMA_MODEL,info,embedding_model)
         err_msg = new_logic(conn, cur, file_id, segments, version_ymd_hms_ppid_pid)
 
+        # segments and log row commit together in the finally below
         if len(err_msg)>0:
-            log_transcription(conn, cur, file_id, file_md5, file_path, "partial_success", start_time, whisper_model_alias, embedding_model_name,model_in_out,version_ymd_hms_ppid_pid, str(err_msg))
+            log_transcription(conn, cur, file_id, file_md5, file_path, "partial_success", start_time, whisper_model_alias, embedding_model_name,model_in_out,version_ymd_hms_ppid_pid, str(err_msg), commit=False)
         else:
-            log_transcription(conn, cur, file_id, file_md5, file_path, "success", start_time, whisper_model_alias, embedding_model_name,model_in_out,version_ymd_hms_ppid_pid)
+            log_transcription(conn, cur, file_id, file_md5, file_path, "success", start_time, whisper_model_alias, embedding_model_name,model_in_out,version_ymd_hms_ppid_pid, commit=False)
 
     except Exception as e:
+        # no half-written transcript: drop the segments of this file, keep only the error row
+        conn.rollback()
         log_transcription(conn, cur, file_id, file_md5, file_path, "error", start_time, whisper_model_alias, embedding_model_name,model_in_out if model_in_out else 'None',version_ymd_hms_ppid_pid, str(e))
     finally:
         # cur.close()
@@ -309,16 +336,29 @@ def transcribe_all(conn, cur, file_id:str, file_path:str,start_time:str,llm_mode
 
 
 from global_config.config import yaml_config_boxed
-def main_func(whisper_model_alias:str, file_id:str, file_path:str,file_md5:str, start_time=datetime.datetime.now()):
+
+def init_worker(whisper_model_alias:str):
+    '''
+    ProcessPoolExecutor initializer: load the model once when the worker process starts,
+    every main_func task of this worker reuses it through get_transcriber
+    '''
+    configure_pool(**(yaml_config_boxed.transcribe.get('db_pool') or {}))
+    cur_logger.info(f'init worker pid={os.getpid()}, preloading {whisper_model_alias}')
+    get_transcriber(whisper_model_alias, num_workers=NUM_WORKERS)
+
+def main_func(whisper_model_alias:str, file_id:str, file_path:str,file_md5:str, start_time=None):
+    # the default used to be evaluated once at import, a long-lived worker would log every file with the same start
+    start_time = start_time or datetime.datetime.now()
     DB_CONN = yaml_config_boxed.transcribe.db_conn
     llm_model_name = yaml_config_boxed.transcribe.llm.ollama_model
     whisper_beam_size = yaml_config_boxed.transcribe.whisper.beam_size
     model_384d = yaml_config_boxed.transcribe.embedding.model_384d
 
-    # PostgreSQL 连接
-    with psycopg2.connect(DB_CONN) as conn, conn.cursor() as cur:
-        conn.autocommit = False
-        # 15 seconds timeout for each statement
+    configure_pool(**(yaml_config_boxed.transcribe.get('db_pool') or {}))
+
+    # PostgreSQL 连接, pooled per worker process
+    with pooled_connection(DB_CONN) as conn, conn.cursor() as cur:
+        # 15 seconds timeout for each statement, every borrower of this pool in the worker sets it
         cur.execute("SET statement_timeout = %s", (15 * 1000,))
         # using 'for update' lock to prevent multiple processes from transcribing the same file
         cur.execute("""
@@ -1,8 +1,11 @@
 # ~/whisper_api.py
 from fastapi import FastAPI, UploadFile, File, Form
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 import tempfile
 import os
-from faster_transcribe import WhisperTranscriber
+import json
+from faster_transcribe import get_transcriber
 
 from global_config.logger_config import get_logger
 
@@ -22,9 +25,9 @@ async def transcribe(file: UploadFile = File(...),
                 f.write(content)
             
             # 转录
-            # 初始化模型
+            # 模型常驻服务进程, 只有第一次请求加载
             cur_logger.info(f'begin to init {whisper_model_alias}')
-            transcriber = WhisperTranscriber(whisper_model_alias, num_workers=1)
+            transcriber = get_transcriber(whisper_model_alias, num_workers=1)
             cur_logger.info(f'end to init {whisper_model_alias}, transcriber.id: {id(transcriber)}')
 
             # Step 1: 转录
@@ -44,6 +47,42 @@ async def transcribe(file: UploadFile = File(...),
     except Exception as e:
         return {"error": str(e)}
 
+@app.post("/transcribe_stream")
+async def transcribe_stream(file: UploadFile = File(...),
+                            whisper_model_alias: str = Form(...),  whisper_beam_size:int=Form(1)
+                           ):
+    '''
+    NDJSON, one message per line as the decoder produces it:
+    {"info": {...}} first, then {"segment": {...}} per segment, {"done": <segment count>} last.
+    a failure arrives as {"error": "..."}, also after segments were already sent
+    '''
+    # 分块保存上传的文件
+    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(file.filename)[1], delete=False) as tmp:
+        while chunk := await file.read(1024 * 1024):
+            tmp.write(chunk)
+
+    def messages():
+        try:
+            transcriber = get_transcriber(whisper_model_alias, num_workers=1)
+            cur_logger.info(f'begin to stream transcription by {whisper_model_alias}, original file: {file.filename}, temp file: {tmp.name}')
+            segments, info = transcriber.transcribe(tmp.name, beam_size=whisper_beam_size, language=None, vad_filter=True)
+            yield json.dumps({"info": jsonable_encoder(info)}, ensure_ascii=False) + "\n"
+            count = 0
+            for segment in segments:
+                count += 1
+                yield json.dumps({"segment": jsonable_encoder(segment)}, ensure_ascii=False) + "\n"
+            cur_logger.info(f'end to stream transcription by {whisper_model_alias}, segments: {count}')
+            yield json.dumps({"done": count}) + "\n"
+        except Exception as e:
+            cur_logger.exception(f'failed to stream transcription: {file.filename}')
+            yield json.dumps({"error": str(e)}, ensure_ascii=False) + "\n"
+        finally:
+            # 清理临时文件
+            os.unlink(tmp.name)
+
+    # a sync generator runs in the threadpool, decoding never blocks the event loop
+    return StreamingResponse(messages(), media_type="application/x-ndjson")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -7,13 +7,29 @@ import re
 import platform
 import subprocess
 import plistlib
-from dataclasses import dataclass
+import json
+import time
+import select
+from dataclasses import asdict, dataclass
 from pathlib import Path, PurePosixPath, PurePath
 from typing import Dict, List, Optional, Tuple
 
 import hashlib
+import functools
+import mmap
+import threading
 import magic
 
+# optional fast hashes, missing libraries just drop the algorithm
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
 @dataclass
 class DeviceMount:
     uuid: str                 # 规范化后的统一 UUID
@@ -82,7 +98,98 @@ def get_mounted_devices() -> Dict[str, str]:
     """返回 {uuid: mount_path}（uuid 已规范化）"""
     return {d.uuid: d.mount_path for d in list_mounted_devices() if d.uuid and d.mount_path}
 
-def list_mounted_devices() -> List[DeviceMount]:
+# =========================
+# 挂载表缓存
+# =========================
+# the device list is cached in process and in MOUNT_CACHE_PATH for other processes (scanner, exif writer, transcriber).
+# an entry is valid for MOUNT_CACHE_TTL_SECS while the mount table digest is unchanged,
+# on Linux a watcher thread polls /proc/self/mountinfo and drops the in-process entry as soon as anything is (un)mounted
+MOUNT_CACHE_TTL_SECS = 300
+MOUNT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "file_scanner", "mounts.json")
+_MOUNTINFO = "/proc/self/mountinfo"
+
+_mount_cache = {"devices": None, "digest": None, "fetched_at": 0.0}
+_mount_cache_lock = threading.Lock()
+_mount_watcher = None
+
+def _mount_table_digest() -> Optional[str]:
+    """digest of the current mount table, None where there is no cheap way to read it"""
+    try:
+        if os.path.exists(_MOUNTINFO):
+            with open(_MOUNTINFO, "rb") as f:
+                return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+        if platform.system() == "Darwin":
+            return hashlib.blake2b("\0".join(sorted(os.listdir("/Volumes"))).encode(), digest_size=16).hexdigest()
+    except OSError:
+        pass
+    return None
+
+def _watch_mountinfo() -> None:
+    # /proc/self/mountinfo signals POLLPRI | POLLERR whenever the mount table of this namespace changes
+    try:
+        with open(_MOUNTINFO, "rb") as f:
+            f.read()
+            poller = select.poll()
+            poller.register(f.fileno(), select.POLLPRI | select.POLLERR)
+            while True:
+                poller.poll()
+                f.seek(0)
+                f.read()
+                with _mount_cache_lock:
+                    _mount_cache["devices"] = None
+    except OSError as e:
+        print(f"[device_utils] 监听挂载表失败: {e}", file=sys.stderr)
+
+def _start_mount_watcher() -> None:
+    global _mount_watcher
+    if _mount_watcher is None and hasattr(select, "poll") and os.path.exists(_MOUNTINFO):
+        _mount_watcher = threading.Thread(target=_watch_mountinfo, name="mountinfo-watcher", daemon=True)
+        _mount_watcher.start()
+
+def _load_mount_cache_file(digest: str) -> Optional[List[DeviceMount]]:
+    try:
+        with open(MOUNT_CACHE_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("digest") != digest or time.time() - data.get("fetched_at", 0) > MOUNT_CACHE_TTL_SECS:
+            return None
+        return [DeviceMount(**d) for d in data["devices"]]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def _save_mount_cache_file(digest: str, devices: List[DeviceMount]) -> None:
+    try:
+        os.makedirs(os.path.dirname(MOUNT_CACHE_PATH), exist_ok=True)
+        tmp_path = f"{MOUNT_CACHE_PATH}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"digest": digest, "fetched_at": time.time(), "devices": [asdict(d) for d in devices]}, f)
+        os.replace(tmp_path, MOUNT_CACHE_PATH)
+    except OSError as e:
+        print(f"[device_utils] 写入挂载缓存失败: {e}", file=sys.stderr)
+
+def list_mounted_devices(use_cache: bool = True) -> List[DeviceMount]:
+    """mounted volumes, served from the mount cache unless use_cache=False"""
+    if not use_cache:
+        return _list_mounted_devices()
+    _start_mount_watcher()
+    now = time.monotonic()
+    with _mount_cache_lock:
+        devices = _mount_cache["devices"]
+        if devices is not None and now - _mount_cache["fetched_at"] < MOUNT_CACHE_TTL_SECS:
+            # without the watcher a changed mount table is only noticed through the digest
+            if _mount_watcher is not None or _mount_cache["digest"] == _mount_table_digest():
+                return list(devices)
+
+    digest = _mount_table_digest()
+    devices = _load_mount_cache_file(digest) if digest else None
+    if devices is None:
+        devices = _list_mounted_devices()
+        if digest:
+            _save_mount_cache_file(digest, devices)
+    with _mount_cache_lock:
+        _mount_cache.update(devices=devices, digest=digest, fetched_at=now)
+    return list(devices)
+
+def _list_mounted_devices() -> List[DeviceMount]:
     system = platform.system()
     try:
         if system == "Darwin":
@@ -105,25 +212,49 @@ def resolve_full_path(device_uuid: str, relative_path: str, mounts: Optional[Dic
         raise FileNotFoundError(f"未找到设备 {device_uuid} 的挂载点，请确认设备已连接。")
     return str(Path(base) / Path(relative_path))
 
-def match_path_to_device(abs_path: str, mounts: Optional[Dict[str, str]] = None) -> Optional[Tuple[str, str]]:
-    abs_path = str(Path(abs_path).resolve())
+def _canonical_path(path: str) -> str:
+    try:
+        path = os.path.realpath(path)
+    except (OSError, ValueError):
+        path = os.path.normpath(path)
+    return os.path.normcase(path) if platform.system() == "Windows" else path
+
+@functools.lru_cache(maxsize=16)
+def _canonical_mount_roots(mount_items: Tuple[Tuple[str, str], ...]) -> List[Tuple[str, str]]:
+    """[(uuid, canonical mount path)] longest first, every mount root is resolved once per mount table"""
+    roots = [(uuid, _canonical_path(mnt)) for uuid, mnt in mount_items]
+    return sorted(roots, key=lambda r: len(r[1]), reverse=True)
+
+def match_paths_to_devices(abs_paths: List[str], mounts: Optional[Dict[str, str]] = None) -> List[Optional[Tuple[str, str]]]:
+    """
+    match_path_to_device for many paths, one result per path in the same order.
+    every distinct parent directory is resolved once, so a directory listing costs one realpath plus one lstat per file
+    """
     if mounts is None:
         mounts = get_mounted_devices()
-    best = None
-    best_len = -1
-    for uuid, mnt in mounts.items():
-        try:
-            mnorm = str(Path(mnt).resolve())
-        except Exception:
-            mnorm = mnt
-        if _is_prefix_of(mnorm, abs_path) and len(mnorm) > best_len:
-            best = (uuid, mnorm)
-            best_len = len(mnorm)
-    if not best:
-        return None
-    uuid, mount_path = best
-    rel = os.path.relpath(abs_path, mount_path)
-    return uuid, normalize_relative_path(rel)
+    roots = _canonical_mount_roots(tuple(sorted(mounts.items())))
+    resolved_dirs: Dict[str, str] = {}
+    results = []
+    for abs_path in abs_paths:
+        parent, name = os.path.split(os.path.normpath(os.path.abspath(abs_path)))
+        real_parent = resolved_dirs.get(parent)
+        if real_parent is None:
+            real_parent = resolved_dirs[parent] = _canonical_path(parent)
+        path = os.path.join(real_parent, name) if name else real_parent
+        if name and os.path.islink(path):
+            path = _canonical_path(path)
+        elif platform.system() == "Windows":
+            path = os.path.normcase(path)
+        match = next((r for r in roots if _is_prefix_of(r[1], path)), None)
+        if match is None:
+            results.append(None)
+            continue
+        uuid, mount_path = match
+        results.append((uuid, normalize_relative_path(os.path.relpath(path, mount_path))))
+    return results
+
+def match_path_to_device(abs_path: str, mounts: Optional[Dict[str, str]] = None) -> Optional[Tuple[str, str]]:
+    return match_paths_to_devices([abs_path], mounts)[0]
 
 def normalize_relative_path(p: str) -> str:
     posix = PurePosixPath(*PurePath(p).parts)
@@ -208,13 +339,29 @@ def _list_macos_text() -> List[DeviceMount]:
 # Linux
 # =========================
 
-def _list_linux() -> List[DeviceMount]:
+_UDEV_ESCAPE_RE = re.compile(rb"\\x([0-9a-fA-F]{2})")
+
+def _read_disk_links(kind: str) -> Dict[str, str]:
+    """
+    /dev/disk/by-<kind>/<value> -> ../../sdb1 symlinks maintained by udev, returns {real device path: value}.
+    udev escapes blanks and special characters in the link name as \\xNN
+    """
+    base = f"/dev/disk/by-{kind}"
+    links = {}
+    try:
+        with os.scandir(base) as it:
+            for entry in it:
+                value = _UDEV_ESCAPE_RE.sub(lambda m: bytes([int(m.group(1), 16)]), os.fsencode(entry.name))
+                links[os.path.realpath(entry.path)] = value.decode("utf-8", errors="replace")
+    except OSError:
+        pass
+    return links
+
+def _blkid_maps() -> Tuple[Dict[str, str], Dict[str, str]]:
+    """fallback for systems without udev links, returns ({uuid: device}, {device: partuuid})"""
     uuid_to_dev = {}
     partuuid_map = {}
-
-    # 对所有设备
     proc = subprocess.run(["blkid", "-o", "export"], capture_output=True, text=True, check=False)
-
     if proc.returncode == 0:
         cur_dev = None
         for line in proc.stdout.splitlines():
@@ -228,10 +375,17 @@ def _list_linux() -> List[DeviceMount]:
                 uuid_to_dev[val] = cur_dev
             elif key == "PARTUUID":
                 partuuid_map[cur_dev] = val
+    return uuid_to_dev, partuuid_map
 
-        # 调试看看
-        print(f'\n\nuuid_to_dev: {uuid_to_dev}')
-        print(f'\n\npartuuid_map: {partuuid_map}')
+def _list_linux() -> List[DeviceMount]:
+    # 对所有设备: read the udev symlinks, only fork blkid when they are missing (containers, no udev)
+    dev_to_uuid = _read_disk_links("uuid")
+    if dev_to_uuid:
+        uuid_to_dev = {uuid: dev for dev, uuid in dev_to_uuid.items()}
+        partuuid_map = _read_disk_links("partuuid")
+    else:
+        uuid_to_dev, partuuid_map = _blkid_maps()
+    label_map = _read_disk_links("label")
 
     # 读取挂载信息
     dev_to_mount: Dict[str, Tuple[str, str]] = {}
@@ -255,13 +409,12 @@ def _list_linux() -> List[DeviceMount]:
         mount_path, fs = m
         if _looks_like_system_mount(mount_path):
             continue
-        print(f'dev: {dev}')
         devices.append(DeviceMount(
             uuid=fs_uuid,
             mount_path=mount_path,
             device=dev,
             fs_type=fs,
-            label=None,
+            label=label_map.get(dev),
             is_external=None,
             partition_uuid=partuuid_map.get(dev)  # 用 PARTUUID
         ))
@@ -361,18 +514,13 @@ def _list_windows() -> List[DeviceMount]:
 # =========================
 
 def _is_prefix_of(prefix: str, path: str) -> bool:
-    if platform.system() == "Windows":
-        prefix = os.path.normcase(prefix)
-        path = os.path.normcase(path)
-    try:
-        p_prefix = str(Path(prefix).resolve())
-        p_path = str(Path(path).resolve())
-    except Exception:
-        p_prefix = os.path.normpath(prefix)
-        p_path = os.path.normpath(path)
+    """pure string check on paths that are already canonical (see _canonical_path), no syscalls"""
+    p_prefix = os.path.normpath(prefix)
+    p_path = os.path.normpath(path)
     if not p_path.startswith(p_prefix):
         return False
-    if len(p_path) == len(p_prefix):
+    # "/" or "C:\\" already end with the separator
+    if len(p_path) == len(p_prefix) or p_prefix.endswith(("/", "\\")):
         return True
     sep = os.sep
     return p_path[len(p_prefix)] in (sep, "/","\\")
@@ -402,21 +550,334 @@ def _dedup_by_uuid_choose_mounted(devs: List[DeviceMount]) -> List[DeviceMount]:
     return list(by_uuid.values())
 
 # === 工具函数 ===
-def calculate_md5(filepath, block_size=65536):
-    md5 = hashlib.md5()
+DEFAULT_HASH_BLOCK_SIZE = 1024 * 1024
+# read buffers reused per thread and block size
+_hash_buffers = threading.local()
+_warned_algorithms = set()
+
+def _new_hasher(algorithm: str):
+    if algorithm == "xxh3_128":
+        return xxhash.xxh3_128() if xxhash else None
+    if algorithm == "blake3":
+        return blake3.blake3() if blake3 else None
+    try:
+        return hashlib.new(algorithm)
+    except ValueError:
+        return None
+
+def _new_hashers(algorithms) -> Dict[str, object]:
+    hashers = {}
+    for algorithm in algorithms:
+        hasher = _new_hasher(algorithm)
+        if hasher is None:
+            if algorithm not in _warned_algorithms:
+                _warned_algorithms.add(algorithm)
+                print(f"[device_utils] 摘要算法不可用, 已忽略: {algorithm}", file=sys.stderr)
+            continue
+        hashers[algorithm] = hasher
+    return hashers
+
+def _read_buffer(block_size: int, aligned: bool = False):
+    """aligned buffers are anonymous mmaps (page aligned), as required by O_DIRECT"""
+    buffers = getattr(_hash_buffers, "buffers", None)
+    if buffers is None:
+        buffers = _hash_buffers.buffers = {}
+    key = (block_size, aligned)
+    buf = buffers.get(key)
+    if buf is None:
+        buf = buffers[key] = mmap.mmap(-1, block_size) if aligned else bytearray(block_size)
+    return buf
+
+# =========================
+# 读取文件的 I/O 方式
+# =========================
+# buffered: os.readv 读入复用的缓冲区
+# mmap:     映射整个文件, MADV_SEQUENTIAL, 结束后丢弃页缓存
+# fadvise:  POSIX_FADV_SEQUENTIAL 预读, 每读完 _DROP_BEHIND_BYTES 就 POSIX_FADV_DONTNEED, 不挤占其它进程的页缓存
+# direct:   O_DIRECT + 页对齐缓冲区, 完全绕过页缓存; 文件系统不支持时退回 fadvise
+# auto:     不小于 large_file_threshold 的文件用 fadvise, 其它用 buffered
+IO_BACKENDS = ("auto", "buffered", "mmap", "fadvise", "direct")
+LARGE_FILE_THRESHOLD = 256 * 1024 * 1024
+_DROP_BEHIND_BYTES = 64 * 1024 * 1024
+
+class _DirectIONotSupported(Exception):
+    pass
+
+def select_io_backend(size: int, io_backend: str = "auto", large_file_threshold: int = LARGE_FILE_THRESHOLD) -> str:
+    if io_backend != "auto":
+        return io_backend
+    if size >= large_file_threshold and hasattr(os, "posix_fadvise"):
+        return "fadvise"
+    return "buffered"
+
+def _fadvise(fd: int, offset: int, length: int, advice_name: str) -> None:
+    advice = getattr(os, advice_name, None)
+    if advice is None or not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        os.posix_fadvise(fd, offset, length, advice)
+    except OSError:
+        pass
+
+def _iter_read(fd: int, block_size: int, aligned: bool = False, drop_behind: bool = False):
+    if drop_behind:
+        _fadvise(fd, 0, 0, "POSIX_FADV_SEQUENTIAL")
+    buf = _read_buffer(block_size, aligned)
+    view = memoryview(buf)
+    offset = dropped = 0
+    try:
+        while True:
+            try:
+                n = os.readv(fd, [buf])
+            except OSError as e:
+                if aligned and offset == 0:
+                    raise _DirectIONotSupported(str(e))
+                raise
+            if not n:
+                break
+            yield view[:n]
+            offset += n
+            if drop_behind and offset - dropped >= _DROP_BEHIND_BYTES:
+                _fadvise(fd, dropped, offset - dropped, "POSIX_FADV_DONTNEED")
+                dropped = offset
+        if drop_behind and offset > dropped:
+            _fadvise(fd, dropped, offset - dropped, "POSIX_FADV_DONTNEED")
+    finally:
+        view.release()
+
+def _iter_mmap(fd: int, block_size: int):
+    mm = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    if hasattr(mm, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+        mm.madvise(mmap.MADV_SEQUENTIAL)
+    view = memoryview(mm)
     try:
-        with open(filepath, 'rb') as f:
-            for chunk in iter(lambda: f.read(block_size), b''):
-                md5.update(chunk)
-        return md5.hexdigest()
+        for offset in range(0, len(mm), block_size):
+            yield view[offset:offset + block_size]
+    finally:
+        view.release()
+        try:
+            mm.close()
+        except BufferError:
+            # the caller still holds the last block, the mapping is closed when it is collected
+            pass
+        _fadvise(fd, 0, 0, "POSIX_FADV_DONTNEED")
+
+def iter_file_blocks(filepath, block_size=DEFAULT_HASH_BLOCK_SIZE, io_backend="auto", large_file_threshold=LARGE_FILE_THRESHOLD):
+    """
+    按 io_backend 顺序读取文件, 逐块返回 memoryview; 每块只在下一次迭代前有效
+    """
+    fd = os.open(filepath, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        backend = select_io_backend(size, io_backend, large_file_threshold)
+        if backend == "mmap" and size > 0:
+            yield from _iter_mmap(fd, block_size)
+            return
+        if backend == "direct" and hasattr(os, "O_DIRECT"):
+            aligned_size = -(-block_size // mmap.PAGESIZE) * mmap.PAGESIZE
+            try:
+                direct_fd = os.open(filepath, os.O_RDONLY | os.O_DIRECT)
+            except OSError:
+                direct_fd = None
+            if direct_fd is not None:
+                try:
+                    yield from _iter_read(direct_fd, aligned_size, aligned=True)
+                    return
+                except _DirectIONotSupported:
+                    pass
+                finally:
+                    os.close(direct_fd)
+            backend = "fadvise"
+        yield from _iter_read(fd, block_size, drop_behind=(backend in ("fadvise", "direct")))
+    finally:
+        os.close(fd)
+
+def calculate_hashes(filepath, algorithms=("md5",), block_size=DEFAULT_HASH_BLOCK_SIZE,
+                     io_backend="auto", large_file_threshold=LARGE_FILE_THRESHOLD) -> Optional[Dict[str, str]]:
+    """
+    计算多个摘要, 只读取文件一次: 返回 {algorithm: hexdigest}, 读取失败返回 None
+    algorithms: hashlib 名称 (md5, sha1, ...) 以及 xxh3_128 (需要 xxhash)、blake3 (需要 blake3), 不可用的算法被忽略
+    io_backend: 见 IO_BACKENDS
+    """
+    hashers = _new_hashers(algorithms)
+    try:
+        for chunk in iter_file_blocks(filepath, block_size, io_backend, large_file_threshold):
+            for hasher in hashers.values():
+                hasher.update(chunk)
+        return {algorithm: hasher.hexdigest() for algorithm, hasher in hashers.items()}
     except Exception:
         return None
 
+# quick fingerprint: size + first, middle and last sample, always blake2b so that every host produces comparable values
+QUICK_FINGERPRINT_SAMPLE_SIZE = 1024 * 1024
+
+def calculate_quick_fingerprint(filepath, size: Optional[int] = None, sample_size=QUICK_FINGERPRINT_SAMPLE_SIZE) -> Optional[str]:
+    """
+    快速指纹: 文件大小 + 头/中/尾各 sample_size 字节的摘要, 文件不大于 3 * sample_size 时读取全部内容
+    相同指纹只代表"可能重复", 需要完整摘要确认
+    """
+    return _read_quick_fingerprint(filepath, size, sample_size)[0]
+
+def _quick_fingerprint_ranges(size: int, sample_size: int) -> List[Tuple[int, int]]:
+    """[(offset, length)] hashed after the size, ascending and never overlapping"""
+    if size <= 3 * sample_size:
+        return [(0, size)]
+    return [(0, sample_size), (size // 2 - sample_size // 2, sample_size), (size - sample_size, sample_size)]
+
+def _read_quick_fingerprint(filepath, size: Optional[int], sample_size: int, head_size: int = 0) -> Tuple[Optional[str], bytes]:
+    """returns (fingerprint, up to head_size bytes of the file start for mime sniffing), (None, b"") on failure"""
+    hasher = hashlib.blake2b(digest_size=16)
+    buf = _read_buffer(sample_size)
+    view = memoryview(buf)
+    head = b""
+    try:
+        with open(filepath, 'rb', buffering=0) as f:
+            if size is None:
+                size = os.fstat(f.fileno()).st_size
+            hasher.update(size.to_bytes(8, "little"))
+            for offset, length in _quick_fingerprint_ranges(size, sample_size):
+                f.seek(offset)
+                remaining = length
+                while remaining > 0:
+                    n = f.readinto(view[:min(remaining, sample_size)])
+                    if not n:
+                        break
+                    # the first range always starts at offset 0
+                    if offset == 0 and len(head) < head_size:
+                        head += bytes(view[:min(n, head_size - len(head))])
+                    hasher.update(view[:n])
+                    remaining -= n
+        return hasher.hexdigest(), head
+    except Exception:
+        return None, b""
+    finally:
+        view.release()
+
+def needs_full_hash_for_quick_fingerprint(size: int, sample_size=QUICK_FINGERPRINT_SAMPLE_SIZE) -> bool:
+    """small files are read completely by the quick fingerprint anyway, so hashing them fully costs nothing extra"""
+    return size <= 3 * sample_size
+
+def calculate_md5(filepath, block_size=DEFAULT_HASH_BLOCK_SIZE):
+    hashes = calculate_hashes(filepath, ("md5",), block_size)
+    return hashes["md5"] if hashes else None
+
+# =========================
+# MIME 类型
+# =========================
+# libmagic handles are not thread safe, every thread keeps its own
+_magic_handles = threading.local()
+# bytes handed to libmagic, the same as its default bytes_max when it reads a file itself
+MIME_SNIFF_BYTES = 1024 * 1024
+# extensions whose content type is reliable; once libmagic agreed MIME_EXTENSION_TRUST times in a row,
+# later files with that extension take the learned type without sniffing
+_TRUSTED_EXTENSIONS = {
+    ".jpg", ".jpeg", ".png", ".gif", ".heic", ".webp", ".tif", ".tiff", ".cr2", ".nef", ".arw", ".dng",
+    ".mp4", ".m4v", ".mov", ".mkv", ".avi", ".wmv", ".webm", ".mts", ".m2ts", ".3gp",
+    ".mp3", ".m4a", ".flac", ".wav", ".ogg", ".opus", ".aac",
+    ".pdf", ".zip", ".gz", ".7z", ".rar", ".epub",
+}
+MIME_EXTENSION_TRUST = 20
+_extension_mime: Dict[str, Tuple[str, int]] = {}
+_extension_mime_lock = threading.Lock()
+
+def _magic_handle():
+    handle = getattr(_magic_handles, "handle", None)
+    if handle is None:
+        handle = _magic_handles.handle = magic.Magic(mime=True)
+    return handle
+
+def _extension_of(filepath) -> str:
+    return os.path.splitext(str(filepath))[1].lower()
+
+def mime_type_from_extension(filepath) -> Optional[str]:
+    """the learned type of a trusted extension, None when the file has to be sniffed"""
+    learned = _extension_mime.get(_extension_of(filepath))
+    if learned and learned[1] >= MIME_EXTENSION_TRUST:
+        return learned[0]
+    return None
+
+def _learn_extension(filepath, mime_type: str) -> None:
+    ext = _extension_of(filepath)
+    if ext not in _TRUSTED_EXTENSIONS:
+        return
+    with _extension_mime_lock:
+        learned = _extension_mime.get(ext)
+        # a different answer starts counting again
+        count = learned[1] + 1 if learned and learned[0] == mime_type else 1
+        _extension_mime[ext] = (mime_type, count)
+
+def mime_type_from_buffer(filepath, head: bytes, size: int) -> str:
+    """mime type from the first bytes of a file that was read anyway, same answers as get_mime_type"""
+    if size == 0:
+        # from_file reports empty files by their inode, a buffer cannot tell
+        return 'inode/x-empty'
+    try:
+        mime_type = _magic_handle().from_buffer(bytes(head))
+    except Exception:
+        return 'application/octet-stream'
+    _learn_extension(filepath, mime_type)
+    return mime_type
+
 def get_mime_type(filepath):
+    mime_type = mime_type_from_extension(filepath)
+    if mime_type:
+        return mime_type
     try:
-        return magic.from_file(filepath, mime=True)
+        mime_type = _magic_handle().from_file(str(filepath))
     except Exception:
         return 'application/octet-stream'
+    _learn_extension(filepath, mime_type)
+    return mime_type
+
+def scan_file(filepath, size: int, algorithms=("md5",), full_hash: bool = True, block_size=DEFAULT_HASH_BLOCK_SIZE,
+              io_backend="auto", large_file_threshold=LARGE_FILE_THRESHOLD, sample_size=QUICK_FINGERPRINT_SAMPLE_SIZE,
+              timings: Optional[Dict[str, float]] = None) -> Tuple[Optional[str], Optional[Dict[str, str]], Optional[str]]:
+    """
+    mime type, digests and quick fingerprint from a single open of the file: returns (mime_type, hashes, quick_fp).
+    full_hash=False only reads the fingerprint samples and returns hashes={}; hashes is None when reading failed.
+    the fingerprint and the mime type are taken from the same blocks the digests are computed from,
+    so the values are identical to calculate_quick_fingerprint / get_mime_type.
+    timings: optional dict, the seconds spent in libmagic are added under 'mime'
+    """
+    mime_type = mime_type_from_extension(filepath)
+    head_size = 0 if mime_type else MIME_SNIFF_BYTES
+
+    def sniff(head: bytes) -> str:
+        start = time.perf_counter()
+        try:
+            return mime_type_from_buffer(filepath, head, size)
+        finally:
+            if timings is not None:
+                timings['mime'] = timings.get('mime', 0.0) + time.perf_counter() - start
+
+    if not full_hash:
+        quick_fp, head = _read_quick_fingerprint(filepath, size, sample_size, head_size)
+        if quick_fp is None:
+            return mime_type, None, None
+        return mime_type or sniff(head), {}, quick_fp
+
+    hashers = _new_hashers(algorithms)
+    fp_hasher = hashlib.blake2b(digest_size=16)
+    fp_hasher.update(size.to_bytes(8, "little"))
+    ranges = _quick_fingerprint_ranges(size, sample_size)
+    head = bytearray()
+    offset = 0
+    try:
+        for chunk in iter_file_blocks(filepath, block_size, io_backend, large_file_threshold):
+            n = len(chunk)
+            if len(head) < head_size:
+                head += chunk[:head_size - len(head)]
+            for hasher in hashers.values():
+                hasher.update(chunk)
+            for start, length in ranges:
+                lo, hi = max(start, offset), min(start + length, offset + n)
+                if lo < hi:
+                    fp_hasher.update(chunk[lo - offset:hi - offset])
+            offset += n
+    except Exception:
+        return mime_type, None, None
+    hashes = {algorithm: hasher.hexdigest() for algorithm, hasher in hashers.items()}
+    return mime_type or sniff(head), hashes, fp_hasher.hexdigest()
     
 # =========================
 # 自测
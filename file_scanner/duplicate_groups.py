@@ -0,0 +1,79 @@
+"""
+duplicate_group: one row per md5 shared by at least two live paths of file_inventory,
+kept up to date by the scanner and the verifier for every md5 they touch, so reports never scan file_inventory.
+
+    python -m file_scanner.duplicate_groups --rebuild
+"""
+import argparse
+from typing import Iterable
+
+from global_config.logger_config import logger
+from global_config.db_pool import pooled_connection
+
+# hardlinks share (machine, device, inode), only distinct inodes take space; rows without inode count as distinct
+INODE_KEY = "CASE WHEN inode IS NULL THEN 'id:' || id ELSE machine || ':' || device || ':' || inode END"
+
+# groups of the given md5s are recomputed from their live rows, groups that no longer have two paths are dropped
+REFRESH_SQL = """
+WITH g AS (
+    SELECT md5, MAX(size) AS size, COUNT(*) AS file_count, SUM(size) AS total_bytes, ARRAY_AGG(id ORDER BY id) AS member_ids,
+           COUNT(DISTINCT {inode_key}) AS inode_count
+    FROM {table_name}
+    WHERE deleted = 0 AND md5 = ANY(%(md5s)s)
+    GROUP BY md5
+    HAVING COUNT(DISTINCT path) > 1
+), dropped AS (
+    DELETE FROM duplicate_group d
+    WHERE d.md5 = ANY(%(md5s)s) AND NOT EXISTS (SELECT 1 FROM g WHERE g.md5 = d.md5)
+)
+INSERT INTO duplicate_group (md5, size, file_count, total_bytes, member_ids, inode_count, reclaimable_bytes, updated_at)
+SELECT md5, size, file_count, total_bytes, member_ids, inode_count, (inode_count - 1) * size, CURRENT_TIMESTAMP FROM g
+ON CONFLICT (md5) DO UPDATE SET
+    size = EXCLUDED.size, file_count = EXCLUDED.file_count, total_bytes = EXCLUDED.total_bytes,
+    member_ids = EXCLUDED.member_ids, inode_count = EXCLUDED.inode_count, reclaimable_bytes = EXCLUDED.reclaimable_bytes,
+    updated_at = CURRENT_TIMESTAMP;
+"""
+
+REBUILD_SQL = """
+INSERT INTO duplicate_group (md5, size, file_count, total_bytes, member_ids, inode_count, reclaimable_bytes, updated_at)
+SELECT md5, MAX(size), COUNT(*), SUM(size), ARRAY_AGG(id ORDER BY id),
+       COUNT(DISTINCT {inode_key}), (COUNT(DISTINCT {inode_key}) - 1) * MAX(size), CURRENT_TIMESTAMP
+FROM {table_name}
+WHERE deleted = 0 AND md5 IS NOT NULL
+GROUP BY md5
+HAVING COUNT(DISTINCT path) > 1;
+"""
+
+# md5s per refresh statement
+REFRESH_CHUNK_SIZE = 5000
+
+
+def refresh_duplicate_groups(cur, md5s: Iterable[str], table_name: str = 'file_inventory') -> int:
+    """recompute the groups of the touched md5s with the given cursor, returns the number of md5s refreshed"""
+    md5s = sorted({m for m in md5s if m})
+    for i in range(0, len(md5s), REFRESH_CHUNK_SIZE):
+        cur.execute(REFRESH_SQL.format(table_name=table_name, inode_key=INODE_KEY), {'md5s': md5s[i:i + REFRESH_CHUNK_SIZE]})
+    return len(md5s)
+
+
+def rebuild_duplicate_groups(dsn: str = None, table_name: str = 'file_inventory', **connect_kwargs) -> int:
+    """recompute every group in one transaction, for the first fill or after bulk changes outside the scanner"""
+    with pooled_connection(dsn, **connect_kwargs) as conn, conn.cursor() as cur:
+        cur.execute("TRUNCATE duplicate_group")
+        cur.execute(REBUILD_SQL.format(table_name=table_name, inode_key=INODE_KEY))
+        return cur.rowcount
+
+
+if __name__ == "__main__":
+    from global_config.config import yaml_config_boxed
+
+    parser = argparse.ArgumentParser(description="maintain the duplicate_group table")
+    parser.add_argument("--rebuild", action='store_true', help='recompute all groups from file_inventory')
+    parser.add_argument("--table_name", default='file_inventory')
+    args = parser.parse_args()
+
+    if args.rebuild:
+        count = rebuild_duplicate_groups(yaml_config_boxed.transcribe.db_conn, table_name=args.table_name)
+        logger.info(f"✅ 重建重复文件分组: {count}")
+    else:
+        parser.print_help()
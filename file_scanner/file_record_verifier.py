@@ -5,52 +5,144 @@ import psycopg2
 import yaml
 import magic
 import time
+import argparse
+from collections import defaultdict
 from psycopg2.extras import execute_batch
 from datetime import datetime
 
 from global_config.config import yaml_config_boxed
 from global_config.config import yaml_config
 from global_config.logger_config import logger
+from global_config.db_pool import configure_pool, pooled_connection
+from file_scanner.mount_path_utils import MountPathUtil
+from file_scanner.duplicate_groups import refresh_duplicate_groups
 
 DB_CONFIG_STR = yaml_config_boxed.transcribe.db_conn
+configure_pool(**(yaml_config_boxed.transcribe.get('db_pool') or {}))
+
+# ids per bulk UPDATE statement
+DELETE_CHUNK_SIZE = 10000
 
 def query_existing_records(start_id:int, limit:int=1000):
     try:
-        conn = psycopg2.connect(DB_CONFIG_STR)
-        with conn:
+        with pooled_connection(DB_CONFIG_STR) as conn:
             with conn.cursor() as cur:
                 cur.execute(f"SELECT id, path FROM file_inventory WHERE id > %s AND deleted = 0 order by id limit %s", (start_id, limit,))
                 rows = cur.fetchall()
-        conn.close()
         return rows
     except Exception as e:
         logger.info(f"❌ 查询旧记录失败: {str(e)}")
         return None
 
 
-def delete_illegal_record(file_id:int):
-    delete_old_row_sql = f"""
-UPDATE file_inventory
-SET deleted = 1, scanned_at = CURRENT_TIMESTAMP
-WHERE id= %s AND deleted = 0;
-"""
+def query_mount_records(mount_uuid:str):
+    """
+    all live rows of one volume as {relative parent dir: [(id, file name)]}, streamed through a server-side cursor
+    """
+    records = defaultdict(list)
     try:
-        conn = psycopg2.connect(DB_CONFIG_STR)
-        with conn:
-            with conn.cursor() as cur:
-                cur.execute(delete_old_row_sql, (file_id,))
-        conn.close()
+        with pooled_connection(DB_CONFIG_STR) as conn:
+            with conn.cursor(name="mount_records") as cur:
+                cur.itersize = 10000
+                cur.execute("SELECT id, relative_path FROM file_inventory WHERE mount_uuid = %s AND deleted = 0 AND relative_path IS NOT NULL", (mount_uuid,))
+                for file_id, relative_path in cur:
+                    parent, name = os.path.split(relative_path)
+                    records[parent].append((file_id, name))
+        return records
     except Exception as e:
-        logger.info(f"❌ 删除旧记录失败: {str(e)}")
+        logger.info(f"❌ 查询卷记录失败: {mount_uuid}, {str(e)}")
         return None
 
-start_id = 0
-rows = query_existing_records(start_id)
-while len(rows)>0:
-    logger.info(f'scanning from start_id:{start_id}')
-    
-    for file_id, path in rows:
-        if not os.path.exists(path):
-            delete_illegal_record(file_id)
-        start_id = file_id
+
+def delete_illegal_records(file_ids:list):
+    """mark rows deleted with one UPDATE per DELETE_CHUNK_SIZE ids, returns the number of rows changed"""
+    delete_old_rows_sql = f"""
+UPDATE file_inventory
+SET deleted = 1, scanned_at = CURRENT_TIMESTAMP
+WHERE id = ANY(%s) AND deleted = 0
+RETURNING md5;
+"""
+    deleted = 0
+    for i in range(0, len(file_ids), DELETE_CHUNK_SIZE):
+        chunk = file_ids[i:i + DELETE_CHUNK_SIZE]
+        try:
+            with pooled_connection(DB_CONFIG_STR) as conn:
+                with conn.cursor() as cur:
+                    cur.execute(delete_old_rows_sql, (chunk,))
+                    md5s = [r[0] for r in cur.fetchall()]
+                    deleted += len(md5s)
+        except Exception as e:
+            logger.info(f"❌ 删除旧记录失败: {str(e)}")
+            continue
+        try:
+            with pooled_connection(DB_CONFIG_STR) as conn:
+                with conn.cursor() as cur:
+                    refresh_duplicate_groups(cur, md5s)
+        except Exception as e:
+            logger.info(f"❌ 更新重复文件分组失败: {str(e)}")
+    return deleted
+
+
+def find_missing_ids(mount_path:str, records:dict):
+    """
+    list every directory that has rows once and diff the names, instead of one os.path.exists per row.
+    a directory that is gone takes all of its rows with it, an unreadable one is left alone
+    """
+    missing_ids = []
+    for parent, files in records.items():
+        dir_path = os.path.join(mount_path, parent)
+        try:
+            with os.scandir(dir_path) as it:
+                present = {entry.name for entry in it}
+        except (FileNotFoundError, NotADirectoryError):
+            present = set()
+        except OSError as e:
+            logger.info(f"❌ 无法读取目录, 跳过: {dir_path}, {str(e)}")
+            continue
+        missing_ids.extend(file_id for file_id, name in files if name not in present)
+    return missing_ids
+
+
+def verify_by_mount():
+    """check every mounted volume against its rows by (mount_uuid, relative_path), volumes not mounted here are skipped"""
+    mount_path_util = MountPathUtil.from_system()
+    seen_uuids = set()
+    for mount in mount_path_util.mount_points:
+        # same key as MountPathUtil.real_path_2_logical
+        mount_uuid = mount.partition_uuid if mount.partition_uuid else mount.uuid
+        if not mount_uuid or mount_uuid in seen_uuids:
+            continue
+        seen_uuids.add(mount_uuid)
+        records = query_mount_records(mount_uuid)
+        if not records:
+            continue
+        row_count = sum(len(files) for files in records.values())
+        logger.info(f'verifying mount_uuid:{mount_uuid}, mount_path:{mount.mount_path}, dirs:{len(records)}, rows:{row_count}')
+        missing_ids = find_missing_ids(mount.mount_path, records)
+        deleted = delete_illegal_records(missing_ids)
+        logger.info(f'✅ mount_uuid:{mount_uuid}, missing:{len(missing_ids)}, marked deleted:{deleted}')
+
+
+def verify_by_path():
+    """legacy mode: page through all rows and check the stored absolute path"""
+    start_id = 0
     rows = query_existing_records(start_id)
+    while rows:
+        logger.info(f'scanning from start_id:{start_id}')
+        missing_ids = [file_id for file_id, path in rows if not os.path.exists(path)]
+        if missing_ids:
+            delete_illegal_records(missing_ids)
+        start_id = rows[-1][0]
+        rows = query_existing_records(start_id)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="mark file_inventory rows of files that no longer exist as deleted")
+    parser.add_argument("--mode", choices=['mount', 'path'], default='mount',
+                        help='mount: diff every mounted volume by mount_uuid and relative_path; path: check the absolute path of every row')
+    args = parser.parse_args()
+
+    if args.mode == 'mount':
+        verify_by_mount()
+    else:
+        verify_by_path()
@@ -0,0 +1,367 @@
+"""
+watch mode: keep file_inventory current from inotify events instead of periodic full walks.
+
+    python -m file_scanner.scanner /mnt/disk --run_mode watch
+
+linux only (inotify through ctypes, no extra package). one watch per directory, so large trees may need
+    sysctl fs.inotify.max_user_watches=1048576
+"""
+import os
+import ctypes
+import ctypes.util
+import errno
+import select
+import struct
+import threading
+import time
+from dataclasses import replace
+from typing import Callable, Dict, List, Optional, Tuple
+
+from global_config.logger_config import logger
+from file_scanner.inventory_store import InventoryStore
+from file_scanner.mount_path_utils import MountPathUtil
+from file_scanner.walker import WalkRules, walk
+
+# <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONTFOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+              | IN_ONLYDIR | IN_DONTFOLLOW | IN_EXCL_UNLINK)
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class Inotify:
+    """minimal inotify binding: add_watch / rm_watch / read_events"""
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._poll = select.poll()
+        self._poll.register(self.fd, select.POLLIN)
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd: int):
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self, timeout_secs: float) -> List[Tuple[int, int, int, str]]:
+        """[(wd, mask, cookie, name)], empty after timeout_secs without events"""
+        if not self._poll.poll(max(int(timeout_secs * 1000), 0)):
+            return []
+        try:
+            data = os.read(self.fd, 1024 * 1024)
+        except BlockingIOError:
+            return []
+        events, offset = [], 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            events.append((wd, mask, cookie, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FsWatcher:
+    """
+    debounces file events and hands the quiet paths to scan_files() in batches, so a file written in many chunks
+    or saved several times in a row is hashed once. deletes and renames are written to file_inventory right away:
+    a rename keeps the row and its digests, a directory rename moves every row below it.
+    a move out of the watched roots counts as a delete, a move in as new files.
+    when the kernel queue overflows, events were lost and rescan() walks the roots incrementally.
+    rescans (the initial catch-up too) run on their own thread while the event loop keeps draining the queue,
+    overflows during a rescan are coalesced into one more rescan after it. while a rescan runs, the loop only
+    tracks watches: changed files, deletes and renames are written to file_inventory after it, so the two never
+    write the same path at the same time.
+    """
+
+    def __init__(self, root_dirs: List[str], store: InventoryStore, mount_path_util: MountPathUtil,
+                 scan_files: Callable[[List[str]], Dict[str, int]], rescan: Callable[[List[str]], Dict[str, int]],
+                 rules: Optional[WalkRules] = None, debounce_secs: float = 2.0, move_timeout_secs: float = 0.5,
+                 max_batch: int = 5000):
+        self.root_dirs = [os.path.normpath(os.path.abspath(r)) for r in root_dirs]
+        self.store = store
+        self.mount_path_util = mount_path_util
+        self.scan_files = scan_files
+        self.rescan = rescan
+        self.rules = rules or WalkRules()
+        self.debounce_secs = debounce_secs
+        self.move_timeout_secs = move_timeout_secs
+        self.max_batch = max_batch
+
+        self.inotify = Inotify()
+        self._wd_path: Dict[int, str] = {}
+        self._path_wd: Dict[str, int] = {}
+        # {path: monotonic time of its last event}
+        self._pending: Dict[str, float] = {}
+        # {cookie: (old path, is_dir, monotonic time)}, IN_MOVED_FROM waiting for its IN_MOVED_TO
+        self._moves: Dict[int, Tuple[str, bool, float]] = {}
+        self._deleted_files: List[str] = []
+        self._deleted_dirs: List[str] = []
+        # renames seen while a rescan runs, (old path, new path, is_dir) in event order
+        self._deferred_moves: List[Tuple[str, str, bool]] = []
+        self._rescan_lock = threading.Lock()
+        self._rescan_requested = False
+        self._rescan_thread: Optional[threading.Thread] = None
+        self._watch_limit_logged = False
+        self.counters = {'events': 0, 'scanned_batches': 0, 'deleted': 0, 'moved': 0, 'overflows': 0}
+
+    # === watches ===
+    def _root_of(self, path: str) -> Optional[str]:
+        for root in self.root_dirs:
+            if path == root or path.startswith(root.rstrip(os.sep) + os.sep):
+                return root
+        return None
+
+    def _accepted(self, path: str, is_dir: bool) -> bool:
+        root = self._root_of(path)
+        if root is None:
+            return False
+        name, rel_path = os.path.basename(path), os.path.relpath(path, root)
+        return self.rules.accept_dir(name, rel_path) if is_dir else self.rules.accept_file(name, rel_path)
+
+    def _add_watch(self, dir_path: str):
+        try:
+            wd = self.inotify.add_watch(dir_path)
+        except OSError as e:
+            if e.errno == errno.ENOSPC and not self._watch_limit_logged:
+                self._watch_limit_logged = True
+                logger.info(f"❌ inotify 监视数量已达上限, 请调大 fs.inotify.max_user_watches: {dir_path}")
+            elif e.errno != errno.ENOSPC:
+                logger.info(f"❌ 无法监视目录: {dir_path}, {str(e)}")
+            return
+        self._wd_path[wd] = dir_path
+        self._path_wd[dir_path] = wd
+
+    def _add_tree(self, dir_path: str, queue_files: bool):
+        """watch every directory below dir_path; queue_files for directories created or moved in while watching"""
+        root = self._root_of(dir_path)
+        # the rules are relative to the watched root, max_depth counts from there as well
+        rules = self.rules
+        if rules.max_depth is not None and root and dir_path != root:
+            depth = len(os.path.relpath(dir_path, root).split(os.sep))
+            if depth > rules.max_depth:
+                return
+            rules = replace(rules, max_depth=max(rules.max_depth - depth, 0))
+        now = time.monotonic()
+        for sub_dir, file_entries in walk(dir_path, rules):
+            self._add_watch(sub_dir)
+            if queue_files:
+                for entry in file_entries:
+                    self._pending[entry.path] = now
+
+    def _forget_tree(self, dir_path: str):
+        prefix = dir_path.rstrip(os.sep) + os.sep
+        for path in [p for p in self._path_wd if p == dir_path or p.startswith(prefix)]:
+            wd = self._path_wd.pop(path)
+            self._wd_path.pop(wd, None)
+            self.inotify.rm_watch(wd)
+
+    def _rename_tree(self, old_dir: str, new_dir: str):
+        """watches follow the inode, only the path bookkeeping changes"""
+        old_prefix = old_dir.rstrip(os.sep) + os.sep
+        for path in [p for p in self._path_wd if p == old_dir or p.startswith(old_prefix)]:
+            new_path = new_dir + path[len(old_dir):]
+            wd = self._path_wd.pop(path)
+            self._path_wd[new_path] = wd
+            self._wd_path[wd] = new_path
+        for path in [p for p in self._pending if p.startswith(old_prefix)]:
+            self._pending[new_dir + path[len(old_dir):]] = self._pending.pop(path)
+
+    # === events ===
+    def _handle(self, wd: int, mask: int, cookie: int, name: str, now: float):
+        if mask & IN_Q_OVERFLOW:
+            self.counters['overflows'] += 1
+            logger.info("❌ inotify 事件队列溢出, 重新增量扫描所有目录")
+            self._request_rescan()
+            return
+        dir_path = self._wd_path.get(wd)
+        if dir_path is None:
+            return
+        if mask & (IN_IGNORED | IN_DELETE_SELF):
+            if mask & IN_IGNORED:
+                self._wd_path.pop(wd, None)
+                if self._path_wd.get(dir_path) == wd:
+                    self._path_wd.pop(dir_path)
+            return
+        path = os.path.join(dir_path, name)
+        is_dir = bool(mask & IN_ISDIR)
+        if not self._accepted(path, is_dir):
+            return
+
+        if mask & IN_MOVED_FROM:
+            self._moves[cookie] = (path, is_dir, now)
+        elif mask & IN_MOVED_TO:
+            move = self._moves.pop(cookie, None)
+            if move:
+                self._apply_move(move[0], path, is_dir, now)
+            elif is_dir:
+                self._add_tree(path, queue_files=True)
+            else:
+                self._pending[path] = now
+        elif mask & IN_DELETE:
+            if is_dir:
+                self._deleted_dirs.append(path)
+            else:
+                self._pending.pop(path, None)
+                self._deleted_files.append(path)
+        elif mask & IN_CREATE and is_dir:
+            # files created before the watch is in place are picked up by the walk
+            self._add_tree(path, queue_files=True)
+        elif not is_dir:
+            # IN_CREATE (also new hardlinks), IN_MODIFY, IN_CLOSE_WRITE
+            self._pending[path] = now
+
+    def _apply_move(self, old_path: str, new_path: str, is_dir: bool, now: float):
+        if is_dir:
+            self._rename_tree(old_path, new_path)
+        if self._rescanning():
+            self._deferred_moves.append((old_path, new_path, is_dir))
+            if not is_dir:
+                # hashed after the rescan, the moved row is found unchanged and skipped
+                self._pending.pop(old_path, None)
+                self._pending[new_path] = now
+            return
+        self._store_move(old_path, new_path, is_dir, now)
+
+    def _store_move(self, old_path: str, new_path: str, is_dir: bool, now: float):
+        logical = self.mount_path_util.real_path_2_logical(new_path)
+        mount_uuid, relative_path = logical if logical else (None, None)
+        moved = self.store.move(old_path, new_path, mount_uuid, relative_path, is_dir=is_dir)
+        if moved:
+            self.counters['moved'] += moved
+        if not is_dir and (self._pending.pop(old_path, None) is not None or not moved):
+            # still being written, or never recorded (e.g. the temp file of an atomic save)
+            self._pending[new_path] = now
+        logger.info(f"> 重命名: {old_path} -> {new_path}, 记录数量: {moved}")
+
+    def _expire_moves(self, now: float):
+        """an IN_MOVED_FROM without IN_MOVED_TO left the watched roots"""
+        for cookie, (old_path, is_dir, at) in list(self._moves.items()):
+            if now - at < self.move_timeout_secs:
+                continue
+            del self._moves[cookie]
+            if is_dir:
+                self._forget_tree(old_path)
+                self._deleted_dirs.append(old_path)
+                prefix = old_path.rstrip(os.sep) + os.sep
+                for path in [p for p in self._pending if p.startswith(prefix)]:
+                    del self._pending[path]
+            else:
+                self._pending.pop(old_path, None)
+                self._deleted_files.append(old_path)
+
+    # === rescans ===
+    def _request_rescan(self):
+        """starts a rescan thread, or makes the running one walk the roots once more when it is done"""
+        with self._rescan_lock:
+            self._rescan_requested = True
+            if self._rescan_thread is None:
+                self._rescan_thread = threading.Thread(target=self._rescan_loop, name='watch-rescan', daemon=True)
+                self._rescan_thread.start()
+
+    def _rescan_loop(self):
+        while True:
+            with self._rescan_lock:
+                if not self._rescan_requested:
+                    self._rescan_thread = None
+                    return
+                self._rescan_requested = False
+            try:
+                counters = self.rescan(self.root_dirs)
+                logger.info(f"✅ 增量扫描完成: {counters}")
+            except Exception as e:
+                logger.exception(f"❌ 增量扫描失败: {e}")
+
+    def _rescanning(self) -> bool:
+        with self._rescan_lock:
+            return self._rescan_thread is not None
+
+    def _flush_moves(self, now: float):
+        moves, self._deferred_moves = self._deferred_moves, []
+        for old_path, new_path, is_dir in moves:
+            self._store_move(old_path, new_path, is_dir, now)
+
+    def _flush_deletes(self):
+        if not self._deleted_files and not self._deleted_dirs:
+            return
+        deleted = self.store.mark_deleted(self._deleted_files, self._deleted_dirs)
+        if deleted is not None:
+            self.counters['deleted'] += deleted
+            logger.info(f"> 标记删除: 文件 {len(self._deleted_files)}, 目录 {len(self._deleted_dirs)}, 记录数量: {deleted}")
+        self._deleted_files, self._deleted_dirs = [], []
+
+    def _flush_pending(self, now: float):
+        due = [p for p, at in self._pending.items() if now - at >= self.debounce_secs]
+        for i in range(0, len(due), self.max_batch):
+            batch = due[i:i + self.max_batch]
+            for path in batch:
+                del self._pending[path]
+            self.counters['scanned_batches'] += 1
+            counters = self.scan_files(batch)
+            logger.info(f"> 已处理变更文件: {len(batch)}, {counters}")
+
+    def _next_timeout(self, now: float) -> float:
+        deadlines = [at + self.move_timeout_secs for _, _, at in self._moves.values()]
+        if not self._rescanning():
+            # nothing is flushed while a rescan runs, only the move timeouts matter then
+            deadlines += [at + self.debounce_secs for at in self._pending.values()]
+        return min([1.0] + [max(d - now, 0.0) for d in deadlines])
+
+    def run(self, stop: Optional[threading.Event] = None, initial_scan: bool = True):
+        """
+        blocks until stop is set; initial_scan walks the roots once to catch up, in the background
+        after the watches are in place, so nothing changed during the walk is missed
+        """
+        stop = stop or threading.Event()
+        for root in self.root_dirs:
+            self._add_tree(root, queue_files=False)
+        logger.info(f"✅ 开始监视目录: {self.root_dirs}, 监视数量: {len(self._wd_path)}")
+        if initial_scan:
+            self._request_rescan()
+        try:
+            while not stop.is_set():
+                now = time.monotonic()
+                for wd, mask, cookie, name in self.inotify.read_events(self._next_timeout(now)):
+                    self.counters['events'] += 1
+                    self._handle(wd, mask, cookie, name, time.monotonic())
+                now = time.monotonic()
+                self._expire_moves(now)
+                if self._rescanning():
+                    continue
+                self._flush_moves(now)
+                self._flush_deletes()
+                self._flush_pending(now)
+        finally:
+            with self._rescan_lock:
+                rescan_thread = self._rescan_thread
+            if rescan_thread:
+                rescan_thread.join()
+            self.inotify.close()
+            logger.info(f"> 停止监视: {self.counters}")
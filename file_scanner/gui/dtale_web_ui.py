@@ -50,6 +50,14 @@ GROUP BY fi.deleted, TO_CHAR(fi.scanned_at, 'yyyy-mm-dd HH24')
 ORDER BY ymdh_scanned_at
 """
 
+# 扫描吞吐量, written by scanner.py every report interval (mount_uuid IS NULL is the whole scan)
+SQL_QUERY_METRICS = """
+SELECT sm.recorded_at, sm.machine, sm.files_per_sec, sm.bytes_per_sec / 1048576.0 AS mib_per_sec, sm.rows_per_sec
+FROM scan_metrics sm
+WHERE sm.mount_uuid IS NULL AND sm.recorded_at >= NOW() - INTERVAL '24 HOURS'
+ORDER BY sm.recorded_at
+"""
+
 # 初始化 Dash 应用
 app = dash.Dash(__name__)
 app.title = "PostgreSQL 实时柱状图"
@@ -73,6 +81,8 @@ app.layout = html.Div([
     dcc.Graph(id='bar-chart-1'),
     html.Hr(),
     dcc.Graph(id='bar-chart-2'),
+    html.Hr(),
+    dcc.Graph(id='line-chart-metrics'),
 
     dcc.Interval(
         id='interval-component',
@@ -86,6 +96,7 @@ app.layout = html.Div([
     Output('bar-chart-1', 'figure'),
     Output('bar-chart-2', 'figure'),
     Output('stat-panel', 'children'),
+    Output('line-chart-metrics', 'figure'),
     Input('interval-component', 'n_intervals')
 )
 def update_graph(n):
@@ -136,11 +147,25 @@ def update_graph(n):
         now_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         stat_text = f"当前时间：{now_str} ｜ 近几天文件总数（按 deleted 分类）：\n" + "\n".join(daily_stat_lines)
 
-        return fig1, fig2, stat_text
+        return fig1, fig2, stat_text, metrics_figure()
 
     except Exception as e:
         logger.exception("刷新出错：")
-        return dash.no_update, dash.no_update, dash.no_update
+        return dash.no_update, dash.no_update, dash.no_update, dash.no_update
+
+def metrics_figure():
+    # scan_metrics may not exist yet, that must not break the other charts
+    try:
+        df = pd.read_sql(SQL_QUERY_METRICS, engine)
+    except Exception:
+        logger.exception("查询 scan_metrics 出错：")
+        return dash.no_update
+    df = df.melt(id_vars=['recorded_at', 'machine'], value_vars=['files_per_sec', 'mib_per_sec', 'rows_per_sec'],
+                 var_name='metric', value_name='value')
+    fig = px.line(df, x='recorded_at', y='value', color='metric', line_dash='machine',
+                  title='近 24 小时扫描吞吐量（文件/秒, MiB/秒, 写入行/秒）')
+    fig.update_layout(xaxis_title='时间', yaxis_title='速率')
+    return fig
 
 # 启动服务器
 if __name__ == '__main__':
@@ -14,106 +14,101 @@ DB_CONFIG = {
     "password": yaml_config_boxed.gui.postgres.password
 }
 
-# 三个 SQL 查询
-SQL_DUPLICATE_FILES = """
-SELECT * FROM file_inventory fi
-WHERE fi.deleted = 0
-  AND EXISTS (
-      SELECT 1 FROM file_inventory f
-      WHERE f.deleted = 0
-        AND f.md5 = fi.md5
-        AND f.path != fi.path
-  )
-ORDER BY size DESC;
+# 查询 duplicate_group（由 scanner / file_record_verifier 增量维护，首次使用前执行
+# python -m file_scanner.duplicate_groups --rebuild），分页在数据库端完成
+SQL_GROUP_SUMMARY = """
+SELECT COUNT(*) AS group_count,
+       COALESCE(SUM(file_count), 0) AS file_count,
+       COALESCE(SUM(total_bytes), 0) AS all_sum_size,
+       COALESCE(SUM(size), 0) AS distinctive_sum_size,
+       COALESCE(SUM(reclaimable_bytes), 0) AS reclaimable_size
+FROM duplicate_group;
 """
 
-SQL_ALL_SUM_SIZE = """
-SELECT SUM(size) AS all_sum_size
-FROM file_inventory fi
-WHERE fi.deleted = 0
-  AND EXISTS (
-      SELECT 1 FROM file_inventory f
-      WHERE f.deleted = 0
-        AND f.md5 = fi.md5
-        AND f.path != fi.path
-  );
+SQL_GROUP_PAGE = """
+SELECT md5, size, file_count, total_bytes, inode_count, reclaimable_bytes
+FROM duplicate_group
+ORDER BY size DESC, md5
+LIMIT %(limit)s OFFSET %(offset)s;
 """
 
-SQL_DISTINCTIVE_SUM_SIZE = """
-SELECT SUM(size) AS distinctive_sum_size FROM (
-  SELECT DISTINCT fi.md5, fi.size
-  FROM file_inventory fi
-  WHERE fi.deleted = 0
-    AND EXISTS (
-        SELECT 1 FROM file_inventory f
-        WHERE f.deleted = 0
-          AND f.md5 = fi.md5
-          AND f.path != fi.path
-    )
-) t;
+SQL_GROUP_MEMBERS = """
+SELECT fi.*
+FROM duplicate_group g
+JOIN file_inventory fi ON fi.id = ANY(g.member_ids)
+WHERE g.md5 = ANY(%(md5s)s) AND fi.deleted = 0
+ORDER BY fi.size DESC, fi.md5, fi.path;
 """
 
+# 每页分组数量
+GROUPS_PER_PAGE = 100
+
 # 页面标题
 st.title("📂 重复文件分析报表")
 
-# 连接数据库并查询
-@st.cache_data(ttl=300)
-def run_queries():
+def read_sql(sql, params=None):
     conn = psycopg2.connect(**DB_CONFIG)
-    df_duplicates = pd.read_sql(SQL_DUPLICATE_FILES, conn)
-    sum_all = pd.read_sql(SQL_ALL_SUM_SIZE, conn)
-    sum_distinct = pd.read_sql(SQL_DISTINCTIVE_SUM_SIZE, conn)
-    conn.close()
-    return df_duplicates, sum_all.iloc[0, 0], sum_distinct.iloc[0, 0]
+    try:
+        return pd.read_sql(sql, conn, params=params)
+    finally:
+        conn.close()
+
+@st.cache_data(ttl=300)
+def query_summary():
+    return read_sql(SQL_GROUP_SUMMARY).iloc[0]
+
+@st.cache_data(ttl=300)
+def query_page(page: int):
+    df_groups = read_sql(SQL_GROUP_PAGE, {'limit': GROUPS_PER_PAGE, 'offset': (page - 1) * GROUPS_PER_PAGE})
+    if df_groups.empty:
+        return df_groups, df_groups
+    df_members = read_sql(SQL_GROUP_MEMBERS, {'md5s': df_groups['md5'].tolist()})
+    # 同一分组内与前面某行共享 inode 的路径是硬链接，不是真正的副本
+    df_members.insert(0, 'hardlink', df_members.duplicated(['md5', 'machine', 'device', 'inode']) & df_members['inode'].notna())
+    return df_groups, df_members
 
 # 执行查询
 with st.spinner("正在加载数据..."):
-    df_duplicates, all_sum, distinct_sum = run_queries()
+    summary = query_summary()
+
+all_sum = int(summary['all_sum_size'])
+distinct_sum = int(summary['distinctive_sum_size'])
+# 硬链接不占额外空间，只有不同 inode 的副本才能节省
+reclaimable_sum = int(summary['reclaimable_size'])
 
 # 显示统计信息
 st.subheader("📊 重复文件大小统计")
 st.metric(label="所有重复文件大小总和", value=f"{all_sum / (1024**3):.2f} GB")
 st.metric(label="去重后的大小总和", value=f"{distinct_sum / (1024**3):.2f} GB")
-st.metric(label="可节省空间", value=f"{(all_sum - distinct_sum) / (1024**3):.2f} GB")
-
-# 展示重复文件列表
-# st.subheader("📁 重复文件列表")
-# st.dataframe(df_duplicates, use_container_width=True)
-
-# pd.set_option("styler.render.max_elements", 10_000_000)  # 或更大
+st.metric(label="可节省空间（不含硬链接）", value=f"{reclaimable_sum / (1024**3):.2f} GB")
+st.metric(label="硬链接副本大小（不占空间）", value=f"{(all_sum - distinct_sum - reclaimable_sum) / (1024**3):.2f} GB")
+st.caption(f"重复分组: {int(summary['group_count']):,}，重复文件: {int(summary['file_count']):,}")
 
 # 高亮重复文件：同一 md5 分组，第一个文件为正常颜色，其余为浅红色背景
 def highlight_duplicates(df):
-    styles = pd.DataFrame('', index=df.index, columns=df.columns)
-    for md5, group in df.groupby('md5'):
-        if len(group) > 1:
-            for i, idx in enumerate(group.index):
-                if i > 0:  # 除了第一个，其余设置浅红色背景
-                    styles.loc[idx, :] = 'background-color: #ffe6e6'
-    return styles
-
-# 重新设置索引顺序（防止混乱）
-df_duplicates_sorted = df_duplicates.sort_values(by=['size', 'md5', 'path'],ascending=[False,True,True])
-
-# st.subheader("📁 重复文件列表（相同md5文件高亮显示）")
-# st.dataframe(
-#     df_duplicates_sorted.style.apply(highlight_duplicates, axis=None),
-#     use_container_width=True
-# )
-
-MAX_ROWS = 500
-df_show = df_duplicates_sorted.head(MAX_ROWS)
-
-st.subheader(f"📁 重复文件列表（前 {MAX_ROWS} 条，高亮显示）")
-st.dataframe(
-    df_show.style.apply(highlight_duplicates, axis=None),
-    use_container_width=True
-)
-
-# 允许下载完整结果（未加颜色）
-st.download_button(
-    label="📥 下载完整重复文件列表 CSV",
-    data=df_duplicates_sorted.to_csv(index=False),
-    file_name="duplicate_files.csv",
-    mime="text/csv"
-)
+    first_of_group = ~df['md5'].duplicated()
+    return pd.DataFrame([[''] * len(df.columns) if first else ['background-color: #ffe6e6'] * len(df.columns)
+                         for first in first_of_group], index=df.index, columns=df.columns)
+
+page_count = max(1, -(-int(summary['group_count']) // GROUPS_PER_PAGE))
+page = st.number_input(f"页码（共 {page_count} 页，每页 {GROUPS_PER_PAGE} 组）", min_value=1, max_value=page_count, value=1, step=1)
+
+with st.spinner("正在加载数据..."):
+    df_groups, df_members = query_page(int(page))
+
+st.subheader(f"📁 重复文件列表（第 {page} 页，高亮显示）")
+if df_members.empty:
+    st.info("没有重复文件")
+else:
+    st.dataframe(
+        df_members.style.apply(highlight_duplicates, axis=None),
+        use_container_width=True
+    )
+
+    # 下载当前页（未加颜色）
+    st.download_button(
+        label="📥 下载当前页重复文件列表 CSV",
+        data=df_members.to_csv(index=False),
+        file_name=f"duplicate_files_page_{page}.csv",
+        mime="text/csv"
+    )
@@ -0,0 +1,118 @@
+import os
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from global_config.logger_config import logger
+
+DEFAULT_INODE_CACHE_DB = os.path.join(os.path.expanduser('~'), '.cache', 'file_scanner', 'inode_digests.sqlite3')
+
+# (mime_type, hashes, quick_fp) as returned by device_utils.scan_file
+ScanValue = Tuple[Optional[str], Dict[str, str], Optional[str]]
+
+
+class InodeCache:
+    """
+    digests of hardlinked files (st_nlink > 1) by inode, so every inode is read once per scan however many paths it has.
+    in memory the key is (st_dev, st_ino, size, mtime_ns); with db_path the values are also kept in a sqlite file
+    keyed by (mount_uuid, inode, size, mtime_ns), so the next snapshot of an rsnapshot / Time Machine tree, whose paths
+    are all new, still reuses them.
+    a thread that finds an inode being hashed by another thread waits for that result instead of reading it again.
+    the memory part keeps the max_entries most recently used inodes, watch and worker mode keep one cache for the life
+    of the process; an evicted entry is read again from the sqlite file, or hashed again without one.
+    """
+
+    COMMIT_EVERY = 1000
+
+    def __init__(self, db_path: str = None, max_entries: int = 100000):
+        self._lock = threading.Lock()
+        self.max_entries = max(1, int(max_entries))
+        self._done: "OrderedDict[tuple, ScanValue]" = OrderedDict()
+        self._inflight: Dict[tuple, threading.Event] = {}
+        self.conn = None
+        self._pending_commits = 0
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+            self.conn = sqlite3.connect(db_path, check_same_thread=False)
+            self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS inode_digest (
+                mount_uuid TEXT NOT NULL,
+                inode INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                mime_type TEXT,
+                hashes TEXT NOT NULL,
+                quick_fp TEXT,
+                PRIMARY KEY (mount_uuid, inode, size, mtime_ns)
+            )""")
+            self.conn.commit()
+
+    @staticmethod
+    def _usable(value: ScanValue, full_hash: bool) -> bool:
+        # a fingerprint-only value cannot serve a path that needs full digests
+        return bool(value[1]) or not full_hash
+
+    def _load(self, db_key: tuple) -> Optional[ScanValue]:
+        if self.conn is None or db_key is None:
+            return None
+        row = self.conn.execute("SELECT mime_type, hashes, quick_fp FROM inode_digest "
+                                "WHERE mount_uuid = ? AND inode = ? AND size = ? AND mtime_ns = ?", db_key).fetchone()
+        return (row[0], json.loads(row[1]), row[2]) if row else None
+
+    def claim(self, key: tuple, db_key: Optional[tuple], full_hash: bool) -> Optional[ScanValue]:
+        """
+        returns the known value, or None when the caller has to compute it and then call publish(key, db_key, value)
+        """
+        while True:
+            with self._lock:
+                value = self._done.get(key)
+                if value is None:
+                    value = self._load(db_key)
+                    if value is not None:
+                        self._remember(key, value)
+                else:
+                    self._done.move_to_end(key)
+                if value is not None and self._usable(value, full_hash):
+                    return value
+                event = self._inflight.get(key)
+                if event is None:
+                    self._inflight[key] = threading.Event()
+                    return None
+            event.wait()
+
+    def _remember(self, key: tuple, value: ScanValue):
+        self._done[key] = value
+        self._done.move_to_end(key)
+        while len(self._done) > self.max_entries:
+            self._done.popitem(last=False)
+
+    def publish(self, key: tuple, db_key: Optional[tuple], value: Optional[ScanValue]):
+        """value None (read failed) wakes the waiters, one of them claims the inode and retries"""
+        with self._lock:
+            if value is not None and value[1] is not None:
+                self._remember(key, value)
+                if self.conn is not None and db_key is not None:
+                    self.conn.execute("INSERT OR REPLACE INTO inode_digest VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                      (*db_key, value[0], json.dumps(value[1]), value[2]))
+                    self._pending_commits += 1
+                    if self._pending_commits >= self.COMMIT_EVERY:
+                        self.conn.commit()
+                        self._pending_commits = 0
+            event = self._inflight.pop(key, None)
+        if event:
+            event.set()
+
+    def flush(self):
+        with self._lock:
+            if self.conn is not None:
+                self.conn.commit()
+                self._pending_commits = 0
+
+    def close(self):
+        self.flush()
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        logger.info(f"> inode 缓存条目数量: {len(self._done)}")
@@ -0,0 +1,240 @@
+import os
+from typing import Dict, List, Optional, Tuple
+
+from psycopg2.extras import execute_batch
+
+from global_config.logger_config import logger
+from global_config.db_pool import pooled_connection
+from global_config.pg_bulk import bulk_insert, bulk_update
+from file_scanner.duplicate_groups import refresh_duplicate_groups
+
+# column order of the insert and stat update tuples built by the scan pipeline
+INSERT_COLUMNS = ('machine', 'path', 'mime_type', 'md5', 'size', 'scan_duration_secs', 'mount_uuid', 'relative_path',
+                  'mtime_ns', 'inode', 'device', 'xxh3_128', 'blake3', 'quick_fp', 'nlink')
+UPDATE_STAT_COLUMNS = ('mtime_ns', 'inode', 'device', 'xxh3_128', 'blake3', 'quick_fp', 'nlink', 'id')
+
+
+def _like_prefix(dir_path: str) -> str:
+    escaped = dir_path.rstrip(os.sep).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped + os.sep + '%'
+
+
+class InventoryStore:
+    """
+    reads and writes rows of file_inventory for the scanner, every call borrows a pooled connection
+    """
+
+    def __init__(self, db_config: dict, table_name: str = 'file_inventory', prefetch_itersize: int = 10000,
+                 write_backend: str = 'copy', duplicate_groups: bool = True):
+        self.db_config = db_config
+        self.table_name = table_name
+        self.prefetch_itersize = prefetch_itersize
+        # 'copy': COPY into a staging table and merge with one statement, 'batch': execute_batch of single-row statements
+        self.write_backend = write_backend
+        # refresh duplicate_group for every md5 a write adds or removes
+        self.duplicate_groups = duplicate_groups
+
+        self.insert_sql = f"""
+        INSERT INTO {table_name} (machine, path, mime_type, md5, size, scanned_at, gmt_create, scan_duration_secs, deleted, mount_uuid, relative_path, mtime_ns, inode, device, xxh3_128, blake3, quick_fp, nlink)
+        VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, %s, 0, %s, %s, %s, %s, %s, %s, %s, %s, %s);
+        """
+
+        self.mark_old_sql = f"""
+        UPDATE {table_name}
+        SET deleted = 1, scanned_at = CURRENT_TIMESTAMP
+        WHERE path = ANY(%s) AND deleted = 0
+        RETURNING md5;
+        """
+
+        # rows written before incremental mode have no stat columns (or before multi hashing no fast hashes),
+        # fill them in once the md5 is confirmed
+        self.update_stat_sql = f"""
+        UPDATE {table_name}
+        SET mtime_ns = %s, inode = %s, device = %s, scanned_at = CURRENT_TIMESTAMP,
+            xxh3_128 = COALESCE(%s, xxh3_128), blake3 = COALESCE(%s, blake3), quick_fp = COALESCE(%s, quick_fp),
+            nlink = %s
+        WHERE id = %s;
+        """
+
+        # full digests of rows whose quick fingerprint collided
+        self.update_hashes_sql = f"""
+        UPDATE {table_name}
+        SET md5 = %s, xxh3_128 = COALESCE(%s, xxh3_128), blake3 = COALESCE(%s, blake3), scanned_at = CURRENT_TIMESTAMP
+        WHERE id = %s AND deleted = 0;
+        """
+
+        self.update_quick_fp_sql = f"""
+        UPDATE {table_name}
+        SET quick_fp = %s
+        WHERE id = %s AND deleted = 0;
+        """
+
+    def load_existing_records(self, dir_path: str, recursive: bool = False) -> Optional[Dict[str, Tuple]]:
+        """
+        stream all live rows under dir_path in one query through a server-side cursor,
+        returns {path: (md5, size, id, mtime_ns, inode, device, quick_fp)}, or None if the query failed.
+        recursive=False only keeps the files directly inside dir_path.
+        """
+        sql = f"SELECT path, md5, size, id, mtime_ns, inode, device, quick_fp FROM {self.table_name} WHERE deleted = 0 AND path LIKE %s"
+        params = [_like_prefix(dir_path)]
+        if not recursive:
+            sql += " AND strpos(substr(path, %s), %s) = 0"
+            params += [len(dir_path.rstrip(os.sep)) + 2, os.sep]
+        records = {}
+        try:
+            with pooled_connection(**self.db_config) as conn:
+                with conn.cursor(name="existing_records") as cur:
+                    cur.itersize = self.prefetch_itersize
+                    cur.execute(sql, params)
+                    for row in cur:
+                        records[row[0]] = row[1:]
+            return records
+        except Exception as e:
+            logger.info(f"❌ 查询旧记录失败: {dir_path}, {str(e)}")
+            return None
+
+    def write(self, old_paths: List[str], insert_records: List[tuple], update_records: List[tuple]) -> bool:
+        """
+        write one batch in one transaction: old rows of changed files are marked deleted before their new rows are inserted
+        """
+        touched_md5s = [r[3] for r in insert_records]
+        try:
+            with pooled_connection(**self.db_config) as conn, conn.cursor() as cur:
+                if old_paths:
+                    cur.execute(self.mark_old_sql, (old_paths,))
+                    touched_md5s += [r[0] for r in cur.fetchall()]
+                if self.write_backend == 'copy':
+                    if insert_records:
+                        bulk_insert(cur, self.table_name, INSERT_COLUMNS, insert_records,
+                                    constants={'scanned_at': 'CURRENT_TIMESTAMP', 'gmt_create': 'CURRENT_TIMESTAMP', 'deleted': '0'})
+                    if update_records:
+                        bulk_update(cur, self.table_name, 'id', UPDATE_STAT_COLUMNS, update_records,
+                                    assignments={'scanned_at': 'CURRENT_TIMESTAMP',
+                                                 'xxh3_128': 'COALESCE(s.xxh3_128, t.xxh3_128)',
+                                                 'blake3': 'COALESCE(s.blake3, t.blake3)',
+                                                 'quick_fp': 'COALESCE(s.quick_fp, t.quick_fp)'})
+                else:
+                    if insert_records:
+                        execute_batch(cur, self.insert_sql, insert_records)
+                    if update_records:
+                        execute_batch(cur, self.update_stat_sql, update_records)
+        except Exception as e:
+            logger.info(f"❌ 批量写入失败: {str(e)}")
+            return False
+        self.refresh_duplicate_groups(touched_md5s)
+        return True
+
+    def mark_deleted(self, paths: List[str] = (), dir_paths: List[str] = ()) -> Optional[int]:
+        """
+        mark the rows of removed files, and of every file below removed directories, as deleted right away (watch mode).
+        returns the number of rows changed, or None if the update failed
+        """
+        sql = f"""
+        UPDATE {self.table_name}
+        SET deleted = 1, scanned_at = CURRENT_TIMESTAMP
+        WHERE deleted = 0 AND (path = ANY(%s) OR path LIKE ANY(%s))
+        RETURNING md5;
+        """
+        if not paths and not dir_paths:
+            return 0
+        try:
+            with pooled_connection(**self.db_config) as conn, conn.cursor() as cur:
+                cur.execute(sql, (list(paths), [_like_prefix(d) for d in dir_paths]))
+                md5s = [r[0] for r in cur.fetchall()]
+        except Exception as e:
+            logger.info(f"❌ 标记删除失败: {str(e)}")
+            return None
+        self.refresh_duplicate_groups(md5s)
+        return len(md5s)
+
+    def move(self, old_path: str, new_path: str, mount_uuid: Optional[str], relative_path: Optional[str],
+             is_dir: bool = False) -> Optional[int]:
+        """
+        rename within one volume (watch mode): the rows keep their digests and only get the new path.
+        a file renamed over an existing one (atomic save) replaces that row, a directory carries every row below it.
+        returns the number of rows moved, or None if the update failed
+        """
+        if is_dir:
+            old_prefix = old_path.rstrip(os.sep)
+            sql = f"""
+            UPDATE {self.table_name}
+            SET path = %(new)s || substr(path, %(cut)s), mount_uuid = %(mount_uuid)s,
+                relative_path = CASE WHEN %(relative_path)s IS NULL THEN NULL ELSE %(relative_path)s || substr(path, %(cut)s) END,
+                scanned_at = CURRENT_TIMESTAMP
+            WHERE deleted = 0 AND path LIKE %(like)s;
+            """
+            params = {'new': new_path.rstrip(os.sep), 'cut': len(old_prefix) + 1, 'mount_uuid': mount_uuid,
+                      'relative_path': relative_path.rstrip(os.sep) if relative_path is not None else None,
+                      'like': _like_prefix(old_prefix)}
+        else:
+            sql = f"""
+            UPDATE {self.table_name}
+            SET path = %(new)s, mount_uuid = %(mount_uuid)s, relative_path = %(relative_path)s, scanned_at = CURRENT_TIMESTAMP
+            WHERE deleted = 0 AND path = %(old)s;
+            """
+            params = {'new': new_path, 'old': old_path, 'mount_uuid': mount_uuid, 'relative_path': relative_path}
+        replaced_md5s = []
+        try:
+            with pooled_connection(**self.db_config) as conn, conn.cursor() as cur:
+                if not is_dir:
+                    cur.execute(self.mark_old_sql, ([new_path],))
+                    replaced_md5s = [r[0] for r in cur.fetchall()]
+                cur.execute(sql, params)
+                moved = cur.rowcount
+        except Exception as e:
+            logger.info(f"❌ 更新重命名路径失败: {old_path} -> {new_path}, {str(e)}")
+            return None
+        self.refresh_duplicate_groups(replaced_md5s)
+        return moved
+
+    def refresh_duplicate_groups(self, md5s: List[str]):
+        """
+        separate transaction after the rows are committed: a missing duplicate_group table only turns the refresh off,
+        it never fails a scan; `python -m file_scanner.duplicate_groups --rebuild` repairs anything missed
+        """
+        if not self.duplicate_groups or not any(md5s):
+            return
+        try:
+            with pooled_connection(**self.db_config) as conn, conn.cursor() as cur:
+                refresh_duplicate_groups(cur, md5s, self.table_name)
+        except Exception as e:
+            logger.info(f"❌ 更新重复文件分组失败, 不再更新 duplicate_group: {str(e)}")
+            self.duplicate_groups = False
+
+    def load_quick_fingerprint_peers(self) -> Optional[List[Tuple]]:
+        """
+        live rows sharing their size with at least one row that only has a quick fingerprint (md5 is null),
+        returns [(id, path, size, md5, quick_fp)] or None if the query failed
+        """
+        sql = f"""
+        SELECT fi.id, fi.path, fi.size, fi.md5, fi.quick_fp
+        FROM {self.table_name} fi
+        WHERE fi.deleted = 0
+          AND fi.size IN (SELECT DISTINCT f.size FROM {self.table_name} f WHERE f.deleted = 0 AND f.md5 IS NULL)
+        ORDER BY fi.size, fi.quick_fp;
+        """
+        try:
+            with pooled_connection(**self.db_config) as conn:
+                with conn.cursor(name="quick_fingerprint_peers") as cur:
+                    cur.itersize = self.prefetch_itersize
+                    cur.execute(sql)
+                    return list(cur)
+        except Exception as e:
+            logger.info(f"❌ 查询快速指纹候选失败: {str(e)}")
+            return None
+
+    def update_hashes(self, hash_records: List[tuple], quick_fp_records: List[tuple] = ()) -> bool:
+        """
+        hash_records: [(md5, xxh3_128, blake3, id)], quick_fp_records: [(quick_fp, id)]
+        """
+        try:
+            with pooled_connection(**self.db_config) as conn, conn.cursor() as cur:
+                if quick_fp_records:
+                    execute_batch(cur, self.update_quick_fp_sql, quick_fp_records)
+                if hash_records:
+                    execute_batch(cur, self.update_hashes_sql, hash_records)
+        except Exception as e:
+            logger.info(f"❌ 更新摘要失败: {str(e)}")
+            return False
+        self.refresh_duplicate_groups([r[0] for r in hash_records])
+        return True
@@ -19,6 +19,39 @@ class MountPathUtil:
         """
         if not isinstance(self.mount_points, list):
             raise TypeError("mount_points must be a list")
+        self._build_index()
+
+    def _build_index(self):
+        """
+        a trie of mount path components for longest-prefix lookup and a uuid dict, built once.
+        call again after changing mount_points.
+        the first mount wins when several share a mount path or a uuid, like the former linear scans
+        """
+        self._trie = {}
+        self._by_uuid = {}
+        for m in self.mount_points:
+            node = self._trie
+            for part in self._components(m.mount_path):
+                node = node.setdefault(part, {})
+            node.setdefault(None, m)
+            for uuid in (m.partition_uuid, m.uuid):
+                if uuid:
+                    self._by_uuid.setdefault(uuid, m)
+
+    @staticmethod
+    def _components(path: str) -> List[str]:
+        return [p for p in path.split(os.sep) if p]
+
+    def find_mount(self, real_path: str) -> Optional[Any]:
+        """the mount point with the longest mount path containing real_path, O(path depth)"""
+        node = self._trie
+        found = node.get(None)
+        for part in self._components(real_path):
+            node = node.get(part)
+            if node is None:
+                break
+            found = node.get(None, found)
+        return found
 
     @classmethod
     def from_mount_points(cls, mount_points: List[Any]) -> "MountPathUtil":
@@ -61,24 +94,34 @@ class MountPathUtil:
         '''
         returns {disk uuid}, {relative_path}
         '''
-        mount_path_list = [m for m in self.mount_points if real_path.startswith(m.mount_path)]
-        if mount_path_list:
-            most_match_mount = max(mount_path_list, key=lambda o: len(o.mount_path))
-            relative_path = real_path.removeprefix(most_match_mount.mount_path)
-            relative_path = relative_path.removeprefix(os.path.sep)
+        most_match_mount = self.find_mount(real_path)
+        if most_match_mount:
+            relative_path = os.sep.join(self._components(real_path)[len(self._components(most_match_mount.mount_path)):])
             return most_match_mount.partition_uuid if most_match_mount.partition_uuid else most_match_mount.uuid, relative_path
-        
+
         return None
 
+    def real_paths_2_logical(self, real_paths: List[str]) -> List[Optional[Tuple[str, str]]]:
+        '''
+        batch version of real_path_2_logical, one result per path in the same order
+        '''
+        return [self.real_path_2_logical(p) for p in real_paths]
+
     def logical_path_2_real(self, uuid:str, relative_path:str)->str:
         if uuid is None or relative_path is None:
             cur_logger.error(f'logical_path_2_real, uuid:{uuid} or relative_path:{relative_path} is illegal')
             return None
-        mount_path_list = [m for m in self.mount_points if m.partition_uuid == uuid or m.uuid == uuid]
-        print(f'mount_path_list: {mount_path_list}')
-        if mount_path_list:
-            most_match_mount = mount_path_list[0]
+        most_match_mount = self._by_uuid.get(uuid)
+        if most_match_mount:
             real_path = os.path.join(most_match_mount.mount_path, relative_path)
             return real_path
-        
-        return None
\ No newline at end of file
+
+        return None
+
+    def logical_paths_2_real(self, logical_paths: List[Tuple[str, str]]) -> List[Optional[str]]:
+        '''
+        batch version of logical_path_2_real for [(uuid, relative_path)], None where the volume is not mounted
+        '''
+        by_uuid = self._by_uuid
+        return [os.path.join(by_uuid[uuid].mount_path, rel) if uuid in by_uuid and rel is not None else None
+                for uuid, rel in logical_paths]
\ No newline at end of file
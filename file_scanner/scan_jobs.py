@@ -0,0 +1,250 @@
+"""
+scan_job: leasable scan work items shared by scanner processes on any number of hosts.
+a job is a subtree of a volume, keyed by (mount_uuid, relative_path), so whichever host has that disk mounted
+can take it, wherever the disk is mounted there.
+
+    python -m file_scanner.scanner /mnt/archive --run_mode enqueue --split_depth 1
+    python -m file_scanner.scanner --run_mode worker --wait        # on every host, as many processes as wanted
+"""
+import os
+import json
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from psycopg2.extras import execute_values
+
+from global_config.logger_config import logger
+from global_config.db_pool import pooled_connection
+from file_scanner.mount_path_utils import MountPathUtil
+from file_scanner.walker import WalkRules
+from file_scanner.scan_pipeline import ScanCancelled
+
+ENQUEUE_SQL = """
+INSERT INTO scan_job (mount_uuid, relative_path, max_depth, root_hint, priority, max_attempts)
+VALUES %s
+ON CONFLICT (mount_uuid, relative_path) DO UPDATE SET
+    max_depth = EXCLUDED.max_depth, root_hint = EXCLUDED.root_hint, priority = EXCLUDED.priority,
+    max_attempts = EXCLUDED.max_attempts, status = 'pending', attempts = 0, last_error = NULL,
+    lease_owner = NULL, lease_expires_at = NULL, created_at = CURRENT_TIMESTAMP
+WHERE scan_job.status <> 'running'
+RETURNING id;
+"""
+
+# pending jobs and running jobs whose owner stopped heartbeating, only on volumes mounted here
+CLAIM_SQL = """
+UPDATE scan_job SET
+    status = 'running', lease_owner = %(owner)s, attempts = attempts + 1,
+    lease_expires_at = CURRENT_TIMESTAMP + %(lease_secs)s * INTERVAL '1 second',
+    started_at = CURRENT_TIMESTAMP, finished_at = NULL
+WHERE id = (
+    SELECT id FROM scan_job
+    WHERE mount_uuid = ANY(%(mount_uuids)s)
+      AND (status = 'pending' OR (status = 'running' AND lease_expires_at < CURRENT_TIMESTAMP))
+      AND attempts < max_attempts
+    ORDER BY priority DESC, id
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING id, mount_uuid, relative_path, max_depth, attempts;
+"""
+
+HEARTBEAT_SQL = """
+UPDATE scan_job SET lease_expires_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+WHERE id = %s AND lease_owner = %s AND status = 'running';
+"""
+
+FINISH_SQL = """
+UPDATE scan_job SET
+    status = CASE WHEN %(status)s = 'failed' AND attempts < max_attempts AND %(retry)s THEN 'pending' ELSE %(status)s END,
+    counters = %(counters)s, last_error = %(error)s, lease_expires_at = NULL, finished_at = CURRENT_TIMESTAMP
+WHERE id = %(id)s AND lease_owner = %(owner)s
+RETURNING status;
+"""
+
+# leases that expired on their last attempt are never claimed again
+REAP_SQL = """
+UPDATE scan_job SET status = 'failed', last_error = COALESCE(last_error, 'lease expired'), lease_expires_at = NULL
+WHERE status = 'running' AND lease_expires_at < CURRENT_TIMESTAMP AND attempts >= max_attempts;
+"""
+
+
+@dataclass
+class ScanJob:
+    id: int
+    mount_uuid: str
+    relative_path: str
+    max_depth: Optional[int]     # None scans the whole subtree, 0 only the files of the directory itself
+    attempts: int
+
+
+def plan_jobs(root_dir: str, mount_path_util: MountPathUtil, split_depth: int = 0,
+              rules: Optional[WalkRules] = None) -> List[Tuple[str, str, Optional[int]]]:
+    """
+    [(mount_uuid, relative_path, max_depth)] covering root_dir: one job per directory at split_depth
+    plus one files-only job (max_depth 0) per directory above it, so no file is left out and none is scanned twice.
+    directories on another volume are left to their own root, like the walker does with one_file_system
+    """
+    rules = rules or WalkRules()
+    root_dir = os.path.normpath(os.path.abspath(root_dir))
+    try:
+        root_dev = os.stat(root_dir).st_dev
+    except OSError as e:
+        logger.info(f"❌ 无法读取目录: {root_dir}, {str(e)}")
+        return []
+    jobs = []
+    stack = [(root_dir, 0)]
+    while stack:
+        dir_path, depth = stack.pop()
+        logical = mount_path_util.real_path_2_logical(dir_path)
+        if not logical or not logical[0]:
+            logger.info(f"❌ 目录不在已知挂载点上, 跳过: {dir_path}")
+            continue
+        mount_uuid, relative_path = logical
+        remaining = None if rules.max_depth is None else rules.max_depth - depth
+        if depth >= split_depth or remaining == 0:
+            jobs.append((mount_uuid, relative_path, remaining))
+            continue
+        jobs.append((mount_uuid, relative_path, 0))
+        try:
+            with os.scandir(dir_path) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError as e:
+            logger.info(f"❌ 无法读取目录: {dir_path}, {str(e)}")
+            continue
+        sub_dirs = []
+        for entry in entries:
+            rel_path = os.path.relpath(entry.path, root_dir)
+            try:
+                if not entry.is_dir(follow_symlinks=False) or not rules.accept_dir(entry.name, rel_path):
+                    continue
+                if rules.one_file_system and entry.stat(follow_symlinks=False).st_dev != root_dev:
+                    continue
+            except OSError:
+                continue
+            sub_dirs.append(entry.path)
+        stack.extend((p, depth + 1) for p in reversed(sub_dirs))
+    return jobs
+
+
+class ScanJobQueue:
+    """
+    claim / heartbeat / finish of scan_job rows. a claim is a lease of lease_secs renewed by a heartbeat thread,
+    a job whose owner died is claimed again by any worker once the lease expires, up to max_attempts times.
+    """
+
+    def __init__(self, db_config: dict, owner: str = None, lease_secs: int = 300):
+        self.db_config = db_config
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_secs = lease_secs
+
+    def enqueue(self, jobs: Iterable[Tuple[str, str, Optional[int]]], root_hint: str = None,
+                priority: int = 0, max_attempts: int = 3) -> int:
+        """adds the jobs or resets finished ones to pending, jobs running right now are left alone, returns the rows written"""
+        values = [(mount_uuid, relative_path, max_depth, root_hint, priority, max_attempts)
+                  for mount_uuid, relative_path, max_depth in jobs]
+        if not values:
+            return 0
+        with pooled_connection(**self.db_config) as conn, conn.cursor() as cur:
+            # rowcount only covers the last page, RETURNING collects the rows of every page
+            return len(execute_values(cur, ENQUEUE_SQL, values, page_size=1000, fetch=True))
+
+    def claim(self, mount_uuids: List[str]) -> Optional[ScanJob]:
+        if not mount_uuids:
+            return None
+        with pooled_connection(**self.db_config) as conn, conn.cursor() as cur:
+            cur.execute(REAP_SQL)
+            cur.execute(CLAIM_SQL, {'owner': self.owner, 'lease_secs': self.lease_secs, 'mount_uuids': list(mount_uuids)})
+            row = cur.fetchone()
+        return ScanJob(*row) if row else None
+
+    def heartbeat(self, job: ScanJob) -> bool:
+        """False when the lease was lost, i.e. another worker took the job after it expired"""
+        with pooled_connection(**self.db_config) as conn, conn.cursor() as cur:
+            cur.execute(HEARTBEAT_SQL, (self.lease_secs, job.id, self.owner))
+            return cur.rowcount == 1
+
+    @contextmanager
+    def keep_alive(self, job: ScanJob):
+        """
+        renews the lease every lease_secs / 3 while the job runs, yields an event that is set once the lease is lost:
+        another worker may already have claimed the job, so the holder has to stop writing and must not finish it
+        """
+        stop = threading.Event()
+        lost = threading.Event()
+
+        def beat():
+            while not stop.wait(self.lease_secs / 3):
+                try:
+                    if not self.heartbeat(job):
+                        logger.info(f"❌ 扫描任务租约已丢失, 取消任务: job={job.id}")
+                        lost.set()
+                        return
+                except Exception as e:
+                    logger.info(f"❌ 扫描任务心跳失败: job={job.id}, {str(e)}")
+
+        t = threading.Thread(target=beat, name=f'scan-job-heartbeat-{job.id}', daemon=True)
+        t.start()
+        try:
+            yield lost
+        finally:
+            stop.set()
+            t.join()
+
+    def finish(self, job: ScanJob, counters: Dict[str, int] = None, error: str = None, retry: bool = True) -> Optional[str]:
+        """done without error, otherwise back to pending until max_attempts, returns the new status"""
+        params = {'id': job.id, 'owner': self.owner, 'status': 'failed' if error else 'done', 'retry': retry,
+                  'counters': json.dumps(counters) if counters else None, 'error': error}
+        with pooled_connection(**self.db_config) as conn, conn.cursor() as cur:
+            cur.execute(FINISH_SQL, params)
+            row = cur.fetchone()
+        return row[0] if row else None
+
+
+def run_worker(job_queue: ScanJobQueue, mount_path_util: MountPathUtil,
+               run_job: Callable[[ScanJob, str, threading.Event], Dict[str, int]], wait: bool = False,
+               poll_secs: float = 60) -> Dict[str, int]:
+    """
+    claims jobs on the volumes mounted here and runs run_job(job, real_path, cancel) until the queue is empty,
+    or forever with wait. a job fails (and is requeued) when run_job raises or reports write or prefetch failures.
+    cancel is set when the lease is lost, run_job then raises ScanCancelled and the job is left to its new owner
+    """
+    mount_uuids = sorted({u for m in mount_path_util.mount_points for u in (m.partition_uuid, m.uuid) if u})
+    totals = {'done': 0, 'failed': 0, 'requeued': 0, 'lost': 0}
+    while True:
+        job = job_queue.claim(mount_uuids)
+        if job is None:
+            if not wait:
+                return totals
+            time.sleep(poll_secs)
+            continue
+        real_path = mount_path_util.logical_path_2_real(job.mount_uuid, job.relative_path)
+        logger.info(f"> 领取扫描任务: job={job.id}, 第 {job.attempts} 次, {job.mount_uuid}:{job.relative_path} -> {real_path}")
+        if not real_path or not os.path.isdir(real_path):
+            status = job_queue.finish(job, error=f'not a directory: {real_path}', retry=False)
+            totals['failed'] += 1
+            logger.info(f"❌ 扫描任务目录不存在: job={job.id}, {real_path}, status={status}")
+            continue
+        counters, error, lost = None, None, False
+        with job_queue.keep_alive(job) as cancel:
+            try:
+                counters = run_job(job, real_path, cancel)
+                if counters.get('write_failed') or counters.get('prefetch_failed'):
+                    error = f"write_failed: {counters.get('write_failed', 0)}, prefetch_failed: {counters.get('prefetch_failed', 0)}"
+            except ScanCancelled:
+                lost = True
+            except Exception as e:
+                logger.exception(f"❌ 扫描任务失败: job={job.id}, {e}")
+                error = str(e)
+            lost = lost or cancel.is_set()
+        if lost:
+            # the row belongs to whoever claimed it after the lease expired, finish() would overwrite its state
+            totals['lost'] += 1
+            logger.info(f"❌ 扫描任务已放弃 (租约丢失): job={job.id}")
+            continue
+        status = job_queue.finish(job, counters, error)
+        totals['done' if status == 'done' else 'requeued' if status == 'pending' else 'failed'] += 1
+        logger.info(f"✅ 扫描任务结束: job={job.id}, status={status}, counters={counters}")
@@ -0,0 +1,166 @@
+import os
+import time
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional
+
+from psycopg2.extras import execute_values
+
+from global_config.logger_config import logger
+from global_config.db_pool import pooled_connection
+
+# stage timers, summed over all threads of that stage:
+# walk (directory listing + stat), db_read (prefetch of existing rows), mime (libmagic),
+# quick_fp (reading only the fingerprint samples), hash (the single read pass for digests and fingerprint), db_write (batch writes)
+STAGES = ('walk', 'db_read', 'mime', 'quick_fp', 'hash', 'db_write')
+
+COLUMNS = ('scan_id', 'machine', 'mount_uuid', 'elapsed_secs', 'files_scanned', 'files_hashed', 'bytes_hashed',
+           'rows_written', 'files_per_sec', 'bytes_per_sec', 'rows_per_sec',
+           'walk_secs', 'db_read_secs', 'mime_secs', 'quick_fp_secs', 'hash_secs', 'db_write_secs',
+           'hash_queue', 'write_queue')
+
+
+class ScanMetrics:
+    """
+    throughput and per-stage time of one scan, recorded by the pipeline threads and flushed by record():
+    one row for the whole scan (mount_uuid NULL) plus one row per mount_uuid into the scan_metrics table,
+    and the same numbers as a prometheus text file (node_exporter textfile collector).
+    rates are per interval since the previous record(), totals are cumulative.
+
+    slow scan, how to read it: hash_secs close to elapsed * hash_workers with low bytes/s means disk bound,
+    high mime/hash time with high bytes/s means cpu bound, db_write_secs close to elapsed means db bound.
+    """
+
+    def __init__(self, scan_id: str, machine: str, db_config: dict = None, table_name: Optional[str] = 'scan_metrics',
+                 textfile: Optional[str] = None):
+        self.scan_id = str(scan_id)
+        self.machine = machine
+        self.db_config = db_config
+        self.table_name = table_name if db_config else None
+        self.textfile = textfile
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.stage_secs = dict.fromkeys(STAGES, 0.0)
+        # {mount_uuid: {'files_hashed', 'bytes_hashed', 'hash_secs'}}
+        self.per_mount = defaultdict(lambda: {'files_hashed': 0, 'bytes_hashed': 0, 'hash_secs': 0.0})
+        self.bytes_hashed = 0
+        self._last = {'time': self.started, 'files_scanned': 0, 'bytes_hashed': 0, 'rows_written': 0}
+        self._last_mount = {}
+
+    # === called by the pipeline threads ===
+    def add_time(self, stage: str, secs: float):
+        with self._lock:
+            self.stage_secs[stage] += secs
+
+    @contextmanager
+    def timed(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def timed_iter(self, iterable: Iterable, stage: str):
+        """time spent producing the items of a generator, e.g. the directory walk"""
+        it = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                self.add_time(stage, time.perf_counter() - start)
+                return
+            self.add_time(stage, time.perf_counter() - start)
+            yield item
+
+    def add_hashed(self, mount_uuid: Optional[str], nbytes: int, secs: float):
+        with self._lock:
+            self.bytes_hashed += nbytes
+            m = self.per_mount[mount_uuid or '']
+            m['files_hashed'] += 1
+            m['bytes_hashed'] += nbytes
+            m['hash_secs'] += secs
+
+    # === called by the writer thread every report interval ===
+    def record(self, counters: Dict[str, int], hash_queue: int = None, write_queue: int = None):
+        now = time.monotonic()
+        with self._lock:
+            stage_secs = dict(self.stage_secs)
+            per_mount = {k: dict(v) for k, v in self.per_mount.items()}
+            bytes_hashed = self.bytes_hashed
+        interval = max(now - self._last['time'], 1e-6)
+        files_scanned = counters.get('scanned', 0)
+        files_hashed = counters.get('hashed', 0) + counters.get('quick_only', 0)
+        rows_written = counters.get('inserted', 0) + counters.get('stat_updated', 0)
+        total = {
+            'mount_uuid': None, 'elapsed_secs': round(now - self.started, 3),
+            'files_scanned': files_scanned, 'files_hashed': files_hashed, 'bytes_hashed': bytes_hashed,
+            'rows_written': rows_written,
+            'files_per_sec': (files_scanned - self._last['files_scanned']) / interval,
+            'bytes_per_sec': (bytes_hashed - self._last['bytes_hashed']) / interval,
+            'rows_per_sec': (rows_written - self._last['rows_written']) / interval,
+            'hash_queue': hash_queue, 'write_queue': write_queue,
+            **{f'{stage}_secs': round(secs, 3) for stage, secs in stage_secs.items()},
+        }
+        rows = [total]
+        for mount_uuid, m in per_mount.items():
+            last_bytes = self._last_mount.get(mount_uuid, 0)
+            rows.append({
+                'mount_uuid': mount_uuid or None, 'elapsed_secs': total['elapsed_secs'],
+                'files_hashed': m['files_hashed'], 'bytes_hashed': m['bytes_hashed'],
+                'bytes_per_sec': (m['bytes_hashed'] - last_bytes) / interval,
+                'hash_secs': round(m['hash_secs'], 3),
+            })
+            self._last_mount[mount_uuid] = m['bytes_hashed']
+        self._last = {'time': now, 'files_scanned': files_scanned, 'bytes_hashed': bytes_hashed, 'rows_written': rows_written}
+
+        if self.table_name:
+            self._write_table(rows)
+        if self.textfile:
+            self._write_textfile(rows)
+        return rows
+
+    def _write_table(self, rows):
+        values = [tuple(self.scan_id if c == 'scan_id' else self.machine if c == 'machine' else r.get(c) for c in COLUMNS)
+                  for r in rows]
+        sql = f"INSERT INTO {self.table_name} ({', '.join(COLUMNS)}) VALUES %s"
+        try:
+            with pooled_connection(**self.db_config) as conn, conn.cursor() as cur:
+                execute_values(cur, sql, values)
+        except Exception as e:
+            # a missing table must not stop the scan, the text file still works
+            logger.info(f"❌ 写入扫描指标失败, 不再写入 {self.table_name}: {str(e)}")
+            self.table_name = None
+
+    def _write_textfile(self, rows):
+        labels = f'machine="{self.machine}",scan_id="{self.scan_id}"'
+        total = rows[0]
+        lines = [
+            '# TYPE file_scanner_files_scanned_total counter',
+            f'file_scanner_files_scanned_total{{{labels}}} {total["files_scanned"]}',
+            '# TYPE file_scanner_files_hashed_total counter',
+            f'file_scanner_files_hashed_total{{{labels}}} {total["files_hashed"]}',
+            '# TYPE file_scanner_bytes_hashed_total counter',
+            f'file_scanner_bytes_hashed_total{{{labels}}} {total["bytes_hashed"]}',
+            '# TYPE file_scanner_rows_written_total counter',
+            f'file_scanner_rows_written_total{{{labels}}} {total["rows_written"]}',
+            '# TYPE file_scanner_stage_seconds_total counter',
+        ]
+        lines += [f'file_scanner_stage_seconds_total{{{labels},stage="{stage}"}} {total[f"{stage}_secs"]}' for stage in STAGES]
+        lines += ['# TYPE file_scanner_queue_depth gauge']
+        lines += [f'file_scanner_queue_depth{{{labels},queue="{q}"}} {total[f"{q}_queue"]}'
+                  for q in ('hash', 'write') if total[f"{q}_queue"] is not None]
+        lines += ['# TYPE file_scanner_mount_bytes_hashed_total counter']
+        lines += [f'file_scanner_mount_bytes_hashed_total{{{labels},mount_uuid="{r["mount_uuid"] or ""}"}} {r["bytes_hashed"]}'
+                  for r in rows[1:]]
+        lines += ['# TYPE file_scanner_elapsed_seconds gauge', f'file_scanner_elapsed_seconds{{{labels}}} {total["elapsed_secs"]}']
+        try:
+            os.makedirs(os.path.dirname(self.textfile) or '.', exist_ok=True)
+            # atomic rename, the collector never reads a half written file
+            tmp_path = f"{self.textfile}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            os.replace(tmp_path, self.textfile)
+        except OSError as e:
+            logger.info(f"❌ 写入指标文件失败: {self.textfile}, {str(e)}")
@@ -0,0 +1,488 @@
+import os
+import queue
+import socket
+import stat
+import threading
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from global_config.logger_config import logger
+from concurrent.futures import ThreadPoolExecutor
+from file_scanner.device_utils import (DEFAULT_HASH_BLOCK_SIZE, LARGE_FILE_THRESHOLD, QUICK_FINGERPRINT_SAMPLE_SIZE,
+                                       calculate_hashes, calculate_quick_fingerprint,
+                                       needs_full_hash_for_quick_fingerprint, scan_file)
+from file_scanner.inventory_store import InventoryStore
+from file_scanner.mount_path_utils import MountPathUtil
+from file_scanner.scan_session import ScanSession
+from file_scanner.scan_metrics import ScanMetrics
+from file_scanner.inode_cache import InodeCache
+from file_scanner.walker import WalkRules, walk
+
+# end-of-stream marker passed from walker to hashers and from every hasher to the writer
+_DONE = None
+
+MIN_FILE_COUNT = 10
+
+
+@dataclass
+class ScanTask:
+    full_path: str
+    st: os.stat_result
+    old_record: Optional[tuple]     # (md5, size, id, mtime_ns, inode, device, quick_fp) or None
+    disk_uuid: Optional[str]
+    relative_path: Optional[str]
+
+
+@dataclass
+class ScanResult:
+    task: ScanTask
+    mime_type: Optional[str]
+    hashes: Optional[Dict[str, str]]     # {algorithm: hexdigest}, empty when only the quick fingerprint was computed
+    quick_fp: Optional[str]
+    duration: float
+
+    @property
+    def md5(self) -> Optional[str]:
+        return self.hashes.get('md5') if self.hashes else None
+
+
+def is_unchanged(old_record: tuple, st: os.stat_result) -> bool:
+    """
+    a row is considered unchanged when size, mtime_ns, inode and device all match the current stat,
+    rows without stat columns (written before incremental mode) never match
+    """
+    _, old_size, _, old_mtime_ns, old_inode, old_device = old_record[:6]
+    return (old_size == st.st_size
+            and old_mtime_ns == st.st_mtime_ns
+            and old_inode == st.st_ino
+            and old_device == st.st_dev)
+
+
+class ScanCancelled(Exception):
+    """raised by ScanPipeline.run() when its cancel event was set during the scan"""
+
+
+class ScanPipeline:
+    """
+    walker thread -> bounded hash queue -> N hashing threads -> bounded write queue -> single writer (caller thread)
+
+    the walker stats files and drops unchanged ones, hashers compute mime type and md5
+    (hashlib releases the GIL on large buffers), the writer batches rows into postgres.
+    queue depths and the time every stage spent blocked are logged every report_interval_secs:
+    a full hash queue with an idle writer means hashing (disk) bound, a full write queue means db bound,
+    empty queues with a busy walker mean the walk itself (metadata) is the bottleneck.
+    """
+
+    def __init__(self, store: InventoryStore, mount_path_util: MountPathUtil, machine_name: str = None,
+                 hash_workers: int = 2, queue_size: int = 1000, batch_size: int = 100,
+                 incremental: bool = True, force_update: bool = False, prefetch_scope: str = 'root',
+                 report_interval_secs: float = 30,
+                 hash_algorithms: List[str] = ('md5', 'xxh3_128'), hash_block_size: int = DEFAULT_HASH_BLOCK_SIZE,
+                 full_hash: str = 'always', io_backend: str = 'auto', large_file_threshold: int = LARGE_FILE_THRESHOLD,
+                 walk_rules: WalkRules = None, session: ScanSession = None, metrics: ScanMetrics = None,
+                 inode_cache: InodeCache = None, cancel: threading.Event = None):
+        self.store = store
+        self.mount_path_util = mount_path_util
+        self.machine_name = machine_name or socket.gethostname()
+        self.hash_workers = max(1, int(hash_workers))
+        self.queue_size = max(1, int(queue_size))
+        self.batch_size = max(1, int(batch_size))
+        self.incremental = incremental
+        self.force_update = force_update
+        self.prefetch_scope = prefetch_scope
+        self.report_interval_secs = report_interval_secs
+        # md5 is always computed, file_inventory.md5 and the duplicate reports key on it
+        self.hash_algorithms = ['md5'] + [a for a in hash_algorithms if a != 'md5']
+        self.hash_block_size = int(hash_block_size)
+        # 'always': full digests for every file, 'on_collision': large new files only get the quick fingerprint,
+        # their full digests are computed by resolve_quick_fingerprint_collisions() when the fingerprint collides
+        self.full_hash = full_hash
+        # see device_utils.IO_BACKENDS, 'auto' reads large files with drop-behind so the page cache of other jobs survives
+        self.io_backend = io_backend
+        self.large_file_threshold = int(large_file_threshold)
+        self.walk_rules = walk_rules or WalkRules()
+        # optional checkpoint, completed subtrees of a resumed session are pruned from the walk
+        self.session = session
+        # optional throughput / stage time instrumentation, flushed on every report()
+        self.metrics = metrics
+        # hardlinked paths reuse the digests of their inode instead of reading it again
+        self.inode_cache = inode_cache
+        # set from outside (e.g. a lost scan_job lease): the walk stops, queued files are dropped unwritten
+        # and run() raises ScanCancelled
+        self.cancel = cancel
+
+        self.counters = {
+            'scanned': 0,       # regular files seen by the walker
+            'skipped': 0,       # unchanged, not hashed
+            'hashed': 0,
+            'quick_only': 0,    # only the quick fingerprint was computed
+            'hardlink_reused': 0,   # digests copied from another path of the same inode
+            'hash_failed': 0,
+            'inserted': 0,
+            'stat_updated': 0,
+            'write_failed': 0,
+            'prefetch_failed': 0,   # directories (or roots) skipped because their existing rows could not be loaded
+        }
+        # seconds every stage spent blocked on its queues
+        self.wait_secs = {'walker_put': 0.0, 'hasher_get': 0.0, 'hasher_put': 0.0, 'writer_get': 0.0}
+        self._lock = threading.Lock()
+        self._walker_error = None
+
+        self.mark_old_batch: List[str] = []
+        self.insert_batch: List[tuple] = []
+        self.update_stat_batch: List[tuple] = []
+        # directory of every row in the current batch, reported to the session once the batch is written
+        self.batch_dirs: List[str] = []
+
+    # === helpers ===
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self.counters[key] += n
+
+    def _put(self, q: queue.Queue, item, wait_key: str):
+        start = time.monotonic()
+        q.put(item)
+        waited = time.monotonic() - start
+        with self._lock:
+            self.wait_secs[wait_key] += waited
+
+    def _get(self, q: queue.Queue, wait_key: str, timeout: float = None):
+        start = time.monotonic()
+        try:
+            return q.get(timeout=timeout)
+        finally:
+            waited = time.monotonic() - start
+            with self._lock:
+                self.wait_secs[wait_key] += waited
+
+    def _cancelled(self) -> bool:
+        return self.cancel is not None and self.cancel.is_set()
+
+    def _timed(self, stage: str):
+        return self.metrics.timed(stage) if self.metrics else nullcontext()
+
+    def report(self):
+        with self._lock:
+            counters = dict(self.counters)
+            wait_secs = {k: round(v, 1) for k, v in self.wait_secs.items()}
+        logger.info(f"> 扫描进度: {counters}, hash_queue: {self.hash_queue.qsize()}/{self.queue_size}, "
+                    f"write_queue: {self.write_queue.qsize()}/{self.queue_size}, wait_secs: {wait_secs}")
+        if self.metrics:
+            self.metrics.record(counters, self.hash_queue.qsize(), self.write_queue.qsize())
+
+    # === stage 1: walker ===
+    def _walk(self, root_dirs: List[str], files: Optional[List[str]] = None):
+        try:
+            if files is not None:
+                self._queue_files(files)
+            for root_dir in root_dirs:
+                self._walk_root(root_dir)
+        except BaseException as e:
+            self._walker_error = e
+            logger.exception(f"❌ 遍历目录失败: {e}")
+        finally:
+            for _ in range(self.hash_workers):
+                self._put(self.hash_queue, _DONE, 'walker_put')
+
+    def _walk_root(self, root_dir: str):
+        logger.info(f"> 正在扫描目录: {root_dir}")
+        existing_records = {}
+        if not self.force_update and self.prefetch_scope == 'root':
+            with self._timed('db_read'):
+                existing_records = self.store.load_existing_records(root_dir, recursive=True)
+            if existing_records is None:
+                # nothing of this root was scanned: run() raises after the other roots, the session stays resumable
+                self._count('prefetch_failed')
+                logger.info(f"❌ 预加载已有记录失败, 跳过目录: {root_dir}")
+                self._walker_error = self._walker_error or RuntimeError(f"prefetch failed: {root_dir}")
+                return
+            logger.info(f"> 预加载已有记录数量: {len(existing_records)}, 目录: {root_dir}")
+        session = self.session
+        dirs = walk(root_dir, self.walk_rules, prune=session.is_completed if session else None)
+        if self.metrics:
+            dirs = self.metrics.timed_iter(dirs, 'walk')
+        for root, file_entries in dirs:
+            if self._cancelled():
+                logger.info(f"❌ 扫描已取消, 停止遍历: {root_dir}")
+                return
+            if session:
+                session.enter_dir(root)
+            if not self.force_update and self.prefetch_scope == 'dir':
+                with self._timed('db_read'):
+                    existing_records = self.store.load_existing_records(root)
+                if existing_records is None:
+                    self._count('prefetch_failed')
+                    if session:
+                        session.dir_failed(root)
+                    continue
+            files_count = len(file_entries)
+            if files_count > MIN_FILE_COUNT:
+                logger.info(f"> 正在扫描目录: {root_dir} 中的(文件数量大于{MIN_FILE_COUNT})子目录: {root}, 其中文件数量: {files_count}")
+            for entry in file_entries:
+                try:
+                    # cached by the walker, no extra syscall
+                    st = entry.stat()
+                except OSError:
+                    continue
+                self._queue_file(entry.path, st, existing_records.pop(entry.path, None), root)
+        if session:
+            session.leave_all()
+
+    def _queue_file(self, full_path: str, st: os.stat_result, old_record: Optional[tuple], dir_path: str):
+        self._count('scanned')
+        if self.incremental and not self.force_update and old_record is not None and is_unchanged(old_record, st):
+            self._count('skipped')
+            return
+        mount_conversion = self.mount_path_util.real_path_2_logical(full_path)
+        disk_uuid, relative_path = mount_conversion if mount_conversion else (None, None)
+        if self.session:
+            self.session.file_queued(dir_path)
+        self._put(self.hash_queue, ScanTask(full_path, st, old_record, disk_uuid, relative_path), 'walker_put')
+
+    def _queue_files(self, files: List[str]):
+        """explicit file paths instead of a walk (watch mode), existing rows are loaded per parent directory"""
+        by_dir = {}
+        for full_path in files:
+            by_dir.setdefault(os.path.dirname(full_path), []).append(full_path)
+        for dir_path, paths in sorted(by_dir.items()):
+            existing_records = {}
+            if not self.force_update:
+                with self._timed('db_read'):
+                    existing_records = self.store.load_existing_records(dir_path)
+                if existing_records is None:
+                    self._count('prefetch_failed')
+                    continue
+            for full_path in sorted(paths):
+                try:
+                    st = os.stat(full_path)
+                except OSError:
+                    # gone again before it was hashed, the watcher marks the delete
+                    continue
+                if stat.S_ISREG(st.st_mode):
+                    self._queue_file(full_path, st, existing_records.pop(full_path, None), dir_path)
+
+    # === stage 2: hashers ===
+    def _needs_full_hash(self, task: ScanTask) -> bool:
+        if self.full_hash != 'on_collision' or needs_full_hash_for_quick_fingerprint(task.st.st_size):
+            return True
+        # a row with a known md5 must stay exact, a changed file is rehashed instead of trusting the samples
+        return bool(task.old_record and task.old_record[0])
+
+    def _inode_keys(self, task: ScanTask):
+        """(memory key, persistent key) of a hardlinked file, None when the inode has a single path"""
+        st = task.st
+        if self.inode_cache is None or st.st_nlink <= 1:
+            return None
+        db_key = (task.disk_uuid, st.st_ino, st.st_size, st.st_mtime_ns) if task.disk_uuid else None
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns), db_key
+
+    def _hash_worker(self):
+        while True:
+            task = self._get(self.hash_queue, 'hasher_get')
+            if task is _DONE:
+                self._put(self.write_queue, _DONE, 'hasher_put')
+                return
+            if self._cancelled():
+                continue
+            start_time = time.time()
+            size = task.st.st_size
+            full_hash = self._needs_full_hash(task)
+            timings = {}
+            inode_keys = self._inode_keys(task)
+            cached = self.inode_cache.claim(*inode_keys, full_hash) if inode_keys else None
+            if cached is not None:
+                # another path of the same inode was already read
+                mime_type, hashes, quick_fp = cached
+                self._count('hardlink_reused')
+                self._put(self.write_queue, ScanResult(task, mime_type, hashes, quick_fp, round(time.time() - start_time, 4)), 'hasher_put')
+                continue
+            try:
+                # one open per file: mime type and quick fingerprint come from the blocks read for the digests
+                mime_type, hashes, quick_fp = scan_file(task.full_path, size, self.hash_algorithms, full_hash,
+                                                        self.hash_block_size, self.io_backend, self.large_file_threshold,
+                                                        timings=timings)
+            except Exception as e:
+                logger.info(f"❌ 计算文件摘要失败: {task.full_path}, {str(e)}")
+                mime_type, hashes, quick_fp = None, None, None
+            if inode_keys:
+                self.inode_cache.publish(*inode_keys, (mime_type, hashes, quick_fp) if hashes is not None else None)
+            if self.metrics:
+                mime_secs = timings.get('mime', 0.0)
+                read_secs = max(time.time() - start_time - mime_secs, 0.0)
+                self.metrics.add_time('mime', mime_secs)
+                self.metrics.add_time('hash' if full_hash else 'quick_fp', read_secs)
+                if hashes is not None:
+                    # bytes read: the whole file when fully hashed, else the fingerprint samples
+                    nbytes = size if full_hash else min(size, 3 * QUICK_FINGERPRINT_SAMPLE_SIZE)
+                    self.metrics.add_hashed(task.disk_uuid, nbytes, read_secs)
+            duration = round(time.time() - start_time, 4)
+            if hashes is None:
+                self._count('hash_failed')
+            else:
+                self._count('hashed' if hashes else 'quick_only')
+            self._put(self.write_queue, ScanResult(task, mime_type, hashes, quick_fp, duration), 'hasher_put')
+
+    # === stage 3: writer ===
+    def _collect(self, result: ScanResult):
+        task = result.task
+        if result.hashes is None:
+            if self.session:
+                self.session.files_done([os.path.dirname(task.full_path)], ok=False)
+            return
+        self.batch_dirs.append(os.path.dirname(task.full_path))
+        st = task.st
+        xxh3_128, blake3 = result.hashes.get('xxh3_128'), result.hashes.get('blake3')
+        new_record = (self.machine_name, task.full_path, result.mime_type, result.md5, st.st_size, result.duration,
+                      task.disk_uuid, task.relative_path, st.st_mtime_ns, st.st_ino, st.st_dev, xxh3_128, blake3,
+                      result.quick_fp, st.st_nlink)
+        if self.force_update:
+            self.mark_old_batch.append(task.full_path)
+            self.insert_batch.append(new_record)
+        elif task.old_record is None:
+            self.insert_batch.append(new_record)
+        else:
+            old_md5, old_size, old_id = task.old_record[:3]
+            if result.md5:
+                changed = result.md5 != old_md5 or st.st_size != old_size
+            else:
+                # only fingerprinted, which means the old row has no md5 either
+                changed = result.quick_fp != task.old_record[6] or st.st_size != old_size
+            if changed:
+                self.mark_old_batch.append(task.full_path)
+                self.insert_batch.append(new_record)
+            else:
+                # content unchanged (e.g. touched or copied back), only refresh stat columns
+                self.update_stat_batch.append((st.st_mtime_ns, st.st_ino, st.st_dev, xxh3_128, blake3, result.quick_fp,
+                                               st.st_nlink, old_id))
+
+    def _flush(self):
+        if not self.insert_batch and not self.update_stat_batch:
+            return
+        old_paths, insert_records, update_records = self.mark_old_batch[:], self.insert_batch[:], self.update_stat_batch[:]
+        self.mark_old_batch.clear()
+        self.insert_batch.clear()
+        self.update_stat_batch.clear()
+        batch_dirs, self.batch_dirs = self.batch_dirs, []
+        with self._timed('db_write'):
+            ok = self.store.write(old_paths, insert_records, update_records)
+        if ok:
+            self._count('inserted', len(insert_records))
+            self._count('stat_updated', len(update_records))
+            logger.info(f"> 累计写入文件数量: {self.counters['inserted']}")
+        else:
+            self._count('write_failed', len(insert_records) + len(update_records))
+        if self.session:
+            self.session.files_done(batch_dirs, ok)
+            self.session.checkpoint(self.counters)
+
+    def _write_loop(self):
+        remaining = self.hash_workers
+        last_report = time.monotonic()
+        while remaining:
+            try:
+                result = self._get(self.write_queue, 'writer_get', timeout=1)
+            except queue.Empty:
+                result = False
+            if result is _DONE:
+                remaining -= 1
+            elif self._cancelled():
+                # keep draining so the walker and hashers can finish, nothing more is written
+                continue
+            elif result:
+                self._collect(result)
+                if len(self.insert_batch) + len(self.update_stat_batch) >= self.batch_size:
+                    self._flush()
+            if time.monotonic() - last_report >= self.report_interval_secs:
+                self.report()
+                last_report = time.monotonic()
+        if self._cancelled():
+            # rows collected but not written yet are dropped with the job
+            self.mark_old_batch.clear()
+            self.insert_batch.clear()
+            self.update_stat_batch.clear()
+            self.batch_dirs.clear()
+            return
+        # === 写入剩余数据 ===
+        self._flush()
+        if self.inode_cache:
+            self.inode_cache.flush()
+        if self.session:
+            # directories without any file to write complete here
+            self.session.checkpoint(self.counters)
+
+    def run(self, root_dirs: List[str], files: Optional[List[str]] = None) -> Dict[str, int]:
+        """walks root_dirs, files are hashed as given without walking (used by watch mode with root_dirs empty)"""
+        self.hash_queue = queue.Queue(maxsize=self.queue_size)
+        self.write_queue = queue.Queue(maxsize=self.queue_size)
+        threads = [threading.Thread(target=self._walk, args=(root_dirs, files), name='scan-walker', daemon=True)]
+        threads += [threading.Thread(target=self._hash_worker, name=f'scan-hasher-{i}', daemon=True)
+                    for i in range(self.hash_workers)]
+        for t in threads:
+            t.start()
+        self._write_loop()
+        for t in threads:
+            t.join()
+        self.report()
+        if self._cancelled():
+            # the checkpoint stays as it was, the session is never finished
+            raise ScanCancelled(f"scan cancelled: {root_dirs}")
+        if self.session:
+            if (self._walker_error or self.counters['hash_failed'] or self.counters['write_failed']
+                    or self.counters['prefetch_failed']):
+                # stays resumable, --resume retries only the subtrees that did not complete
+                logger.info(f"> 扫描未完整结束, 可使用 --resume 继续: scan_id={self.session.scan_id}")
+                self.session.checkpoint(self.counters)
+            else:
+                self.session.finish(self.counters)
+        if self._walker_error:
+            raise self._walker_error
+        return dict(self.counters)
+
+
+def resolve_quick_fingerprint_collisions(store: InventoryStore, hash_algorithms: List[str] = ('md5', 'xxh3_128'),
+                                         hash_block_size: int = DEFAULT_HASH_BLOCK_SIZE, hash_workers: int = 2,
+                                         io_backend: str = 'auto', large_file_threshold: int = LARGE_FILE_THRESHOLD) -> Dict[str, int]:
+    """
+    compute full digests only for rows whose (size, quick_fp) collides with another live row.
+    rows written before quick fingerprints existed get their fingerprint first, so they can collide too.
+    files that are not reachable from this machine are left for the machine they live on.
+    """
+    hash_algorithms = ['md5'] + [a for a in hash_algorithms if a != 'md5']
+    counters = {'fingerprinted': 0, 'hashed': 0, 'unreachable': 0}
+    rows = store.load_quick_fingerprint_peers()
+    if not rows:
+        return counters
+
+    with ThreadPoolExecutor(max_workers=max(1, int(hash_workers))) as pool:
+        # 1. legacy rows with md5 but without quick fingerprint
+        legacy = [r for r in rows if r[4] is None and os.path.isfile(r[1])]
+        fps = pool.map(lambda r: calculate_quick_fingerprint(r[1], r[2]), legacy)
+        quick_fp_records = []
+        for r, fp in zip(legacy, fps):
+            if fp:
+                quick_fp_records.append((fp, r[0]))
+        fp_by_id = {row_id: fp for fp, row_id in quick_fp_records}
+        rows = [r if r[0] not in fp_by_id else (r[0], r[1], r[2], r[3], fp_by_id[r[0]]) for r in rows]
+        counters['fingerprinted'] = len(quick_fp_records)
+
+        # 2. groups of the same (size, quick_fp) with more than one member need full digests
+        groups: Dict[tuple, List[tuple]] = {}
+        for r in rows:
+            if r[4] is not None:
+                groups.setdefault((r[2], r[4]), []).append(r)
+        pending = [r for members in groups.values() if len(members) > 1 for r in members if r[3] is None]
+        reachable = [r for r in pending if os.path.isfile(r[1])]
+        counters['unreachable'] = len(pending) - len(reachable)
+        digests = pool.map(lambda r: calculate_hashes(r[1], hash_algorithms, hash_block_size, io_backend, large_file_threshold),
+                           reachable)
+        hash_records = []
+        for r, hashes in zip(reachable, digests):
+            if hashes:
+                hash_records.append((hashes['md5'], hashes.get('xxh3_128'), hashes.get('blake3'), r[0]))
+        counters['hashed'] = len(hash_records)
+
+    store.update_hashes(hash_records, quick_fp_records)
+    logger.info(f"> 快速指纹碰撞处理: {counters}")
+    return counters
@@ -0,0 +1,158 @@
+import os
+import json
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Set
+
+from global_config.logger_config import logger
+
+DEFAULT_SESSION_DB = os.path.join(os.path.expanduser('~'), '.cache', 'file_scanner', 'scan_sessions.sqlite3')
+
+
+class _DirNode:
+    __slots__ = ('parent', 'pending', 'failed')
+
+    def __init__(self, parent: Optional[str]):
+        self.parent = parent
+        # 1 for the walk of the subtree itself + queued files + unfinished child directories
+        self.pending = 1
+        self.failed = False
+
+
+class ScanSession:
+    """
+    checkpoint of one scanner run in a local sqlite file, so a crashed or interrupted scan can be resumed.
+
+    a directory is recorded as completed once every file queued from it has been written to file_inventory
+    and all of its sub directories are completed, so a completed directory stands for its whole subtree.
+    when a directory completes the rows of its children are dropped, the table only keeps the frontier.
+    a directory with a failed hash or write is never recorded, neither are its ancestors.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_SESSION_DB, root_dirs: List[str] = (), machine_name: str = None,
+                 resume: bool = False):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.db_path = db_path
+        self.root_dirs = [os.path.normpath(r) for r in root_dirs]
+        self.machine_name = machine_name
+        # the walker thread opens directories, the writer thread finishes files
+        self._lock = threading.Lock()
+        self._nodes: Dict[str, _DirNode] = {}
+        # directories the walker is still inside, outermost first
+        self._open_dirs: List[str] = []
+        self.completed: Set[str] = set()
+
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.executescript("""
+        CREATE TABLE IF NOT EXISTS scan_session (
+            scan_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            machine TEXT,
+            roots TEXT NOT NULL,
+            status TEXT NOT NULL,
+            last_dir TEXT,
+            counters TEXT,
+            started_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS scan_completed_dir (
+            scan_id INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            PRIMARY KEY (scan_id, path)
+        );
+        """)
+        roots = json.dumps(sorted(self.root_dirs))
+        self.scan_id = None
+        if resume:
+            row = self.conn.execute(
+                "SELECT scan_id FROM scan_session WHERE roots = ? AND machine IS ? AND status = 'running' "
+                "ORDER BY scan_id DESC LIMIT 1", (roots, machine_name)).fetchone()
+            if row:
+                self.scan_id = row[0]
+                self.completed = {r[0] for r in self.conn.execute(
+                    "SELECT path FROM scan_completed_dir WHERE scan_id = ?", (self.scan_id,))}
+                logger.info(f"> 恢复扫描会话: scan_id={self.scan_id}, 已完成目录数量: {len(self.completed)}")
+            else:
+                logger.info(f"> 没有可恢复的扫描会话, 重新开始: {self.root_dirs}")
+        if self.scan_id is None:
+            # an unfinished session of the same roots can no longer be resumed once a fresh scan starts
+            self.conn.execute("UPDATE scan_session SET status = 'abandoned', updated_at = CURRENT_TIMESTAMP "
+                              "WHERE roots = ? AND machine IS ? AND status = 'running'", (roots, machine_name))
+            cur = self.conn.execute("INSERT INTO scan_session (machine, roots, status) VALUES (?, ?, 'running')",
+                                    (machine_name, roots))
+            self.scan_id = cur.lastrowid
+        self.conn.commit()
+
+    def is_completed(self, dir_path: str) -> bool:
+        """used as walker prune callback"""
+        return dir_path in self.completed
+
+    # === called by the walker thread ===
+    def enter_dir(self, dir_path: str):
+        """the walker yields directories top-down, a directory that is not below the innermost open one closes it"""
+        with self._lock:
+            while self._open_dirs and not dir_path.startswith(self._open_dirs[-1].rstrip(os.sep) + os.sep):
+                self._release(self._open_dirs.pop())
+            parent = self._open_dirs[-1] if self._open_dirs else None
+            if parent:
+                self._nodes[parent].pending += 1
+            self._nodes[dir_path] = _DirNode(parent)
+            self._open_dirs.append(dir_path)
+
+    def file_queued(self, dir_path: str):
+        with self._lock:
+            self._nodes[dir_path].pending += 1
+
+    def dir_failed(self, dir_path: str):
+        with self._lock:
+            self._nodes[dir_path].failed = True
+
+    def leave_all(self):
+        """the walk of a root is over"""
+        with self._lock:
+            while self._open_dirs:
+                self._release(self._open_dirs.pop())
+
+    # === called by the writer thread ===
+    def files_done(self, dir_paths: List[str], ok: bool = True):
+        with self._lock:
+            for dir_path in dir_paths:
+                if not ok:
+                    self._nodes[dir_path].failed = True
+                self._release(dir_path)
+
+    def _release(self, dir_path: str):
+        while dir_path is not None:
+            node = self._nodes[dir_path]
+            node.pending -= 1
+            if node.pending:
+                return
+            del self._nodes[dir_path]
+            if node.failed:
+                if node.parent:
+                    self._nodes[node.parent].failed = True
+            else:
+                self._mark_completed(dir_path)
+            dir_path = node.parent
+
+    def _mark_completed(self, dir_path: str):
+        like = dir_path.rstrip(os.sep).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + os.sep + '%'
+        self.conn.execute("DELETE FROM scan_completed_dir WHERE scan_id = ? AND path LIKE ? ESCAPE '\\'",
+                          (self.scan_id, like))
+        self.conn.execute("INSERT OR IGNORE INTO scan_completed_dir (scan_id, path) VALUES (?, ?)",
+                          (self.scan_id, dir_path))
+        self.conn.execute("UPDATE scan_session SET last_dir = ? WHERE scan_id = ?", (dir_path, self.scan_id))
+
+    def checkpoint(self, counters: Dict[str, int] = None):
+        """commit the completed directories, called after every batch written to postgres"""
+        with self._lock:
+            if counters is not None:
+                self.conn.execute("UPDATE scan_session SET counters = ?, updated_at = CURRENT_TIMESTAMP WHERE scan_id = ?",
+                                  (json.dumps(counters), self.scan_id))
+            self.conn.commit()
+
+    def finish(self, counters: Dict[str, int], status: str = 'completed'):
+        with self._lock:
+            self.conn.execute("UPDATE scan_session SET status = ?, counters = ?, updated_at = CURRENT_TIMESTAMP WHERE scan_id = ?",
+                              (status, json.dumps(counters), self.scan_id))
+            self.conn.commit()
+        self.conn.close()
@@ -1,17 +1,24 @@
 import sys
 import os
 import socket
-import psycopg2
 import yaml
-import time
-from psycopg2.extras import execute_batch, execute_values
-from datetime import datetime
+from psycopg2.extras import execute_values
 import argparse
+from dataclasses import replace
+from datetime import datetime
 
 from global_config.logger_config import logger
-from file_scanner.device_utils import list_mounted_devices
+from global_config.db_pool import configure_pool, pooled_connection
+from file_scanner.device_utils import DEFAULT_HASH_BLOCK_SIZE, LARGE_FILE_THRESHOLD as DEFAULT_LARGE_FILE_THRESHOLD
 from file_scanner.mount_path_utils import MountPathUtil
-from file_scanner.device_utils import calculate_md5, get_mime_type
+from file_scanner.inventory_store import InventoryStore
+from file_scanner.scan_pipeline import ScanPipeline, resolve_quick_fingerprint_collisions
+from file_scanner.walker import WalkRules
+from file_scanner.scan_session import DEFAULT_SESSION_DB, ScanSession
+from file_scanner.scan_metrics import ScanMetrics
+from file_scanner.inode_cache import InodeCache
+from file_scanner.scan_jobs import ScanJobQueue, plan_jobs, run_worker
+from file_scanner.fs_watcher import FsWatcher
 
 logger.name = os.path.basename(__file__)
 
@@ -35,8 +42,15 @@ logger.info("✅ Loaded config:")
 logger.info(config)
 
 parser = argparse.ArgumentParser(description="File Scanner")
-parser.add_argument("root_dirs", metavar='FILE', nargs='+', help='scanning dirs')
-parser.add_argument("--run_mode", choices=['scan', 'list_disks', 'list_mount_path'], default='scan', help='show all external disks or scan files in particular dirs')
+parser.add_argument("root_dirs", metavar='FILE', nargs='*', help='scanning dirs, scan_dirs of the config when omitted')
+parser.add_argument("--full_hash", action='store_true', help='compute full digests for every file even when full_hash is on_collision in config')
+parser.add_argument("--resume", action='store_true', help='continue the last unfinished scan of the same dirs, skipping completed subtrees')
+parser.add_argument("--run_mode", choices=['scan', 'list_disks', 'list_mount_path', 'enqueue', 'worker', 'watch'], default='scan',
+                    help='show all external disks or scan files in particular dirs; enqueue: add the dirs to scan_job, worker: scan jobs from scan_job, '
+                         'watch: keep the dirs up to date from inotify events')
+parser.add_argument("--split_depth", type=int, default=0, help='enqueue: one job per sub directory at this depth below every dir')
+parser.add_argument("--priority", type=int, default=0, help='enqueue: jobs of higher priority are claimed first')
+parser.add_argument("--wait", action='store_true', help='worker: keep polling scan_job when it is empty instead of exiting')
 args = parser.parse_args()
 
 logger.info("✅ Loaded args:")
@@ -58,13 +72,65 @@ else:
 
     ROOT_DIRS = [os.path.expanduser(p) for p in root_dirs] if root_dirs else [os.path.expanduser(p) for p in config.get('scan_dirs', ['/tmp'])]
     DB_CONFIG = config.get('db', {})
+    # db_pool: {minconn, maxconn, health_check_secs}
+    configure_pool(**config.get('db_pool', {}))
     TABLE_NAME = config.get('table_name', 'file_inventory')
-    BATCH_SIZE = config.get('batch_size', 100)
+    # copy: COPY into a staging table + one merge statement per batch, batch: execute_batch of single-row statements
+    WRITE_BACKEND = config.get('write_backend', 'copy')
+    BATCH_SIZE = config.get('batch_size', 5000 if WRITE_BACKEND == 'copy' else 100)
     FORCE_UPDATE = config.get('force_update', False)
+    # incremental: skip hashing when (size, mtime_ns, inode, device) are unchanged
+    INCREMENTAL = config.get('incremental', True)
+    # prefetch existing rows per 'dir' (one query per directory) or per 'root' (one query per scanning dir)
+    PREFETCH_SCOPE = config.get('prefetch_scope', 'root')
+    PREFETCH_ITERSIZE = config.get('prefetch_itersize', 10000)
+    # pipeline: walker -> hash_workers threads -> single db writer, connected by queues of queue_size
+    HASH_WORKERS = config.get('hash_workers', 2)
+    QUEUE_SIZE = config.get('queue_size', 1000)
+    REPORT_INTERVAL_SECS = config.get('report_interval_secs', 30)
+    # digests computed in the same read pass, md5 is always included; xxh3_128 needs xxhash, blake3 needs blake3
+    HASH_ALGORITHMS = config.get('hash_algorithms', ['md5', 'xxh3_128'])
+    HASH_BLOCK_SIZE = config.get('hash_block_size', DEFAULT_HASH_BLOCK_SIZE)
+    # 'always' or 'on_collision': large files only get a quick fingerprint until another file collides with it
+    FULL_HASH = 'always' if args.full_hash else config.get('full_hash', 'always')
+    # auto | buffered | mmap | fadvise | direct, auto reads files >= large_file_threshold with drop-behind
+    HASH_IO_BACKEND = config.get('hash_io_backend', 'auto')
+    LARGE_FILE_THRESHOLD = config.get('large_file_threshold', DEFAULT_LARGE_FILE_THRESHOLD)
+    # exclude_dirs, include_globs, exclude_globs, max_depth, one_file_system
+    WALK_RULES = WalkRules.from_config(config)
+    # local sqlite checkpoint of completed subtrees, read back by --resume
+    CHECKPOINT = config.get('checkpoint', True)
+    SESSION_DB = os.path.expanduser(config.get('session_db', DEFAULT_SESSION_DB))
+    # throughput and stage times, written every report interval; metrics_table: null turns the table off
+    METRICS_TABLE = config.get('metrics_table', 'scan_metrics')
+    METRICS_TEXTFILE = config.get('metrics_textfile')
+    # keep duplicate_group up to date for the md5s every batch adds or removes
+    DUPLICATE_GROUPS = config.get('duplicate_groups', True)
+    # hardlinked files are read once per inode; inode_cache_db also keeps their digests across scans (e.g. rsnapshot trees)
+    INODE_CACHE = config.get('inode_cache', True)
+    INODE_CACHE_DB = config.get('inode_cache_db')
+    # inodes kept in memory, the least recently used are dropped (still in inode_cache_db when configured)
+    INODE_CACHE_MAX_ENTRIES = config.get('inode_cache_max_entries', 100000)
+    # scan_job coordination between hosts: lease renewed every lease_secs / 3 by a heartbeat, retried max_attempts times
+    JOB_LEASE_SECS = config.get('job_lease_secs', 300)
+    JOB_MAX_ATTEMPTS = config.get('job_max_attempts', 3)
+    JOB_POLL_SECS = config.get('job_poll_secs', 60)
+    # watch mode: a changed file is hashed once it had no event for watch_debounce_secs
+    WATCH_DEBOUNCE_SECS = config.get('watch_debounce_secs', 2.0)
+    WATCH_INITIAL_SCAN = config.get('watch_initial_scan', True)
 
     # === 获取本机主机名 ===
     machine_name = socket.gethostname()
 
+    if args.run_mode == 'enqueue':
+        job_queue = ScanJobQueue(DB_CONFIG, lease_secs=JOB_LEASE_SECS)
+        for root_dir in ROOT_DIRS:
+            jobs = plan_jobs(root_dir, mountPathUtil, split_depth=args.split_depth, rules=WALK_RULES)
+            count = job_queue.enqueue(jobs, root_hint=f"{machine_name}:{root_dir}", priority=args.priority,
+                                      max_attempts=JOB_MAX_ATTEMPTS)
+            logger.info(f"✅ 已加入扫描任务: {root_dir}, 任务数量: {len(jobs)}, 写入: {count}")
+        sys.exit(0)
+
 
     UPSERT_SQL = """
     INSERT INTO mount_info (uuid, mount_path, device, filesystem_type, label, is_external, partition_uuid, mounted_at)
@@ -87,119 +153,79 @@ else:
                         ) for mountInfo in mount_points]
         logger.info(f'mountInfoList: {mountInfoList}')
         try:
-            conn = psycopg2.connect(**DB_CONFIG)
-            with conn, conn.cursor() as cur:
+            with pooled_connection(**DB_CONFIG) as conn, conn.cursor() as cur:
                 execute_values(cur, sql=UPSERT_SQL,argslist=mountInfoList,template="(%s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)")
         except Exception as e:
             logger.info(f"❌ failed to write disk mount info: {str(e)}")
 
     insert_disk_mount_info()
 
-
-
-    insert_sql = f"""
-    INSERT INTO {TABLE_NAME} (machine, path, mime_type, md5, size, scanned_at, gmt_create, scan_duration_secs, deleted, mount_uuid, relative_path)
-    VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, %s, 0, %s, %s);
-    """
-
-    mark_old_sql = f"""
-    UPDATE {TABLE_NAME}
-    SET deleted = 1, scanned_at = CURRENT_TIMESTAMP
-    WHERE path = %s AND deleted = 0;
-    """
-
-    # === 扫描并处理文件 ===
-    def get_existing_record(path):
-        try:
-            conn = psycopg2.connect(**DB_CONFIG)
-            with conn:
-                with conn.cursor() as cur:
-                    cur.execute(f"SELECT md5, size, id FROM {TABLE_NAME} WHERE path = %s AND deleted = 0;", (path,))
-                    row = cur.fetchone()
-            conn.close()
-            return row
-        except Exception as e:
-            logger.info(f"❌ 查询旧记录失败: {str(e)}")
-            return None
-
-    def mark_old_record(path):
+    inode_cache = InodeCache(os.path.expanduser(INODE_CACHE_DB) if INODE_CACHE_DB else None,
+                             max_entries=INODE_CACHE_MAX_ENTRIES) if INODE_CACHE else None
+    store = InventoryStore(DB_CONFIG, table_name=TABLE_NAME, prefetch_itersize=PREFETCH_ITERSIZE,
+                           write_backend=WRITE_BACKEND, duplicate_groups=DUPLICATE_GROUPS)
+
+    def new_pipeline(root_dirs, resume=False, walk_rules=WALK_RULES, scan_id=None, checkpoint=CHECKPOINT, with_metrics=True,
+                     prefetch_scope=PREFETCH_SCOPE, cancel=None):
+        session = ScanSession(SESSION_DB, root_dirs, machine_name, resume=resume) if checkpoint or resume else None
+        scan_id = scan_id or (session.scan_id if session else datetime.now().strftime('%Y%m%d_%H%M%S'))
+        metrics = ScanMetrics(scan_id, machine_name, DB_CONFIG, table_name=METRICS_TABLE,
+                              textfile=os.path.expanduser(METRICS_TEXTFILE) if METRICS_TEXTFILE else None) if with_metrics else None
+        return ScanPipeline(store, mountPathUtil, machine_name=machine_name,
+                            hash_workers=HASH_WORKERS, queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE,
+                            incremental=INCREMENTAL, force_update=FORCE_UPDATE, prefetch_scope=prefetch_scope,
+                            report_interval_secs=REPORT_INTERVAL_SECS,
+                            hash_algorithms=HASH_ALGORITHMS, hash_block_size=HASH_BLOCK_SIZE, full_hash=FULL_HASH,
+                            io_backend=HASH_IO_BACKEND, large_file_threshold=LARGE_FILE_THRESHOLD,
+                            walk_rules=walk_rules, session=session, metrics=metrics,
+                            inode_cache=inode_cache, cancel=cancel)
+
+    def resolve_collisions(counters):
+        """
+        on_collision: the rows a worker job or a watch batch stored with only a quick fingerprint get their full
+        digests when they collide, as after a one-shot scan; without it they would keep md5 NULL for good
+        """
+        if FULL_HASH == 'on_collision' and counters.get('quick_only'):
+            resolve_quick_fingerprint_collisions(store, HASH_ALGORITHMS, HASH_BLOCK_SIZE, HASH_WORKERS,
+                                                 HASH_IO_BACKEND, LARGE_FILE_THRESHOLD)
+        return counters
+
+    if args.run_mode == 'worker':
+        def run_job(job, real_path, cancel):
+            walk_rules = WALK_RULES if job.max_depth is None else replace(WALK_RULES, max_depth=job.max_depth)
+            # a files-only job must not prefetch the whole subtree below it (e.g. a whole disk for its mount root)
+            prefetch_scope = 'dir' if job.max_depth == 0 else PREFETCH_SCOPE
+            # a job retried on this host resumes from its local checkpoint
+            return resolve_collisions(new_pipeline([real_path], resume=True, walk_rules=walk_rules, scan_id=f'job-{job.id}',
+                                                   prefetch_scope=prefetch_scope, cancel=cancel).run([real_path]))
+
+        job_queue = ScanJobQueue(DB_CONFIG, lease_secs=JOB_LEASE_SECS)
+        totals = run_worker(job_queue, mountPathUtil, run_job, wait=args.wait, poll_secs=JOB_POLL_SECS)
+        if inode_cache:
+            inode_cache.close()
+        logger.info(f"✅ 扫描任务队列已空: {totals}")
+        sys.exit(0)
+
+    if args.run_mode == 'watch':
+        watcher = FsWatcher(ROOT_DIRS, store, mountPathUtil,
+                            # small batches of changed files: no checkpoint and no scan_metrics row per batch
+                            scan_files=lambda files: resolve_collisions(
+                                new_pipeline([], checkpoint=False, with_metrics=False).run([], files=files)),
+                            rescan=lambda roots: resolve_collisions(new_pipeline(roots, checkpoint=False).run(roots)),
+                            rules=WALK_RULES, debounce_secs=WATCH_DEBOUNCE_SECS)
         try:
-            conn = psycopg2.connect(**DB_CONFIG)
-            with conn:
-                with conn.cursor() as cur:
-                    cur.execute(mark_old_sql, (path,))
-            conn.close()
-        except Exception as e:
-            logger.info(f"❌ 标记旧记录失败: {str(e)}")
-
-    insert_batch = []
-    total_inserted = 0
-    MIN_FILE_COUNT=10
-
-    scanning_count = 0
-    for root_dir in ROOT_DIRS:
-        logger.info(f"> 正在扫描目录: {root_dir}")
-        for root, _, files in os.walk(root_dir):
-            files_count = len(files)
-            if files_count>MIN_FILE_COUNT:
-                logger.info(f"> 正在扫描目录: {root_dir} 中的(文件数量大于{MIN_FILE_COUNT})子目录: {root}, 其中文件数量: {files_count}")
-            for name in files:
-                scanning_count += 1
-                if scanning_count % 1000 == 0:
-                    logger.info(f"> 累计扫描文件数量: {scanning_count}")
-                    
-                full_path = os.path.join(root, name)
-                mount_conversion = mountPathUtil.real_path_2_logical(full_path)
-                disk_uuid, relative_path = None, None
-                if mount_conversion:
-                    disk_uuid, relative_path = mount_conversion
-                try:
-                    if os.path.isfile(full_path):
-                        start_time = time.time()
-                        mime_type = get_mime_type(full_path)
-                        md5_hash = calculate_md5(full_path)
-                        file_size = os.path.getsize(full_path)
-                        duration = round(time.time() - start_time, 4)
-                        if not md5_hash:
-                            continue
-
-                        if FORCE_UPDATE:
-                            mark_old_record(full_path)
-                            insert_batch.append((machine_name, full_path, mime_type, md5_hash, file_size, duration, disk_uuid, relative_path))
-                        else:
-                            old_record = get_existing_record(full_path)
-                            if old_record is None:
-                                insert_batch.append((machine_name, full_path, mime_type, md5_hash, file_size, duration, disk_uuid, relative_path))
-                            else:
-                                old_md5, old_size, old_id = old_record
-                                if md5_hash != old_md5 or file_size != old_size:
-                                    mark_old_record(full_path)
-                                    insert_batch.append((machine_name, full_path, mime_type, md5_hash, file_size, duration, disk_uuid, relative_path))
-
-                        if len(insert_batch) >= BATCH_SIZE:
-                            insert_records = insert_batch[:]
-                            insert_batch.clear()
-                            try:
-                                conn = psycopg2.connect(**DB_CONFIG)
-                                with conn, conn.cursor() as cur:
-                                    execute_batch(cur, insert_sql, insert_records)
-                                total_inserted += len(insert_records)
-                                logger.info(f"> 累计写入文件数量: {total_inserted}")
-                            except Exception as e:
-                                logger.info(f"❌ 批量写入失败: {str(e)}")
-                except Exception:
-                    continue
-
-    # === 写入剩余数据 ===
-    if insert_batch:
-        try:
-            conn = psycopg2.connect(**DB_CONFIG)
-            with conn:
-                with conn.cursor() as cur:
-                    execute_batch(cur, insert_sql, insert_batch)
-            conn.close()
-            total_inserted += len(insert_batch)
-        except Exception as e:
-            logger.info(f"❌ 批量写入失败: {str(e)}")
-
-    logger.info(f"✅ 总共插入 {total_inserted} 条记录。")
+            watcher.run(initial_scan=WATCH_INITIAL_SCAN)
+        except KeyboardInterrupt:
+            pass
+        if inode_cache:
+            inode_cache.close()
+        sys.exit(0)
+
+    counters = new_pipeline(ROOT_DIRS, resume=args.resume).run(ROOT_DIRS)
+    if inode_cache:
+        inode_cache.close()
+    if FULL_HASH == 'on_collision':
+        resolve_quick_fingerprint_collisions(store, HASH_ALGORITHMS, HASH_BLOCK_SIZE, HASH_WORKERS,
+                                             HASH_IO_BACKEND, LARGE_FILE_THRESHOLD)
+
+    logger.info(f"✅ 总共插入 {counters['inserted']} 条记录, 扫描 {counters['scanned']} 个文件, 未变化跳过 {counters['skipped']} 个。")
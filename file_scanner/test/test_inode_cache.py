@@ -0,0 +1,84 @@
+import threading
+import time
+
+from file_scanner.inode_cache import InodeCache
+
+KEY = (1, 42, 100, 0)
+VALUE = ('video/mp4', {'md5': 'abc'}, 'fp')
+
+
+def _claim_in_threads(cache, n, hash_value):
+    """n threads claim KEY at once, a claimer sleeps (hashing) and publishes hash_value(attempt)"""
+    results, hashed = [None] * n, []
+    lock = threading.Lock()
+    start = threading.Barrier(n)
+
+    def worker(i):
+        start.wait()
+        # waiters woken by a failed publish retry inside claim(), one of them gets None and reads the file
+        value = cache.claim(KEY, None, full_hash=True)
+        if value is None:
+            with lock:
+                hashed.append(i)
+                attempt = len(hashed)
+            time.sleep(0.05)
+            value = hash_value(attempt)
+            cache.publish(KEY, None, value)
+        results[i] = value
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    assert not any(t.is_alive() for t in threads)
+    return results, hashed
+
+
+def test_one_thread_hashes_the_others_wait():
+    results, hashed = _claim_in_threads(InodeCache(), 4, lambda attempt: VALUE)
+    assert len(hashed) == 1
+    assert results == [VALUE] * 4
+
+
+def test_failed_publish_releases_waiters():
+    # the first read fails, one of the waiters claims the inode and succeeds
+    results, hashed = _claim_in_threads(InodeCache(), 4, lambda attempt: None if attempt == 1 else VALUE)
+    assert len(hashed) == 2
+    assert results.count(VALUE) == 3 and results.count(None) == 1
+
+
+def test_fingerprint_only_value_does_not_serve_full_hash(tmp_path):
+    cache = InodeCache(str(tmp_path / 'inodes.sqlite3'))
+    assert cache.claim(KEY, ('uuid', 42, 100, 0), full_hash=False) is None
+    cache.publish(KEY, ('uuid', 42, 100, 0), ('video/mp4', {}, 'fp'))
+    assert cache.claim(KEY, ('uuid', 42, 100, 0), full_hash=False) == ('video/mp4', {}, 'fp')
+    # a path that needs digests claims it again and upgrades the entry
+    assert cache.claim(KEY, ('uuid', 42, 100, 0), full_hash=True) is None
+    cache.publish(KEY, ('uuid', 42, 100, 0), VALUE)
+    cache.close()
+
+    # persisted by mount uuid, found again under another st_dev
+    reopened = InodeCache(str(tmp_path / 'inodes.sqlite3'))
+    assert reopened.claim((2, 42, 100, 0), ('uuid', 42, 100, 0), full_hash=True) == VALUE
+    reopened.close()
+
+
+def test_memory_is_bounded(tmp_path):
+    cache = InodeCache(max_entries=2)
+    for ino in (1, 2, 3):
+        assert cache.claim((1, ino, 100, 0), None, full_hash=True) is None
+        cache.publish((1, ino, 100, 0), None, VALUE)
+    # inode 1 was the least recently used, without a db it has to be hashed again
+    assert len(cache._done) == 2
+    assert cache.claim((1, 3, 100, 0), None, full_hash=True) == VALUE
+    assert cache.claim((1, 1, 100, 0), None, full_hash=True) is None
+    cache.publish((1, 1, 100, 0), None, VALUE)
+
+    persisted = InodeCache(str(tmp_path / 'inodes.sqlite3'), max_entries=1)
+    for ino in (1, 2):
+        persisted.claim((1, ino, 100, 0), ('uuid', ino, 100, 0), full_hash=True)
+        persisted.publish((1, ino, 100, 0), ('uuid', ino, 100, 0), VALUE)
+    # evicted from memory, found again in sqlite
+    assert persisted.claim((1, 1, 100, 0), ('uuid', 1, 100, 0), full_hash=True) == VALUE
+    persisted.close()
@@ -0,0 +1,64 @@
+import hashlib
+import os
+
+import pytest
+
+from file_scanner.device_utils import IO_BACKENDS, calculate_hashes, iter_file_blocks, select_io_backend
+
+BLOCK = 4096
+THRESHOLD = 3 * BLOCK
+SIZES = [0, 1, BLOCK - 1, BLOCK, BLOCK + 1, THRESHOLD - 1, THRESHOLD, THRESHOLD + 1, 5 * BLOCK + 123]
+
+
+@pytest.fixture(scope='module')
+def files(tmp_path_factory):
+    root = tmp_path_factory.mktemp('io_backends')
+    result = []
+    for size in SIZES:
+        data = os.urandom(size)
+        path = root / f'f{size}'
+        path.write_bytes(data)
+        result.append((str(path), data))
+    return result
+
+
+@pytest.mark.parametrize('io_backend', IO_BACKENDS)
+def test_backends_match_hashlib(files, io_backend):
+    for path, data in files:
+        hashes = calculate_hashes(path, ('md5', 'sha1'), BLOCK, io_backend, THRESHOLD)
+        assert hashes == {'md5': hashlib.md5(data).hexdigest(), 'sha1': hashlib.sha1(data).hexdigest()}, (path, io_backend)
+
+
+@pytest.mark.parametrize('io_backend', IO_BACKENDS)
+def test_backends_match_xxh3(files, io_backend):
+    xxhash = pytest.importorskip('xxhash')
+    for path, data in files:
+        hashes = calculate_hashes(path, ('md5', 'xxh3_128'), BLOCK, io_backend, THRESHOLD)
+        assert hashes['xxh3_128'] == xxhash.xxh3_128(data).hexdigest(), (path, io_backend)
+
+
+@pytest.mark.parametrize('io_backend', IO_BACKENDS)
+def test_blocks_cover_the_file(files, io_backend):
+    for path, data in files:
+        assert b''.join(bytes(b) for b in iter_file_blocks(path, BLOCK, io_backend, THRESHOLD)) == data
+
+
+def test_direct_falls_back(files, monkeypatch):
+    # file systems without O_DIRECT (tmpfs, some FUSE) are read through the fadvise path instead
+    real_open = os.open
+
+    def open_without_direct(path, flags, *args):
+        if flags & getattr(os, 'O_DIRECT', 0):
+            raise OSError(22, 'Invalid argument')
+        return real_open(path, flags, *args)
+
+    monkeypatch.setattr(os, 'open', open_without_direct)
+    for path, data in files:
+        assert calculate_hashes(path, ('md5',), BLOCK, 'direct', THRESHOLD) == {'md5': hashlib.md5(data).hexdigest()}
+
+
+def test_auto_switches_at_threshold():
+    assert select_io_backend(THRESHOLD - 1, 'auto', THRESHOLD) == 'buffered'
+    expected = 'fadvise' if hasattr(os, 'posix_fadvise') else 'buffered'
+    assert select_io_backend(THRESHOLD, 'auto', THRESHOLD) == expected
+    assert select_io_backend(1, 'mmap', THRESHOLD) == 'mmap'
@@ -0,0 +1,39 @@
+from types import SimpleNamespace
+
+from file_scanner.mount_path_utils import MountPathUtil
+
+
+def _mount(mount_path, uuid, partition_uuid=None):
+    return SimpleNamespace(mount_path=mount_path, uuid=uuid, partition_uuid=partition_uuid)
+
+
+def _util():
+    return MountPathUtil.from_mount_points([
+        _mount('/', 'root-uuid'),
+        _mount('/media/disk1', 'disk1-uuid', 'disk1-part'),
+        _mount('/media/disk10', 'disk10-uuid'),
+        _mount('/media/disk1/nested', 'nested-uuid'),
+    ])
+
+
+def test_real_path_2_logical_longest_prefix():
+    util = _util()
+    assert util.real_path_2_logical('/media/disk1/a/b.mp4') == ('disk1-part', 'a/b.mp4')
+    assert util.real_path_2_logical('/media/disk10/c.mp4') == ('disk10-uuid', 'c.mp4')
+    assert util.real_path_2_logical('/media/disk1/nested/d.mp4') == ('nested-uuid', 'd.mp4')
+    assert util.real_path_2_logical('/home/user/e.txt') == ('root-uuid', 'home/user/e.txt')
+    assert MountPathUtil.from_mount_points([_mount('/media/disk1', 'x')]).real_path_2_logical('/home/e.txt') is None
+
+
+def test_logical_path_2_real():
+    util = _util()
+    assert util.logical_path_2_real('disk1-part', 'a/b.mp4') == '/media/disk1/a/b.mp4'
+    assert util.logical_path_2_real('disk1-uuid', 'a/b.mp4') == '/media/disk1/a/b.mp4'
+    assert util.logical_path_2_real('unknown', 'a') is None
+
+
+def test_batch_conversions():
+    util = _util()
+    paths = ['/media/disk10/c.mp4', '/media/disk1/a/b.mp4']
+    logical = util.real_paths_2_logical(paths)
+    assert util.logical_paths_2_real(logical + [('unknown', 'x')]) == paths + [None]
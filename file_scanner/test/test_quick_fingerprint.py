@@ -0,0 +1,116 @@
+import hashlib
+import os
+from types import SimpleNamespace
+
+from file_scanner.device_utils import (QUICK_FINGERPRINT_SAMPLE_SIZE, calculate_quick_fingerprint,
+                                       needs_full_hash_for_quick_fingerprint, scan_file)
+from file_scanner.scan_pipeline import ScanPipeline, ScanTask, resolve_quick_fingerprint_collisions
+
+SAMPLE = 4096
+
+
+def _write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return str(path)
+
+
+def _flip(data, offset):
+    data = bytearray(data)
+    data[offset] ^= 0xff
+    return bytes(data)
+
+
+def _fp(path):
+    return calculate_quick_fingerprint(path, sample_size=SAMPLE)
+
+
+def test_only_sampled_ranges_count(tmp_path):
+    size = 10 * SAMPLE
+    base = os.urandom(size)
+    a = _write(tmp_path / 'a', base)
+    # samples: [0, 4096), [size/2 - 2048, size/2 + 2048), [size - 4096, size)
+    outside = _write(tmp_path / 'outside', _flip(base, 2 * SAMPLE))
+    middle = _write(tmp_path / 'middle', _flip(base, size // 2))
+    last = _write(tmp_path / 'last', _flip(base, size - 1))
+    assert _fp(a) == _fp(outside)
+    assert _fp(a) != _fp(middle)
+    assert _fp(a) != _fp(last)
+    # the size is part of the fingerprint
+    assert _fp(a) != _fp(_write(tmp_path / 'longer', base + b'\0'))
+
+
+def test_small_files_are_read_whole(tmp_path):
+    size = 3 * SAMPLE
+    base = os.urandom(size)
+    a = _write(tmp_path / 'a', base)
+    b = _write(tmp_path / 'b', _flip(base, 2 * SAMPLE))
+    assert _fp(a) != _fp(b)
+    assert needs_full_hash_for_quick_fingerprint(size, SAMPLE)
+    assert not needs_full_hash_for_quick_fingerprint(size + 1, SAMPLE)
+
+
+def test_scan_file_fingerprint_matches(tmp_path):
+    for size in (0, 100, 3 * SAMPLE, 3 * SAMPLE + 1, 10 * SAMPLE + 7):
+        data = os.urandom(size)
+        path = _write(tmp_path / f'f{size}', data)
+        _, hashes, quick_fp = scan_file(path, size, ('md5',), True, block_size=1000, sample_size=SAMPLE)
+        assert hashes['md5'] == hashlib.md5(data).hexdigest()
+        assert quick_fp == _fp(path)
+        _, hashes, quick_fp = scan_file(path, size, ('md5',), False, sample_size=SAMPLE)
+        assert hashes == {} and quick_fp == _fp(path)
+
+
+def test_on_collision_full_hash_decision():
+    pipeline = ScanPipeline(None, None, full_hash='on_collision')
+
+    def task(size, old_record=None):
+        return ScanTask('/x', SimpleNamespace(st_size=size), old_record, None, None)
+
+    small, large = 3 * QUICK_FINGERPRINT_SAMPLE_SIZE, 3 * QUICK_FINGERPRINT_SAMPLE_SIZE + 1
+    assert pipeline._needs_full_hash(task(small))
+    assert not pipeline._needs_full_hash(task(large))
+    # a changed file whose row had an md5 is rehashed, not downgraded to a fingerprint
+    assert pipeline._needs_full_hash(task(large, ('md5', large, 1, 0, 0, 0, 'fp')))
+    assert not pipeline._needs_full_hash(task(large, (None, large, 1, 0, 0, 0, 'fp')))
+    assert ScanPipeline(None, None, full_hash='always')._needs_full_hash(task(large))
+
+
+class _Store:
+    def __init__(self, rows):
+        self.rows = rows
+        self.updates = None
+
+    def load_quick_fingerprint_peers(self):
+        return self.rows
+
+    def update_hashes(self, hash_records, quick_fp_records):
+        self.updates = (sorted(hash_records, key=lambda r: r[-1]), quick_fp_records)
+
+
+def test_collision_pass_groups_and_selects(tmp_path):
+    a = _write(tmp_path / 'a', b'a' * 100)
+    b = _write(tmp_path / 'b', b'b' * 100)
+    c = _write(tmp_path / 'c', b'c' * 100)
+    d = _write(tmp_path / 'd', b'd' * 50)
+    e = _write(tmp_path / 'e', b'd' * 50)
+    store = _Store([
+        (1, a, 100, None, 'fp-x'),                   # collides with 2: hashed
+        (2, b, 100, 'md5-b', 'fp-x'),                # already has md5: not hashed again
+        (3, c, 100, None, 'fp-y'),                   # no peer with the same fingerprint
+        (4, str(tmp_path / 'gone'), 100, None, 'fp-x'),   # not reachable from here
+        (5, d, 50, 'md5-d', None),                   # legacy row, gets its fingerprint first
+        (6, e, 50, None, calculate_quick_fingerprint(e)),  # collides with 5 once it has one
+    ])
+    counters = resolve_quick_fingerprint_collisions(store, ['md5'], hash_workers=2)
+    assert counters == {'fingerprinted': 1, 'hashed': 2, 'unreachable': 1}
+    hash_records, quick_fp_records = store.updates
+    assert [(r[0], r[-1]) for r in hash_records] == [(hashlib.md5(b'a' * 100).hexdigest(), 1),
+                                                     (hashlib.md5(b'd' * 50).hexdigest(), 6)]
+    assert quick_fp_records == [(calculate_quick_fingerprint(d), 5)]
+
+
+def test_collision_pass_without_peers():
+    store = _Store([])
+    assert resolve_quick_fingerprint_collisions(store) == {'fingerprinted': 0, 'hashed': 0, 'unreachable': 0}
+    assert store.updates is None
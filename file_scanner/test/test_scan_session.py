@@ -0,0 +1,120 @@
+import os
+import sqlite3
+
+import pytest
+
+from file_scanner.scan_pipeline import ScanPipeline
+from file_scanner.scan_session import ScanSession
+
+
+def _touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(path)
+
+
+class _Store:
+    """records the written paths, writes of paths below fail_below fail, prefetch_fails makes every prefetch fail"""
+
+    def __init__(self, fail_below=None, prefetch_fails=False):
+        self.fail_below = fail_below
+        self.prefetch_fails = prefetch_fails
+        self.written = []
+
+    def load_existing_records(self, dir_path, recursive=False):
+        return None if self.prefetch_fails else {}
+
+    def write(self, old_paths, insert_records, update_records):
+        paths = [r[1] for r in insert_records]
+        if self.fail_below and any(p.startswith(self.fail_below + os.sep) for p in paths):
+            return False
+        self.written += paths
+        return True
+
+
+class _MountPathUtil:
+    def real_path_2_logical(self, path):
+        return None
+
+
+def _scan(root, store, db_path, resume, prefetch_scope='root'):
+    session = ScanSession(db_path, [root], 'test-host', resume=resume)
+    pipeline = ScanPipeline(store, _MountPathUtil(), hash_workers=1, batch_size=1, session=session,
+                            prefetch_scope=prefetch_scope)
+    pipeline.run([root])
+    return session
+
+
+def _completed(db_path, scan_id):
+    # rows of the frontier are only visible to other connections after ScanSession.checkpoint()
+    with sqlite3.connect(db_path) as conn:
+        return {r[0] for r in conn.execute("SELECT path FROM scan_completed_dir WHERE scan_id = ?", (scan_id,))}
+
+
+def test_resume_walks_only_unfinished_dirs(tmp_path):
+    root = str(tmp_path / 'root')
+    db_path = str(tmp_path / 'session.sqlite3')
+    for rel in ['top.txt', 'a/1.txt', 'a/a1/2.txt', 'b/3.txt', 'b/b1/4.txt', 'c/5.txt']:
+        _touch(os.path.join(root, rel))
+    b = os.path.join(root, 'b')
+
+    first = _scan(root, _Store(fail_below=b), db_path, resume=False)
+    # the frontier only: a and c stand for their subtrees, b and the root never complete
+    assert _completed(db_path, first.scan_id) == {os.path.join(root, 'a'), os.path.join(root, 'c')}
+
+    store = _Store()
+    second = _scan(root, store, db_path, resume=True)
+    assert second.scan_id == first.scan_id
+    assert sorted(os.path.relpath(p, root) for p in store.written) == \
+        [os.path.join('b', '3.txt'), os.path.join('b', 'b1', '4.txt'), 'top.txt']
+
+    # finished: a fresh session starts, nothing left to resume
+    third = _scan(root, _Store(), db_path, resume=True)
+    assert third.scan_id != first.scan_id
+
+
+def test_dir_completes_after_its_files_and_children(tmp_path):
+    session = ScanSession(str(tmp_path / 'session.sqlite3'), ['/r'])
+    session.enter_dir('/r')
+    session.file_queued('/r')
+    session.enter_dir('/r/x')
+    session.file_queued('/r/x')
+    session.enter_dir('/r/x/y')
+    session.enter_dir('/r/z')           # closes /r/x/y (no files: completes) and /r/x (a file is still pending)
+    session.file_queued('/r/z')
+    session.leave_all()
+    session.checkpoint()
+    assert session.completed == set() and _completed(session.db_path, session.scan_id) == {'/r/x/y'}
+
+    session.files_done(['/r/x'])
+    session.files_done(['/r/z'], ok=False)
+    session.checkpoint()
+    # /r/x replaces /r/x/y in the frontier, /r/z failed and so does its parent
+    assert _completed(session.db_path, session.scan_id) == {'/r/x'}
+    session.files_done(['/r'])
+    session.checkpoint()
+    assert _completed(session.db_path, session.scan_id) == {'/r/x'}
+
+
+@pytest.mark.parametrize('prefetch_scope', ['root', 'dir'])
+def test_failed_prefetch_keeps_session_resumable(tmp_path, prefetch_scope):
+    root = str(tmp_path / 'root')
+    db_path = str(tmp_path / 'session.sqlite3')
+    for rel in ['top.txt', 'a/1.txt']:
+        _touch(os.path.join(root, rel))
+
+    session = ScanSession(db_path, [root], 'test-host')
+    pipeline = ScanPipeline(_Store(prefetch_fails=True), _MountPathUtil(), hash_workers=1, session=session,
+                            prefetch_scope=prefetch_scope)
+    if prefetch_scope == 'root':
+        # nothing of the root was scanned, the caller (e.g. run_worker) must see a failure
+        with pytest.raises(RuntimeError):
+            pipeline.run([root])
+    else:
+        assert pipeline.run([root])['prefetch_failed'] == 2
+    assert _completed(db_path, session.scan_id) == set()
+
+    store = _Store()
+    resumed = _scan(root, store, db_path, resume=True, prefetch_scope=prefetch_scope)
+    assert resumed.scan_id == session.scan_id
+    assert sorted(os.path.relpath(p, root) for p in store.written) == [os.path.join('a', '1.txt'), 'top.txt']
@@ -0,0 +1,37 @@
+import os
+
+from file_scanner.walker import WalkRules, walk
+
+
+def _touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write('x')
+
+
+def _files(root, rules=None, prune=None):
+    return [os.path.relpath(e.path, root) for _, entries in walk(str(root), rules, prune) for e in entries]
+
+
+def test_walk_sorted_and_excludes(tmp_path):
+    for rel in ['b/2.txt', 'a/1.txt', 'a/c/3.jpg', '.git/HEAD', 'node_modules/x/index.js', 'top.txt']:
+        _touch(os.path.join(tmp_path, rel))
+    assert _files(tmp_path) == ['top.txt', os.path.join('a', '1.txt'), os.path.join('a', 'c', '3.jpg'), os.path.join('b', '2.txt')]
+
+
+def test_walk_globs_and_depth(tmp_path):
+    for rel in ['a.jpg', 'a.txt', 'tmp/b.jpg', 'd1/d2/c.jpg']:
+        _touch(os.path.join(tmp_path, rel))
+    rules = WalkRules(include_globs=['*.jpg'], exclude_globs=['tmp'])
+    assert _files(tmp_path, rules) == ['a.jpg', os.path.join('d1', 'd2', 'c.jpg')]
+    assert _files(tmp_path, WalkRules(max_depth=0)) == ['a.jpg', 'a.txt']
+
+
+def test_walk_prune_and_symlinks(tmp_path):
+    _touch(os.path.join(tmp_path, 'keep', 'a.txt'))
+    _touch(os.path.join(tmp_path, 'skip', 'b.txt'))
+    os.symlink(os.path.join(tmp_path, 'keep'), os.path.join(tmp_path, 'link_dir'))
+    os.symlink(os.path.join(tmp_path, 'keep', 'a.txt'), os.path.join(tmp_path, 'link_file'))
+    os.symlink(os.path.join(tmp_path, 'missing'), os.path.join(tmp_path, 'dangling'))
+    pruned = os.path.join(str(tmp_path), 'skip')
+    assert _files(tmp_path, prune=lambda d: d == pruned) == ['link_file', os.path.join('keep', 'a.txt')]
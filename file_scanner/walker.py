@@ -0,0 +1,107 @@
+import os
+import stat
+import fnmatch
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, List, Optional, Tuple
+
+# caches, VCS metadata, trash and backup stores that never belong in the inventory
+DEFAULT_EXCLUDE_DIRS = [
+    '.git', '.svn', '.hg', 'node_modules', '__pycache__', '.cache', '.venv',
+    '.Trash', '.Trashes', '.Trash-*', '$RECYCLE.BIN', 'System Volume Information', 'lost+found',
+    '.Spotlight-V100', '.fseventsd', '.DocumentRevisions-V100', '.TemporaryItems',
+    'Backups.backupdb', '.MobileBackups',
+]
+
+
+@dataclass
+class WalkRules:
+    """
+    exclude_dirs:    glob patterns matched against directory names, matching directories are not entered
+    include_globs:   glob patterns matched against file names, empty means every file
+    exclude_globs:   glob patterns matched against the file or directory name and its path relative to the root
+    max_depth:       0 only lists the files of the root itself, None means unlimited
+    one_file_system: do not cross into directories that live on another device than the root, off by default
+                     so that scanning /mnt or /media/<user> still covers the disks mounted below it
+    """
+    exclude_dirs: List[str] = field(default_factory=lambda: list(DEFAULT_EXCLUDE_DIRS))
+    include_globs: List[str] = field(default_factory=list)
+    exclude_globs: List[str] = field(default_factory=list)
+    max_depth: Optional[int] = None
+    one_file_system: bool = False
+
+    @classmethod
+    def from_config(cls, config: dict) -> "WalkRules":
+        """reads the keys of the same names from file-scanner-config.yml"""
+        defaults = cls()
+        return cls(
+            exclude_dirs=config.get('exclude_dirs', defaults.exclude_dirs) or [],
+            include_globs=config.get('include_globs', defaults.include_globs) or [],
+            exclude_globs=config.get('exclude_globs', defaults.exclude_globs) or [],
+            max_depth=config.get('max_depth', defaults.max_depth),
+            one_file_system=config.get('one_file_system', defaults.one_file_system),
+        )
+
+    def _excluded(self, name: str, rel_path: str) -> bool:
+        return any(fnmatch.fnmatch(name, p) or fnmatch.fnmatch(rel_path, p) for p in self.exclude_globs)
+
+    def accept_dir(self, name: str, rel_path: str) -> bool:
+        if any(fnmatch.fnmatch(name, p) for p in self.exclude_dirs):
+            return False
+        return not self._excluded(name, rel_path)
+
+    def accept_file(self, name: str, rel_path: str) -> bool:
+        if self.include_globs and not any(fnmatch.fnmatch(name, p) for p in self.include_globs):
+            return False
+        return not self._excluded(name, rel_path)
+
+
+def walk(root: str, rules: Optional[WalkRules] = None,
+         prune: Optional[Callable[[str], bool]] = None) -> Iterator[Tuple[str, List[os.DirEntry]]]:
+    """
+    os.scandir based replacement of os.walk, top-down and sorted by name so that runs are repeatable.
+    yields (dir_path, file_entries) for every visited directory; file_entries are the DirEntry of regular files
+    (symlinks to files included), their stat() is cached so callers never stat a file twice.
+    directory symlinks are not followed, unreadable directories are skipped.
+    prune(dir_path) returning True skips that directory with its whole subtree.
+    """
+    rules = rules or WalkRules()
+    root = os.path.normpath(root)
+    try:
+        root_dev = os.stat(root).st_dev
+    except OSError:
+        return
+
+    stack = [(root, 0)]
+    while stack:
+        dir_path, depth = stack.pop()
+        if prune and prune(dir_path):
+            continue
+        try:
+            with os.scandir(dir_path) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            continue
+
+        rel_dir = os.path.relpath(dir_path, root)
+        files, sub_dirs = [], []
+        for entry in entries:
+            rel_path = entry.name if rel_dir == '.' else os.path.join(rel_dir, entry.name)
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if rules.max_depth is not None and depth >= rules.max_depth:
+                        continue
+                    if not rules.accept_dir(entry.name, rel_path):
+                        continue
+                    if rules.one_file_system and entry.stat(follow_symlinks=False).st_dev != root_dev:
+                        continue
+                    sub_dirs.append(entry.path)
+                elif entry.is_file() and rules.accept_file(entry.name, rel_path):
+                    # is_file() follows symlinks like os.path.isfile, a dangling link is not a file
+                    if stat.S_ISREG(entry.stat().st_mode):
+                        files.append(entry)
+            except OSError:
+                continue
+
+        yield dir_path, files
+        # reversed so that the stack pops sub directories in name order
+        stack.extend((p, depth + 1) for p in reversed(sub_dirs))
@@ -0,0 +1,133 @@
+# db_pool.py
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.extensions import make_dsn
+from psycopg2.pool import ThreadedConnectionPool
+
+from global_config.logger_config import logger
+
+# defaults, override once per process with configure_pool() before the first connection is taken
+_settings = {
+    "minconn": 1,
+    "maxconn": 8,
+    # connections idle longer than this are pinged with "SELECT 1" before being handed out
+    "health_check_secs": 30,
+}
+
+# {(pid, dsn): _Pool}, pools of a parent process are kept referenced after fork so their sockets are never closed by the child
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def configure_pool(minconn: int = None, maxconn: int = None, health_check_secs: float = None):
+    """
+    set the pool size and health check interval, only affects pools created afterwards
+    """
+    if minconn is not None:
+        _settings["minconn"] = int(minconn)
+    if maxconn is not None:
+        _settings["maxconn"] = int(maxconn)
+    if health_check_secs is not None:
+        _settings["health_check_secs"] = float(health_check_secs)
+
+
+class _Pool:
+    def __init__(self, dsn: str):
+        self.minconn = _settings["minconn"]
+        self.maxconn = max(_settings["maxconn"], self.minconn, 1)
+        self.health_check_secs = _settings["health_check_secs"]
+        self.pool = ThreadedConnectionPool(self.minconn, self.maxconn, dsn)
+        # ThreadedConnectionPool raises PoolError when exhausted, block callers instead
+        self.slots = threading.BoundedSemaphore(self.maxconn)
+        self.last_used = {}
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        now = time.monotonic()
+        # connections never handed out before were just opened by the pool
+        if now - self.last_used.get(id(conn), now) < self.health_check_secs:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def getconn(self):
+        self.slots.acquire()
+        try:
+            # every broken connection is discarded, so maxconn + 1 attempts always reach a fresh one
+            for _ in range(self.maxconn + 1):
+                conn = self.pool.getconn()
+                if self._is_healthy(conn):
+                    return conn
+                logger.info("db_pool: discard broken connection")
+                self.last_used.pop(id(conn), None)
+                self.pool.putconn(conn, close=True)
+            raise psycopg2.OperationalError("db_pool: no healthy connection available")
+        except Exception:
+            self.slots.release()
+            raise
+
+    def putconn(self, conn):
+        try:
+            if not conn.closed and conn.autocommit:
+                conn.autocommit = False
+            self.last_used[id(conn)] = time.monotonic()
+            self.pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            self.slots.release()
+
+
+def get_pool(dsn: str = None, **connect_kwargs) -> _Pool:
+    """
+    returns the pool of the current process for a dsn string or psycopg2.connect keyword arguments
+    """
+    key = (os.getpid(), make_dsn(dsn, **connect_kwargs))
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _Pool(key[1])
+                _pools[key] = pool
+                logger.info(f"db_pool: created pool, pid={key[0]}, minconn={pool.minconn}, maxconn={pool.maxconn}")
+    return pool
+
+
+@contextmanager
+def pooled_connection(dsn: str = None, **connect_kwargs):
+    """
+    borrow a connection like `with psycopg2.connect(...) as conn`:
+    commit on success, rollback on exception, and give it back to the pool instead of leaking or closing it
+    """
+    pool = get_pool(dsn, **connect_kwargs)
+    conn = pool.getconn()
+    try:
+        yield conn
+        if not conn.closed:
+            conn.commit()
+    except Exception:
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+def close_all():
+    """close the pools owned by the current process"""
+    pid = os.getpid()
+    with _pools_lock:
+        for key in [k for k in _pools if k[0] == pid]:
+            _pools.pop(key).pool.closeall()
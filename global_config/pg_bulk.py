@@ -0,0 +1,128 @@
+# pg_bulk.py
+"""
+bulk writes through COPY ... FROM STDIN into a temporary staging table, merged with one set-based statement.
+
+    with pooled_connection(dsn) as conn, conn.cursor() as cur:
+        bulk_insert(cur, 'file_inventory', ['machine', 'path', ...], rows, constants={'gmt_create': 'CURRENT_TIMESTAMP'})
+        bulk_update(cur, 'file_inventory', 'id', ['id', 'mtime_ns', ...], rows)
+
+the staging table is dropped at commit, so every call must run inside a transaction (not in autocommit mode).
+"""
+import io
+import json
+import zlib
+import datetime
+from decimal import Decimal
+from typing import Dict, Iterable, List, Sequence
+
+from psycopg2 import sql
+from psycopg2.extras import Json
+
+# rows per COPY buffer, bounds the memory of huge batches
+COPY_CHUNK_ROWS = 50000
+
+
+def _csv_value(value) -> str:
+    # unquoted empty is NULL in csv COPY, quoted "" is an empty string
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (int, float, Decimal)):
+        return str(value)
+    if isinstance(value, Json):
+        value = value.dumps(value.adapted)
+    elif isinstance(value, (dict, list)):
+        value = json.dumps(value, ensure_ascii=False)
+    elif isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        value = value.isoformat()
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        value = '\\x' + bytes(value).hex()
+    else:
+        value = str(value)
+    return '"' + value.replace('"', '""') + '"'
+
+
+def _csv_buffer(rows: Iterable[Sequence]) -> io.StringIO:
+    buf = io.StringIO()
+    for row in rows:
+        buf.write(','.join(_csv_value(v) for v in row))
+        buf.write('\n')
+    buf.seek(0)
+    return buf
+
+
+def _staging_name(table: str, columns: Sequence[str]) -> str:
+    # one staging table per (table, column list), so two writers on the same connection never clash
+    key = zlib.crc32(','.join(columns).encode()) & 0xffffffff
+    return f"_bulk_{table.replace('.', '_')}_{key:08x}"
+
+
+def _identifier(name: str) -> sql.Composable:
+    return sql.Identifier(*name.split('.'))
+
+
+def copy_into_staging(cur, table: str, columns: Sequence[str], rows: Iterable[Sequence]) -> sql.Identifier:
+    """
+    create a temporary table with the column types of `table` and COPY rows into it, returns its identifier
+    """
+    staging = sql.Identifier(_staging_name(table, columns))
+    column_list = sql.SQL(', ').join(map(sql.Identifier, columns))
+    cur.execute(sql.SQL("CREATE TEMP TABLE IF NOT EXISTS {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA")
+                .format(staging, column_list, _identifier(table)))
+    cur.execute(sql.SQL("TRUNCATE {}").format(staging))
+    copy_sql = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(staging, column_list).as_string(cur)
+    rows = iter(rows)
+    while True:
+        chunk = [row for _, row in zip(range(COPY_CHUNK_ROWS), rows)]
+        if not chunk:
+            break
+        cur.copy_expert(copy_sql, _csv_buffer(chunk))
+    return staging
+
+
+def bulk_insert(cur, table: str, columns: Sequence[str], rows: Iterable[Sequence],
+                constants: Dict[str, str] = None, conflict_columns: Sequence[str] = None,
+                update_columns: Sequence[str] = None) -> int:
+    """
+    INSERT INTO table SELECT ... FROM staging, returns the number of inserted (or updated) rows.
+    constants:        {column: sql expression} filled in by the merge, e.g. {'scanned_at': 'CURRENT_TIMESTAMP'}
+    conflict_columns: adds ON CONFLICT (...), DO UPDATE of update_columns or DO NOTHING when update_columns is empty
+    """
+    constants = constants or {}
+    staging = copy_into_staging(cur, table, columns, rows)
+    target_columns = sql.SQL(', ').join(map(sql.Identifier, list(columns) + list(constants)))
+    select_list = sql.SQL(', ').join([sql.Identifier(c) for c in columns] + [sql.SQL(e) for e in constants.values()])
+    query = sql.SQL("INSERT INTO {} ({}) SELECT {} FROM {}").format(_identifier(table), target_columns, select_list, staging)
+    if conflict_columns:
+        query += sql.SQL(" ON CONFLICT ({})").format(sql.SQL(', ').join(map(sql.Identifier, conflict_columns)))
+        if update_columns:
+            query += sql.SQL(" DO UPDATE SET {}").format(sql.SQL(', ').join(
+                sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(c)) for c in update_columns))
+        else:
+            query += sql.SQL(" DO NOTHING")
+    cur.execute(query)
+    return cur.rowcount
+
+
+def bulk_update(cur, table: str, key_column: str, columns: Sequence[str], rows: Iterable[Sequence],
+                assignments: Dict[str, str] = None, where: str = None) -> int:
+    """
+    UPDATE table t SET ... FROM staging s WHERE t.key_column = s.key_column, returns the number of updated rows.
+    columns includes key_column; every other column is assigned from s unless assignments gives its expression
+    (t. and s. refer to the target and the staging row), e.g. {'blake3': 'COALESCE(s.blake3, t.blake3)'}.
+    where: extra condition, e.g. 't.deleted = 0'
+    """
+    assignments = dict(assignments or {})
+    for c in columns:
+        if c != key_column:
+            assignments.setdefault(c, f's.{c}')
+    staging = copy_into_staging(cur, table, columns, rows)
+    query = sql.SQL("UPDATE {} AS t SET {} FROM {} AS s WHERE t.{} = s.{}").format(
+        _identifier(table),
+        sql.SQL(', ').join(sql.SQL("{} = ").format(sql.Identifier(c)) + sql.SQL(e) for c, e in assignments.items()),
+        staging, sql.Identifier(key_column), sql.Identifier(key_column))
+    if where:
+        query += sql.SQL(" AND ") + sql.SQL(where)
+    cur.execute(query)
+    return cur.rowcount
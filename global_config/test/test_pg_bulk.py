@@ -0,0 +1,52 @@
+import csv
+import datetime
+from decimal import Decimal
+
+from psycopg2.extras import Json
+
+from global_config.pg_bulk import _csv_buffer, _csv_value
+
+PATHS = [
+    '/media/disk1/a,b.mp4',
+    '/media/disk1/say "hi".mkv',
+    '/media/disk1/line\nbreak.txt',
+    '/media/disk1/cr\r\nlf.txt',
+    'C:\\Users\\x\\file.txt',
+    '/media/disk1/\\N',
+    '/media/disk1/视频/字幕 ä é.srt',
+    '/media/disk1/emoji 🎬.mp4',
+    '',
+    ' ',
+]
+
+
+def test_null_and_empty_string_differ():
+    # csv COPY reads an unquoted empty field as NULL and a quoted one as ''
+    assert _csv_value(None) == ''
+    assert _csv_value('') == '""'
+    assert _csv_buffer([(None, '', 'x')]).getvalue() == ',"","x"\n'
+
+
+def test_scalars():
+    assert _csv_value(True) == 't' and _csv_value(False) == 'f'
+    assert _csv_value(0) == '0' and _csv_value(-5) == '-5' and _csv_value(2 ** 63 - 1) == str(2 ** 63 - 1)
+    assert _csv_value(1.5) == '1.5' and _csv_value(Decimal('0.10')) == '0.10'
+    assert _csv_value(datetime.datetime(2025, 1, 2, 3, 4, 5)) == '"2025-01-02T03:04:05"'
+    assert _csv_value(b'\x00\xff') == '"\\x00ff"'
+    assert _csv_value({'a': '视频'}) == '"{""a"": ""视频""}"'
+    assert _csv_value(Json([1, 'x'])) == '"[1, ""x""]"'
+
+
+def test_paths_round_trip():
+    rows = [(i, path, None) for i, path in enumerate(PATHS)]
+    buf = _csv_buffer(rows)
+    # the same rules as postgres csv: quotes doubled, delimiters and newlines kept inside quotes,
+    # backslashes are not escapes
+    parsed = list(csv.reader(buf, strict=True))
+    assert parsed == [[str(i), path, ''] for i, path in enumerate(PATHS)]
+
+
+def test_one_line_per_row_outside_quotes():
+    buf = _csv_buffer([('a\nb', 1), ('c', None)])
+    assert buf.getvalue() == '"a\nb",1\n"c",\n'
+    assert buf.tell() == 0